@@ -1,9 +1,18 @@
 ﻿# This Python file uses the following encoding: utf-8
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.models import User
+from django.db import transaction
 from models import UserProfile, FacebookProfile, Album, Layout, Page, PageContent, Country, State, \
-        Address, ShoppingCartItem, Order, SPSPayment, OrderStatus, OrderItem
+        Address, ShoppingCartItem, Order, SPSPayment, OrderStatus, OrderItem, OrderStatusChange, FulfilmentTask, \
+        ALBUM_SEARCH_INDEX
+
+
+
+
+# Maximum number of albums found when searching them in the admin site
+ALBUM_ADMIN_SEARCH_RESULT_LIMIT = 1000
 
 
 
@@ -14,6 +23,7 @@ class UserProfileAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'user__first_name', 'user__last_name')
     date_hierarchy = 'serviceConditionsAccepted'
     raw_id_fields = ('user',)
+    readonly_fields = ('cartVersion',)
 
 
 
@@ -27,18 +37,40 @@ class FacebookProfileAdmin(admin.ModelAdmin):
 
 
 
+class AlbumSearchChangeList(ChangeList):
+    """ Change list of albums, which finds the albums matching the search criteria from the search index. """
+    def get_query_set(self):
+        query = self.query
+        if not query or not ALBUM_SEARCH_INDEX.is_enabled():
+            return super(AlbumSearchChangeList, self).get_query_set()
+
+        self.query = ""
+        try:
+            queryset = super(AlbumSearchChangeList, self).get_query_set()
+        finally:
+            self.query = query
+        results = ALBUM_SEARCH_INDEX.search(query, include_private = True, how_many = ALBUM_ADMIN_SEARCH_RESULT_LIMIT)
+        return queryset.filter(pk__in = [album_id for (album_id, score) in results])
+
+
+
+
 class AlbumAdmin(admin.ModelAdmin):
     list_display = ('title', 'owning_customer', 'creationDate', 'isPublic', 'description')
     list_filter = ('isPublic',)
     search_fields = ('title', 'owner__username', 'owner__first_name', 'owner__last_name', 'description')
     date_hierarchy = 'creationDate'
     raw_id_fields = ('owner',)
+    readonly_fields = ('coverContent', 'coverRenditions', 'pageCount', 'unitPrice')
 
     def owning_customer(self, obj):
         return obj.owner
     owning_customer.short_description = 'owning user'
     owning_customer.admin_order_field = 'owner'
 
+    def get_changelist(self, request, **kwargs):
+        return AlbumSearchChangeList
+
 
 
 
@@ -53,13 +85,15 @@ class PageAdmin(admin.ModelAdmin):
     list_display = ('album', 'pageNumber', 'layout')
     search_fields = ('album__title',)
     raw_id_fields = ('album',)
+    readonly_fields = ('coverContent', 'coverRenditions')
 
 
 
 
 class PageContentAdmin(admin.ModelAdmin):
-    list_display = ('page', 'placeHolderID', 'content')
+    list_display = ('page', 'placeHolderID', 'kind', 'slot', 'content')
     raw_id_fields = ('page',)
+    readonly_fields = ('imageRenditionStatus', 'imageRenditions')
 
 
 
@@ -98,12 +132,55 @@ class ShoppingCartItemAdmin(admin.ModelAdmin):
 
 
 
+class OrderStatusChangeInline(admin.TabularInline):
+    model = OrderStatusChange
+    fields = ('changeDate', 'status', 'actor', 'clarification')
+    readonly_fields = ('changeDate', 'status', 'actor', 'clarification')
+    extra = 0
+    can_delete = False
+
+
+
+
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('orderer', 'purchaseDate', 'status')
+    list_display = ('orderer', 'purchaseDate', 'status', 'totalPrice')
     list_filter = ('status',)
     search_fields = ('customer__username',)
     date_hierarchy = 'purchaseDate'
     raw_id_fields = ('orderer',)
+    readonly_fields = ('totalPrice', 'priceSnapshot')
+    inlines = (OrderStatusChangeInline,)
+
+    @transaction.commit_on_success
+    def save_model(self, request, obj, form, change):
+        """ 
+            Changes the status of orders so that it gets recorded into their history. New orders start
+            from the ordered status like the ones made by users. Everything is saved in a single transaction.
+        """
+        if change and not 'status' in form.changed_data:
+            obj.save()
+            return
+
+        new_status = obj.status
+        if change:
+            obj.status_id = form.initial['status']
+        else:
+            obj.status = OrderStatus.ordered()
+        obj.save()
+        if not change:
+            OrderStatusChange(order = obj, status = obj.status, actor = request.user.username).save()
+            if new_status.pk == obj.status_id:
+                return
+        obj._change_status(new_status, request.user.username, obj.statusClarification)
+
+
+
+
+class FulfilmentTaskAdmin(admin.ModelAdmin):
+    list_display = ('order', 'availableDate', 'claimedBy', 'attempts')
+    search_fields = ('order__orderer__username', 'claimedBy')
+    raw_id_fields = ('order',)
+    readonly_fields = ('claimToken',)
 
 
 
@@ -125,7 +202,7 @@ class OrderStatusAdmin(admin.ModelAdmin):
 
 
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ('album', 'count', 'order', 'date_of_order')
+    list_display = ('album', 'count', 'unitPrice', 'order', 'date_of_order')
     search_fields = ('order__orderer__username', 'album__title')
 
     def date_of_order(self, obj):
@@ -149,5 +226,6 @@ admin.site.register(ShoppingCartItem, ShoppingCartItemAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(SPSPayment, SPSPaymentAdmin)
 admin.site.register(OrderStatus, OrderStatusAdmin)
+admin.site.register(FulfilmentTask, FulfilmentTaskAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
 
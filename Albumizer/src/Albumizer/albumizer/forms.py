@@ -5,10 +5,14 @@ from django import forms
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.forms.forms import BoundField, NON_FIELD_ERRORS
+from django.forms.models import ModelChoiceIterator
 from django.forms.util import ErrorList, ErrorDict
 from django.forms.widgets import Input
 from django.forms import ModelForm
-from models import UserProfile, Album, Layout, Country, State, Address, ShoppingCartItem
+from django.core.validators import EMPTY_VALUES
+from django.utils.crypto import constant_time_compare
+from models import UserProfile, Album, Address, ShoppingCartItem, LAYOUT_TABLE, COUNTRY_TABLE, STATE_TABLE, \
+                   CHECKOUT_STEP_DELIVERY_ADDRESSES
 
 
 
@@ -32,6 +36,49 @@ class AlbumizerURLInput(Input):
 
 
 
+class LookupTableChoiceIterator(ModelChoiceIterator):
+    """ Iterates through the choices of a LookupTableChoiceField without querying the database. """
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield (u"", self.field.empty_label)
+        for obj in self.field.lookup_table.all():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.lookup_table.all())
+
+
+
+
+class LookupTableChoiceField(forms.ModelChoiceField):
+    """ 
+        Model choice field, which reads its choices from a LookupTable (see lookups.py)
+        instead of querying them from the database every time the form is used.
+    """
+
+    def __init__(self, lookup_table, *args, **kwargs):
+        self.lookup_table = lookup_table
+        super(LookupTableChoiceField, self).__init__(lookup_table.model.objects.all(), *args, **kwargs)
+
+    def _get_choices(self):
+        if hasattr(self, '_choices'):
+            return self._choices
+        return LookupTableChoiceIterator(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def to_python(self, value):
+        if value in EMPTY_VALUES:
+            return None
+        try:
+            return self.lookup_table.by_pk(self.lookup_table.model._meta.pk.to_python(value))
+        except (ValidationError, self.lookup_table.model.DoesNotExist):
+            raise ValidationError(self.error_messages['invalid_choice'])
+
+
+
+
 class AlbumizerTelInput(Input):
     """ Input widget for telephone numbers with type according to html5. """
     input_type = 'tel'
@@ -319,7 +366,7 @@ class UserProfileForm(CommonAlbumizerBaseForm, ModelForm):
     )
     class Meta:
         model = UserProfile
-        exclude = ('user',)
+        exclude = ('user', 'cartVersion')
 
 class AddressModelForm(CommonAlbumizerBaseForm, ModelForm):
     class Meta:
@@ -603,16 +650,16 @@ class AddressForm(CommonAlbumizerForm):
         label = u"City",
         help_text = u"e.g. \"Tampere\" or \"Stockholm\" (max. 50 characters)"
     )
-    cmbState = forms.ModelChoiceField(
+    cmbState = LookupTableChoiceField(
+        STATE_TABLE,
         required = False,
-        queryset = State.objects.all(),
         widget = forms.Select(),
         label = u"State",
         help_text = u"only for customers from USA, Australia and Brazil"
     )
-    cmbCountry = forms.ModelChoiceField(
+    cmbCountry = LookupTableChoiceField(
+        COUNTRY_TABLE,
         required = False,
-        queryset = Country.objects.all(),
         widget = forms.Select(),
         label = u"Country"
     )
@@ -753,18 +800,13 @@ class LoginForm(CommonAlbumizerForm):
 
 class AddPageForm(CommonAlbumizerForm):
     """  """
-    chcPageLayout = forms.ModelChoiceField(
-        queryset = '',
+    chcPageLayout = LookupTableChoiceField(
+        LAYOUT_TABLE,
         empty_label = None,
         label = u'Layout',
         help_text = u'Select layout for page'
     )
 
-    def __init__(self, *args, **kwargs):
-        super(AddPageForm, self).__init__(*args, **kwargs)
-        layouts = Layout.objects.all()
-        self.fields['chcPageLayout'].queryset = layouts
-
 
 
 
@@ -786,8 +828,51 @@ class EditPageForm(CommonAlbumizerForm):
 
 
 
+class AlbumSearchForm(CommonAlbumizerForm):
+    """ Form class representing album search form. """
+    txtSearchCriteria = forms.CharField(
+        label = u"Search albums",
+        max_length = 255,
+        widget = AlbumizerSearchCriteriaInput(attrs = {
+            'size':'50',
+            'required': 'required',
+            'placeholder': u"Words in titles, descriptions, captions or usernames"
+        })
+    )
+
+
+
+
 class DeliveryAddressChoiceField(forms.ModelChoiceField):
+    """ 
+        Model choice field offering addresses, which have been loaded beforehand, instead of querying
+        them from the database. Several fields can share the same addresses and choices, so that the
+        labels of the addresses are rendered only once however many fields there are in a form.
+    """
+
+    def __init__(self, addresses_by_pk, address_choices, *args, **kwargs):
+        self.addresses_by_pk = addresses_by_pk
+        super(DeliveryAddressChoiceField, self).__init__(Address.objects.none(), *args, **kwargs)
+        self.choices = address_choices
+
+    @staticmethod
+    def choices_of_addresses(addresses):
+        """ Returns a list of choices for given addresses, which can be shared by several fields. """
+        return [(address.pk, DeliveryAddressChoiceField.label_of_address(address)) for address in addresses]
+
+    def to_python(self, value):
+        if value in EMPTY_VALUES:
+            return None
+        try:
+            return self.addresses_by_pk[Address._meta.pk.to_python(value)]
+        except (ValidationError, KeyError):
+            raise ValidationError(self.error_messages['invalid_choice'])
+
     def label_from_instance(self, obj):
+        return DeliveryAddressChoiceField.label_of_address(obj)
+
+    @staticmethod
+    def label_of_address(obj):
         label = u"%s %s" % (obj.owner.first_name, obj.owner.last_name)
 
         if obj.postAddressLine1:
@@ -822,11 +907,11 @@ def build_delivery_address_form(request):
 
     def has_items(self):
         """ Returns True if there are items which to choose addresses for. """
-        return self.__items.exists()
+        return bool(self.__items_by_id)
 
     def has_addresses(self):
         """ Returns True if there are addresses which to choose from. """
-        return self.__addresses.exists()
+        return bool(self.__addresses_by_pk)
 
     def get_address_fields(self):
         """ Iterates through all address field_dict in form. """
@@ -836,19 +921,21 @@ def build_delivery_address_form(request):
     def get_item_address_pairs(self):
         """ Iterates through all (order items / address) pairs displayed on the form. """
         for field_name in self.__address_fields:
-            yield (self.__items.get(id__exact = field_name.split("_")[1]),
+            yield (self.__items_by_id[int(field_name.split("_")[1])],
                    self.cleaned_data.get(field_name))
 
     def clean_hdnValidationHash(self):
-        """ Ensures that the validation hash gotten from sent form is correct. """
-        given_hash = self.cleaned_data.get("hdnValidationHash")
-        our_hash = ShoppingCartItem.validation_hash_for_shopping_cart(request)
-        if not given_hash == our_hash:
+        """ Ensures that the checkout token gotten from sent form is correct. """
+        given_hash = self.cleaned_data.get("hdnValidationHash") or ""
+        if not constant_time_compare(given_hash.encode("ascii", "replace"), validation_hash):
             self.add_common_error(CHECKOUT_ERR_MSG_INVALID_HASH)
 
-    items = ShoppingCartItem.items_of_user_with_albums_and_addresses(request.user)
-    addresses = Address.addresses_of_user(request.user)
-    validation_hash = ShoppingCartItem.validation_hash_for_shopping_cart(request)
+    items = ShoppingCartItem.items_of_user_with_albums(request.user)
+    addresses = list(Address.addresses_of_user_with_owners_and_regions(request.user))
+    address_choices = DeliveryAddressChoiceField.choices_of_addresses(addresses)
+    addresses_by_pk = dict([(address.pk, address) for address in addresses])
+    items_by_id = {}
+    validation_hash = ShoppingCartItem.checkout_token(request.user, CHECKOUT_STEP_DELIVERY_ADDRESSES)
 
     field_dict = {}
     address_field_dict = {}
@@ -861,22 +948,24 @@ def build_delivery_address_form(request):
 
     for item in items:
         field_name = u"cmbAddress_" + unicode(item.id)
+        items_by_id[item.id] = item
 
         new_field = DeliveryAddressChoiceField(
-            queryset = addresses,
+            addresses_by_pk,
+            address_choices,
             empty_label = None,
             label = item.album.title
         )
         field_dict[field_name] = new_field
         address_field_dict[field_name] = new_field
 
-        if item.deliveryAddress:
-            initial_value_dict[field_name] = item.deliveryAddress
+        if item.deliveryAddress_id:
+            initial_value_dict[field_name] = item.deliveryAddress_id
 
     members = {
         "__request": request,
-        "__items": items,
-        "__addresses": addresses,
+        "__items_by_id": items_by_id,
+        "__addresses_by_pk": addresses_by_pk,
         "__validation_hash": validation_hash,
         "base_fields": field_dict,
         "__address_fields": address_field_dict,
@@ -0,0 +1,383 @@
+﻿# This Python file uses the following encoding: utf-8
+
+import hashlib, time
+from array import array
+from bisect import bisect_left
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.loading import get_model
+from django.db.models.signals import post_delete, post_init, post_save
+
+
+
+
+LOOKUP_TABLE_VERSION_CHECK_INTERVAL = 5     # seconds
+
+# Number of the latest changes of an IdIndex kept in the database for other processes to apply,
+# and the interval in versions, at which the older ones are deleted
+LOOKUP_CHANGE_HISTORY_LENGTH = 1000
+LOOKUP_CHANGE_PRUNING_INTERVAL = 100
+
+_existing_lookup_tables = set()
+
+
+
+
+def _lookup_model(model_name):
+    """
+        Returns the model of given name storing the versions or changes of the cached content, like
+        LookupVersion, or None if its table has not been created yet, like when migrations preceding
+        the one creating it load fixtures. The models are looked up only when needed, as the models
+        module imports this one.
+    """
+    model = get_model("albumizer", model_name)
+    if model._meta.db_table not in _existing_lookup_tables:
+        if model._meta.db_table not in connection.introspection.table_names():
+            return None
+        _existing_lookup_tables.add(model._meta.db_table)
+    return model
+
+
+
+
+def _atomically(function, *args):
+    """
+        Calls given function in the current transaction, or in a transaction of its own if none is
+        being managed, so that no other process can increment a version between incrementing and
+        reading it.
+    """
+    if transaction.is_managed():
+        return function(*args)
+    return transaction.commit_on_success(function)(*args)
+
+
+
+
+class VersionedProcessCache(object):
+    """
+        Base class for process-local caches of database content. The content is loaded with
+        _load() when needed and served from memory after that.
+
+        Saving or deleting a row of the model through the ORM (e.g. in the admin site or when loading
+        fixtures) increments the version of the content stored into a LookupVersion row, which all
+        processes share through the database. Other processes notice the new version within
+        LOOKUP_TABLE_VERSION_CHECK_INTERVAL seconds and load the content again, unless the
+        subclass is able to update it with _changed_contents().
+        QuerySet.update() sends no signals, so invalidate() must be called after using it.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._contents = None
+        self._version = None
+        self._version_checked_at = 0
+
+        dispatch_uid = "albumizer-lookups-%s-%s" % (self.__class__.__name__, model._meta.db_table)
+        post_save.connect(self._model_changed, sender = model, dispatch_uid = dispatch_uid + "-save", weak = False)
+        post_delete.connect(self._model_changed, sender = model, dispatch_uid = dispatch_uid + "-delete", weak = False)
+
+    def _version_name(self):
+        return "%s-%s" % (self.__class__.__name__, self.model._meta.db_table)
+
+    def _current_version(self):
+        """
+            Returns the version of the content stored into the database, 0 if the content has never been
+            changed, or None if versions cannot be stored yet.
+        """
+        version_model = _lookup_model("LookupVersion")
+        if version_model is None:
+            return None
+        versions = version_model.objects.filter(name = self._version_name()).values_list("version", flat = True)
+        return versions[0] if versions else 0
+
+    def _new_version(self):
+        """
+            Increments the version of the content stored into the database and returns the new version.
+        """
+        return _atomically(self._increment_version)
+
+    def _increment_version(self):
+        version_model = _lookup_model("LookupVersion")
+        if version_model is None:
+            return None
+        versions = version_model.objects.filter(name = self._version_name())
+        if not versions.update(version = F("version") + 1):
+            version_model.objects.get_or_create(name = self._version_name())
+            versions.update(version = F("version") + 1)
+        return self._current_version()
+
+    def _load(self):
+        """
+            Loads the content from the database. Must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def _changed_contents(self, contents, old_version, new_version):
+        """
+            Returns given content updated from given old version to given new one, or None if the content
+            has to be loaded again, which is always the case unless overridden by a subclass.
+        """
+        return None
+
+    def _model_changed(self, sender, instance, signal, **kwargs):
+        """
+            Event handler called whenever a row of the model is saved or deleted.
+        """
+        self.invalidate()
+
+    def invalidate(self):
+        """
+            Makes all processes load the content again.
+        """
+        self._new_version()
+        self._contents = None
+
+    def check_version(self):
+        """
+            Makes this process check the version of the content the next time it is used, instead of
+            within LOOKUP_TABLE_VERSION_CHECK_INTERVAL seconds.
+        """
+        self._version_checked_at = 0
+
+    def _get_contents(self):
+        """
+            Returns the content, loading it if this process does not have the current version. Content
+            loaded inside a transaction having uncommitted changes is not kept for later use.
+        """
+        contents = self._contents
+        now = time.time()
+        if contents is not None and now - self._version_checked_at < LOOKUP_TABLE_VERSION_CHECK_INTERVAL:
+            return contents
+
+        version = self._current_version()
+        if contents is not None and self._version != version:
+            contents = self._changed_contents(contents, self._version, version)
+        if contents is None or self._version != version:
+            if contents is None:
+                contents = self._load()
+            if transaction.is_managed() and transaction.is_dirty():
+                # changes made in the current transaction may still be rolled back, so the content
+                # seeing them is not kept for later use
+                return contents
+            self._contents = contents
+            self._version = version
+        self._version_checked_at = now
+        return contents
+
+
+
+
+class LookupTable(VersionedProcessCache):
+    """
+        Process-local cache of all rows of a small reference table, which changes only when
+        administrators edit it, like OrderStatus or Country. After the rows have been loaded
+        with a single query, lookups are served from memory.
+    """
+
+    def __init__(self, model, key_field_name = None):
+        super(LookupTable, self).__init__(model)
+        self.key_field_name = key_field_name or model._meta.pk.name
+
+    def _load(self):
+        """
+            Returns a tuple of a list of all rows and dictionaries of them by their keys and primary keys.
+        """
+        rows = list(self.model.objects.all())
+        return (rows,
+                dict([(getattr(row, self.key_field_name), row) for row in rows]),
+                dict([(row.pk, row) for row in rows]))
+
+    def all(self):
+        """
+            Returns a list of all rows in the default order of the model.
+        """
+        return self._get_contents()[0]
+
+    def get(self, key):
+        """
+            Returns the row having given key. If there is none, raises DoesNotExist of the model.
+        """
+        try:
+            return self._get_contents()[1][key]
+        except KeyError:
+            raise self.model.DoesNotExist("%s having %s %s does not exist." %
+                                          (self.model._meta.object_name, self.key_field_name, key))
+
+    def by_pk(self, pk):
+        """
+            Returns the row having given primary key. If there is none, raises DoesNotExist of the model.
+        """
+        try:
+            return self._get_contents()[2][pk]
+        except KeyError:
+            raise self.model.DoesNotExist("%s having primary key %s does not exist." %
+                                          (self.model._meta.object_name, pk))
+
+
+
+
+class CompiledStylesheet(VersionedProcessCache):
+    """
+        Process-local stylesheet compiled from the CSS stored into rows of a model, like the ones of
+        page layouts. The stylesheet is versioned with a hash of its content, so that it can be served
+        from an url containing the hash and cached for good. Editing any row changes the hash.
+    """
+
+    def __init__(self, model, css_field_name):
+        super(CompiledStylesheet, self).__init__(model)
+        self.css_field_name = css_field_name
+
+    def _load(self):
+        """
+            Returns a tuple of the compiled stylesheet and a hash of it.
+        """
+        rows = self.model.objects.order_by("pk").values_list("pk", self.css_field_name)
+        css = u"\n\n".join([u"/* %s %s */\n%s" % (self.model._meta.object_name, pk, content.strip())
+                             for (pk, content) in rows])
+        css = css.encode("utf-8")
+        return (css, hashlib.sha1(css).hexdigest()[:12])
+
+    def css(self):
+        """
+            Returns the compiled stylesheet as an utf-8 encoded string.
+        """
+        return self._get_contents()[0]
+
+    def version_hash(self):
+        """
+            Returns a hash of the content of the compiled stylesheet.
+        """
+        return self._get_contents()[1]
+
+
+
+
+class IdIndex(VersionedProcessCache):
+    """
+        Process-local, sorted array of the primary keys of the rows matching given field values,
+        like the ids of public albums. Takes a few bytes per row, and lets e.g. random rows
+        be picked without querying the database.
+
+        Saving a row, which neither joins nor leaves the index, changes nothing. When a row joins or
+        leaves it, the change is recorded into a LookupChange row along with a new version, and the
+        array is updated incrementally both in this process and in the other ones, which apply the
+        changes recorded since the version they have instead of loading the whole array again.
+    """
+
+    def __init__(self, model, **field_values):
+        super(IdIndex, self).__init__(model)
+        self.field_values = field_values
+        self._field_attnames = [model._meta.get_field(field_name).attname for field_name in field_values]
+        self._indexed_attname = "_indexed_by_%s" % "_".join(sorted(field_values))
+        post_init.connect(self._model_initialized, sender = model,
+                          dispatch_uid = "albumizer-lookups-%s-%s-init" % (self.__class__.__name__, model._meta.db_table),
+                          weak = False)
+
+    def _load(self):
+        ids = self.model.objects.filter(**self.field_values).order_by("pk").values_list("pk", flat = True)
+        return array("l", ids)
+
+    def _is_indexed(self, instance):
+        for (field_name, value) in self.field_values.items():
+            if getattr(instance, field_name) != value:
+                return False
+        return True
+
+    def _model_initialized(self, sender, instance, **kwargs):
+        """
+            Event handler remembering whether a row belonged to the index, when it was loaded or created.
+            If the fields of the index have not been loaded, it is not known.
+        """
+        for attname in self._field_attnames:
+            if attname not in instance.__dict__:
+                return
+        setattr(instance, self._indexed_attname, self._is_indexed(instance))
+
+    def _model_changed(self, sender, instance, signal, created = False, **kwargs):
+        was_indexed = False if created else getattr(instance, self._indexed_attname, None)
+        should_be_indexed = signal is post_save and self._is_indexed(instance)
+        setattr(instance, self._indexed_attname, should_be_indexed)
+        if was_indexed == should_be_indexed:
+            return
+
+        if transaction.is_managed():
+            # the change may still be rolled back along with the transaction of the caller, so the array
+            # in memory is left as it is, and the change is loaded like the ones of other processes
+            self._record_change(instance.pk, should_be_indexed)
+            self.check_version()
+            return
+
+        version = _atomically(self._record_change, instance.pk, should_be_indexed)
+        if version is None:
+            # changes cannot be recorded yet, so the array is simply loaded again
+            self._contents = None
+        elif self._contents is not None and self._version is not None and version == self._version + 1:
+            self._contents = self._apply_changes(self._contents, [(instance.pk, should_be_indexed)])
+            self._version = version
+        else:
+            # other processes have changed the rows, too, and their changes are applied along with this one
+            self.check_version()
+
+    def _record_change(self, object_id, is_added):
+        """
+            Increments the version of the index and records the change made in it. Returns the new version.
+        """
+        version = self._increment_version()
+        change_model = _lookup_model("LookupChange")
+        if version is None or change_model is None:
+            return version
+        change_model(name = self._version_name(), version = version, objectId = object_id, isAdded = is_added).save()
+        if version % LOOKUP_CHANGE_PRUNING_INTERVAL == 0:
+            change_model.objects.filter(name = self._version_name(),
+                                        version__lte = version - LOOKUP_CHANGE_HISTORY_LENGTH).delete()
+        return version
+
+    def _changed_contents(self, ids, old_version, new_version):
+        """
+            Returns given array of primary keys with the changes recorded after given old version applied,
+            or None if some of them are missing, e.g. because invalidate() has been called or the changes
+            are too old to be kept anymore.
+        """
+        change_model = _lookup_model("LookupChange")
+        if change_model is None or old_version is None or new_version is None or new_version < old_version:
+            return None
+        changes = list(change_model.objects.filter(name = self._version_name(), version__gt = old_version,
+                                                   version__lte = new_version)
+                                           .order_by("version").values_list("objectId", "isAdded"))
+        if len(changes) != new_version - old_version:
+            return None
+        return self._apply_changes(ids, changes)
+
+    def _apply_changes(self, ids, changes):
+        """
+            Returns a copy of given array of primary keys with given changes applied. changes is a list
+            of tuples of a primary key and whether the row joined the index or left it.
+        """
+        # A copy is modified, so that other threads never see a half-updated array
+        ids = array("l", ids)
+        for (object_id, is_added) in changes:
+            position = bisect_left(ids, object_id)
+            is_indexed = position < len(ids) and ids[position] == object_id
+            if is_added and not is_indexed:
+                ids.insert(position, object_id)
+            elif not is_added and is_indexed:
+                del ids[position]
+        return ids
+
+    def ids(self):
+        """
+            Returns the array of primary keys in ascending order. The array must not be modified.
+        """
+        return self._get_contents()
+
+    def __len__(self):
+        return len(self.ids())
+
+    def sample(self, how_many, randomizer):
+        """
+            Returns a list of at most how_many different primary keys picked uniformly at random
+            using given Random instance.
+        """
+        ids = self.ids()
+        how_many = min(how_many, len(ids))
+        return [ids[position] for position in randomizer.sample(xrange(len(ids)), how_many)]
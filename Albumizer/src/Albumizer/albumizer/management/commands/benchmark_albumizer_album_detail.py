@@ -0,0 +1,114 @@
+# This Python file uses the following encoding: utf-8
+
+import time
+from optparse import make_option
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import resolve
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from Albumizer.albumizer.models import Album, Layout, Page, PageContent
+
+
+
+
+def _create_album_with_pages(owner, layout, number_of_pages):
+    """
+        Creates a public album having given number of pages, each of which containing one image.
+        The image files themselves are not created, as showing the album needs only their urls.
+    """
+    album = Album(owner = owner, title = u"Benchmark album of %d pages" % number_of_pages, isPublic = True)
+    album.save()
+    for page_number in range(1, number_of_pages + 1):
+        page = Page(album = album, pageNumber = page_number, layout = layout)
+        page.save()
+        content = PageContent(page = page, placeHolderID = u"benchmark_image_1")
+        content.image.name = u"benchmark/page-%d.jpg" % page_number
+        content.save()
+    return album
+
+
+def _show_album(album):
+    """
+        Shows given album to an anonymous user the same way as the actual view does.
+        Returns the number of queries performed and the time used in seconds.
+    """
+    url = album.get_absolute_url()
+    request = RequestFactory().get(url)
+    request.user = AnonymousUser()
+    (view, view_args, view_kwargs) = resolve(url)
+
+    number_of_queries_before = len(connection.queries)
+    start_time = time.time()
+    response = view(request, *view_args, **view_kwargs)
+    elapsed_time = time.time() - start_time
+    if response.status_code != 200:
+        raise CommandError(u"Showing the album failed with status code %d." % response.status_code)
+
+    return (len(connection.queries) - number_of_queries_before, elapsed_time)
+
+
+
+
+class Command(BaseCommand):
+    """ Measures the number of queries and the time needed to show albums of different sizes. """
+    help = u"Measures the number of queries and the time needed to show albums having different numbers of pages. " + \
+           u"The albums are created inside a transaction, which is rolled back afterwards."
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option("--page-counts",
+            action = "store",
+            type = "string",
+            dest = "page_counts",
+            default = "10,100,500",
+            help = "Comma-separated list of page counts of the albums to be shown, default 10,100,500"),
+        make_option("--rounds",
+            action = "store",
+            type = "int",
+            dest = "rounds",
+            default = 10,
+            help = "Number of times each album is shown, default 10"),
+        )
+
+    def handle(self, *args, **options):
+        rounds = max(options.get("rounds"), 1)
+        try:
+            page_counts = [int(page_count) for page_count in options.get("page_counts").split(",")]
+        except ValueError:
+            raise CommandError(u"Page counts must be given as a comma-separated list of integers.")
+
+        layouts = Layout.objects.all()[:1]
+        if not layouts:
+            raise CommandError(u"No layouts were found. Please load the layouts fixture first.")
+
+        self.stdout.write(u"Showing each album %d time(s) to an anonymous user.\n\n" % rounds)
+        self.stdout.write(u"%8s %16s %16s %12s %12s\n" %
+                          (u"pages", u"queries (cold)", u"queries (warm)", u"ms (cold)", u"ms (warm)"))
+
+        connection.use_debug_cursor = True
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            owner = User.objects.create_user("albumizer-benchmark", "benchmark@example.com", "benchmark")
+            for page_count in page_counts:
+                album = _create_album_with_pages(owner, layouts[0], page_count)
+
+                # Covers are resolved lazily, so forget them to measure the first showing as well
+                Page.objects.filter(album = album).update(coverContent = None, coverRenditions = "")
+                Album.objects.filter(pk = album.pk).update(coverContent = None, coverRenditions = "")
+
+                (cold_queries, cold_time) = _show_album(album)
+                warm_queries = 0
+                warm_time = 0.0
+                for round_number in range(rounds):
+                    (queries, elapsed_time) = _show_album(album)
+                    warm_queries = max(warm_queries, queries)
+                    warm_time += elapsed_time
+
+                self.stdout.write(u"%8d %16d %16d %12.1f %12.1f\n" %
+                                  (page_count, cold_queries, warm_queries,
+                                   1000.0 * cold_time, 1000.0 * warm_time / rounds))
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
+            connection.use_debug_cursor = None
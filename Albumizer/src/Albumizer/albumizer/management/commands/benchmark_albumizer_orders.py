@@ -0,0 +1,174 @@
+# This Python file uses the following encoding: utf-8
+
+import multiprocessing, random, time
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+from Albumizer.albumizer.models import Album, Address, Layout, Order, OrderItem, Page, ShoppingCartItem
+
+
+
+
+BENCHMARK_USERNAME_PREFIX = "albumizer-order-benchmark-"
+NUMBER_OF_ALBUMS = 20
+
+
+
+
+def _delete_benchmark_users():
+    """ Deletes the users created by this benchmark, and thus also their albums, addresses and orders. """
+    for user in User.objects.filter(username__startswith = BENCHMARK_USERNAME_PREFIX):
+        user.delete()
+
+
+def _create_albums(layout):
+    """ Creates the albums to be ordered, each of them having a different number of pages. """
+    seller = User.objects.create_user(BENCHMARK_USERNAME_PREFIX + "seller", "seller@example.com", "benchmark")
+    album_ids = []
+    for album_number in range(NUMBER_OF_ALBUMS):
+        album = Album(owner = seller, title = u"Benchmark album %d" % album_number, isPublic = True)
+        album.save()
+        for page_number in range(1, album_number % 5 + 2):
+            Page(album = album, pageNumber = page_number, layout = layout).save()
+        album_ids.append(album.id)
+    return album_ids
+
+
+def _create_buyer(buyer_number):
+    """ Creates a user, who places orders in one of the processes, and his/her delivery address. """
+    buyer = User.objects.create_user(BENCHMARK_USERNAME_PREFIX + "buyer-%d" % buyer_number,
+                                     "buyer-%d@example.com" % buyer_number, "benchmark")
+    Address(owner = buyer, postAddressLine1 = u"Benchmark street %d" % buyer_number,
+            zipCode = u"00100", city = u"Helsinki").save()
+    return buyer.id
+
+
+def _place_orders(buyer_id, album_ids, number_of_orders, items_per_order, seed, results):
+    """
+        Places given number of orders as given user, filling the shopping cart before each of them.
+        Only placing the orders is timed. Puts a tuple of the elapsed times in seconds and the number
+        of failed orders into the results queue.
+    """
+    # every process needs a connection of its own
+    connection.close()
+    randomizer = random.Random(seed)
+    buyer = User.objects.get(pk = buyer_id)
+    address = Address.addresses_of_user(buyer)[0]
+
+    elapsed_times = []
+    number_of_failures = 0
+    for order_number in range(number_of_orders):
+        for album_id in randomizer.sample(album_ids, items_per_order):
+            ShoppingCartItem(user = buyer, album_id = album_id, count = randomizer.randint(1, 3),
+                             deliveryAddress = address).save()
+
+        start_time = time.time()
+        try:
+            Order.create_from_shopping_cart_for_user(buyer)
+        except DatabaseError:
+            number_of_failures += 1
+            ShoppingCartItem.remove_all_items_of_user(buyer)
+            continue
+        elapsed_times.append(time.time() - start_time)
+
+    connection.close()
+    results.put((elapsed_times, number_of_failures))
+
+
+def _percentile(sorted_values, percentage):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentage / 100.0))]
+
+
+
+
+class Command(BaseCommand):
+    """ Measures the latency and throughput of placing orders concurrently from several processes. """
+    help = u"Places orders concurrently from several processes against the configured database and measures " + \
+           u"their latency and throughput. The users, albums and orders created are deleted afterwards."
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option("--processes",
+            action = "store",
+            type = "int",
+            dest = "processes",
+            default = 4,
+            help = "Number of processes placing orders at the same time, default 4"),
+        make_option("--orders",
+            action = "store",
+            type = "int",
+            dest = "orders",
+            default = 2000,
+            help = "Total number of orders to be placed, default 2000"),
+        make_option("--items",
+            action = "store",
+            type = "int",
+            dest = "items",
+            default = 5,
+            help = "Number of different albums in each order, default 5"),
+        make_option("--seed",
+            action = "store",
+            type = "int",
+            dest = "seed",
+            default = 1,
+            help = "Seed of the random number generator, default 1"),
+        )
+
+    def handle(self, *args, **options):
+        number_of_processes = max(options.get("processes"), 1)
+        orders_per_process = max(options.get("orders") // number_of_processes, 1)
+        items_per_order = options.get("items")
+        if not 1 <= items_per_order <= NUMBER_OF_ALBUMS:
+            raise CommandError(u"The number of items must be between 1 and %d." % NUMBER_OF_ALBUMS)
+
+        layouts = Layout.objects.all()[:1]
+        if not layouts:
+            raise CommandError(u"No layouts were found. Please load the layouts fixture first.")
+
+        _delete_benchmark_users()
+        try:
+            album_ids = _create_albums(layouts[0])
+            buyer_ids = [_create_buyer(buyer_number) for buyer_number in range(number_of_processes)]
+
+            # the processes must not share the connection of this one
+            connection.close()
+            results = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target = _place_orders,
+                                                 args = (buyer_id, album_ids, orders_per_process, items_per_order,
+                                                         options.get("seed") + process_number, results))
+                         for (process_number, buyer_id) in enumerate(buyer_ids)]
+
+            start_time = time.time()
+            for process in processes:
+                process.start()
+            elapsed_times = []
+            number_of_failures = 0
+            for process in processes:
+                (process_elapsed_times, process_failures) = results.get()
+                elapsed_times.extend(process_elapsed_times)
+                number_of_failures += process_failures
+            for process in processes:
+                process.join()
+            total_time = time.time() - start_time
+
+            if not elapsed_times:
+                raise CommandError(u"All %d orders failed." % number_of_failures)
+            elapsed_times.sort()
+            self.stdout.write(u"Placed %d orders of %d items from %d processes in %.1f s, %.1f orders/s.\n" %
+                              (len(elapsed_times), items_per_order, number_of_processes, total_time,
+                               len(elapsed_times) / total_time))
+            self.stdout.write(u"Placing an order took %.2f ms at median, %.2f ms at 95%% and %.2f ms at most.\n" %
+                              (1000.0 * _percentile(elapsed_times, 50), 1000.0 * _percentile(elapsed_times, 95),
+                               1000.0 * elapsed_times[-1]))
+            self.stdout.write(u"%d orders failed.\n" % number_of_failures)
+
+            orders = Order.objects.filter(orderer__in = buyer_ids)
+            number_of_items = OrderItem.objects.filter(order__in = orders).count()
+            number_of_items_left = ShoppingCartItem.objects.filter(user__in = buyer_ids).count()
+            if orders.count() != len(elapsed_times) or number_of_items != len(elapsed_times) * items_per_order \
+                    or number_of_items_left:
+                raise CommandError(u"The database is inconsistent: %d orders, %d order items and %d cart items." %
+                                   (orders.count(), number_of_items, number_of_items_left))
+            self.stdout.write(u"All orders are complete and all shopping carts are empty.\n")
+        finally:
+            _delete_benchmark_users()
@@ -0,0 +1,151 @@
+# This Python file uses the following encoding: utf-8
+
+import bisect, os, random, shutil, tempfile, time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from Albumizer.albumizer.search import AlbumSearchIndex, SEARCH_WEIGHT_TITLE, SEARCH_WEIGHT_OWNER, \
+                                       SEARCH_WEIGHT_DESCRIPTION, SEARCH_WEIGHT_CAPTION
+
+
+
+
+VOCABULARY_SIZE = 50000
+ALBUMS_PER_OWNER = 10
+SAMPLED_ALBUM_INTERVAL = 1000
+
+
+
+
+class SyntheticAlbums(object):
+    """
+        Generates albums having random titles, descriptions and captions. The words are drawn from
+        a vocabulary following Zipf's law, so that a few words are very common and most are rare,
+        as in real texts.
+    """
+
+    def __init__(self, number_of_albums, randomizer):
+        self.number_of_albums = number_of_albums
+        self.randomizer = randomizer
+        self.words = [u"word%d" % index for index in range(VOCABULARY_SIZE)]
+        self._cumulative_weights = []
+        total_weight = 0.0
+        for rank in range(1, VOCABULARY_SIZE + 1):
+            total_weight += 1.0 / rank
+            self._cumulative_weights.append(total_weight)
+        self.sampled_albums = []
+
+    def random_word(self):
+        position = self.randomizer.random() * self._cumulative_weights[-1]
+        return self.words[bisect.bisect_left(self._cumulative_weights, position)]
+
+    def _text(self, min_words, max_words):
+        return u" ".join([self.random_word() for index in range(self.randomizer.randint(min_words, max_words))])
+
+    def album(self, album_id):
+        owner_id = album_id // ALBUMS_PER_OWNER + 1
+        weighted_texts = [(self._text(2, 5), SEARCH_WEIGHT_TITLE),
+                          (u"user%d" % owner_id, SEARCH_WEIGHT_OWNER),
+                          (self._text(0, 8), SEARCH_WEIGHT_DESCRIPTION)]
+        for caption_number in range(self.randomizer.randint(0, 3)):
+            weighted_texts.append((self._text(2, 6), SEARCH_WEIGHT_CAPTION))
+        return (album_id, owner_id, u"user%d" % owner_id, self.randomizer.random() < 0.9, weighted_texts)
+
+    def __iter__(self):
+        for album_id in range(1, self.number_of_albums + 1):
+            album = self.album(album_id)
+            if album_id % SAMPLED_ALBUM_INTERVAL == 0:
+                self.sampled_albums.append(album)
+            yield album
+
+
+
+
+def _percentile(sorted_values, percentage):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentage / 100.0))]
+
+
+
+
+class Command(BaseCommand):
+    """ Measures the latency of searching albums from a search index containing a large number of albums. """
+    help = u"Builds a search index of synthetic albums into a temporary directory and measures the latency " + \
+           u"of searching them and of updating single albums. The actual database and search index are not touched."
+    requires_model_validation = False
+    option_list = BaseCommand.option_list + (
+        make_option("--albums",
+            action = "store",
+            type = "int",
+            dest = "albums",
+            default = 1000000,
+            help = "Number of synthetic albums in the index, default 1000000"),
+        make_option("--queries",
+            action = "store",
+            type = "int",
+            dest = "queries",
+            default = 300,
+            help = "Number of searches made of each number of words, default 300"),
+        make_option("--seed",
+            action = "store",
+            type = "int",
+            dest = "seed",
+            default = 1,
+            help = "Seed of the random number generator, default 1"),
+        )
+
+    def handle(self, *args, **options):
+        number_of_albums = options.get("albums")
+        number_of_queries = max(options.get("queries"), 1)
+        if number_of_albums < SAMPLED_ALBUM_INTERVAL:
+            raise CommandError(u"At least %d albums are needed." % SAMPLED_ALBUM_INTERVAL)
+        randomizer = random.Random(options.get("seed"))
+
+        directory = tempfile.mkdtemp(prefix = "albumizer-search-benchmark-")
+        try:
+            index = AlbumSearchIndex(os.path.join(directory, "search-index.sqlite3"))
+            albums = SyntheticAlbums(number_of_albums, randomizer)
+
+            start_time = time.time()
+            index.rebuild(albums)
+            self.stdout.write(u"Built an index of %d albums in %.1f s, %.1f MB on disk.\n\n" %
+                              (number_of_albums, time.time() - start_time,
+                               os.path.getsize(index.path) / 1024.0 / 1024.0))
+
+            self.stdout.write(u"%-28s %10s %10s %10s %10s\n" %
+                              (u"search", u"median ms", u"95% ms", u"max ms", u"results"))
+            for number_of_words in (1, 2, 3):
+                for (description, from_albums) in ((u"random words", False), (u"words of one album", True)):
+                    elapsed_times = []
+                    number_of_results = 0
+                    for query_number in range(number_of_queries):
+                        if from_albums:
+                            (album_id, owner_id, owner_name, is_public, weighted_texts) = \
+                                    randomizer.choice(albums.sampled_albums)
+                            words = u" ".join([text for (text, weight) in weighted_texts]).split()
+                            query = u" ".join(randomizer.sample(words, min(number_of_words, len(words))))
+                        else:
+                            query = u" ".join([albums.random_word() for word_number in range(number_of_words)])
+                        user_id = randomizer.randint(1, number_of_albums // ALBUMS_PER_OWNER)
+
+                        start_time = time.time()
+                        results = index.search(query, user_id, how_many = 20)
+                        elapsed_times.append(1000.0 * (time.time() - start_time))
+                        number_of_results += len(results)
+
+                    elapsed_times.sort()
+                    self.stdout.write(u"%d word(s), %-18s %10.2f %10.2f %10.2f %10.1f\n" %
+                                      (number_of_words, description, _percentile(elapsed_times, 50),
+                                       _percentile(elapsed_times, 95), elapsed_times[-1],
+                                       float(number_of_results) / number_of_queries))
+
+            elapsed_times = []
+            for update_number in range(number_of_queries):
+                album = albums.album(randomizer.randint(1, number_of_albums))
+                start_time = time.time()
+                index.update_album(*album)
+                elapsed_times.append(1000.0 * (time.time() - start_time))
+            elapsed_times.sort()
+            self.stdout.write(u"%-28s %10.2f %10.2f %10.2f\n" %
+                              (u"updating one album", _percentile(elapsed_times, 50),
+                               _percentile(elapsed_times, 95), elapsed_times[-1]))
+        finally:
+            shutil.rmtree(directory, ignore_errors = True)
@@ -0,0 +1,148 @@
+# This Python file uses the following encoding: utf-8
+
+import multiprocessing, os, resource, shutil, tempfile, time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from Albumizer.albumizer.models import PageContent
+from Albumizer.albumizer.renditions import create_renditions
+import Image
+
+
+
+
+ACCEPTED_IMAGE_FILE_EXTENSIONS = ["jpg", "jpeg"]
+
+
+
+
+def create_renditions_the_legacy_way(source_path, rendition_specs):
+    """
+        Creates renditions like AlbumizerImageFieldFile._create_thumbnail() used to do, i.e. by opening
+        and scaling the full-sized original separately for each rendition.
+    """
+    for (rendition, target_path) in rendition_specs:
+        thumbnail_image = Image.open(source_path)
+        if thumbnail_image.mode not in ("RGB", "L"):
+            thumbnail_image = thumbnail_image.convert("RGB")
+        thumbnail_image.thumbnail((rendition.width, rendition.height), Image.ANTIALIAS)
+        thumbnail_image.save(target_path, rendition.format, **rendition.save_options())
+    return True
+
+
+BENCHMARKED_IMPLEMENTATIONS = [
+    ("legacy", create_renditions_the_legacy_way),
+    ("cascaded", create_renditions),
+]
+
+
+
+
+def _run_implementation(implementation, image_paths, renditions, rounds, target_folder, result_connection):
+    """
+        Creates renditions of the given images and sends timings and memory usage back to the parent process.
+        Run in a separate process, so that the peak memory usage of different implementations can be compared.
+    """
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.time()
+
+    number_of_failures = 0
+    for round_number in range(rounds):
+        for (image_number, image_path) in enumerate(image_paths):
+            rendition_specs = [(rendition, os.path.join(target_folder, "%d.%s.%s" % \
+                                        (image_number, rendition.name, rendition.file_extension)))
+                               for rendition in renditions]
+            try:
+                if not implementation(image_path, rendition_specs):
+                    number_of_failures += 1
+            except Exception:
+                number_of_failures += 1
+
+    wall_time = time.time() - start_time
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    result_connection.send({
+        "wall_time": wall_time,
+        "cpu_time": cpu_time,
+        "peak_rss_increase_kb": max(usage_after.ru_maxrss - rss_before_kb, 0),
+        "failures": number_of_failures
+    })
+    result_connection.close()
+
+
+
+
+class Command(BaseCommand):
+    """ Compares the current thumbnail creation against the one used before single-decode cascading. """
+    help = u"Measures CPU time and peak memory usage of creating the thumbnails of album images, " + \
+           u"comparing the current implementation against the legacy one."
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option("--image-path",
+            action = "store",
+            type = "string",
+            dest = "image_path",
+            default = None,
+            help = "Full path to folder containing JPEG images (e.g. straight from a camera) to be used"),
+        make_option("--rounds",
+            action = "store",
+            type = "int",
+            dest = "rounds",
+            default = 1,
+            help = "Number of times each image is processed by each implementation, default 1"),
+        make_option("--max-images",
+            action = "store",
+            type = "int",
+            dest = "max_images",
+            default = 0,
+            help = "Maximum number of images to use, default 0 meaning all found images"),
+        )
+
+    def handle(self, *args, **options):
+        image_path = options.get("image_path")
+        rounds = max(options.get("rounds"), 1)
+        max_images = options.get("max_images")
+
+        if not image_path or not os.path.isdir(image_path):
+            raise CommandError(u"Please use the --image-path option to give a path to a folder of JPEG images.")
+
+        image_paths = []
+        for (folder, subfolders, file_names) in os.walk(image_path):
+            for file_name in sorted(file_names):
+                if file_name.split(".")[-1].lower() in ACCEPTED_IMAGE_FILE_EXTENSIONS:
+                    image_paths.append(os.path.join(folder, file_name))
+        if max_images > 0:
+            image_paths = image_paths[:max_images]
+        if not image_paths:
+            raise CommandError(u"No JPEG images were found from the given folder.")
+
+        renditions = PageContent._meta.get_field("image").renditions
+        self.stdout.write(u"Creating %d renditions (%s) of %d images, %d round(s) per implementation.\n\n" %
+                          (len(renditions), u", ".join([rendition.name for rendition in renditions]),
+                           len(image_paths), rounds))
+        self.stdout.write(u"%-10s %10s %10s %14s %16s %9s\n" %
+                          (u"", u"wall s", u"CPU s", u"CPU ms/image", u"peak RSS +MiB", u"failures"))
+
+        results = {}
+        for (name, implementation) in BENCHMARKED_IMPLEMENTATIONS:
+            target_folder = tempfile.mkdtemp(prefix = "albumizer-benchmark-")
+            try:
+                (parent_connection, child_connection) = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(target = _run_implementation,
+                                                  args = (implementation, image_paths, renditions,
+                                                          rounds, target_folder, child_connection))
+                process.start()
+                result = parent_connection.recv()
+                process.join()
+            finally:
+                shutil.rmtree(target_folder, True)
+
+            results[name] = result
+            self.stdout.write(u"%-10s %10.2f %10.2f %14.1f %16.1f %9d\n" %
+                              (name, result["wall_time"], result["cpu_time"],
+                               1000.0 * result["cpu_time"] / (len(image_paths) * rounds),
+                               result["peak_rss_increase_kb"] / 1024.0, result["failures"]))
+
+        if results["cascaded"]["cpu_time"] > 0:
+            self.stdout.write(u"\nCPU time of legacy / cascaded: %.2f\n" %
+                              (results["legacy"]["cpu_time"] / results["cascaded"]["cpu_time"]))
@@ -0,0 +1,50 @@
+# This Python file uses the following encoding: utf-8
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from Albumizer.albumizer.models import Album
+from Albumizer.albumizer.pricing import unit_price_for_page_count
+from Albumizer.albumizer.utils import update_fields_by_pk
+
+
+
+
+class Command(BaseCommand):
+    """ Checks the stored page counts and unit prices of albums against their actual pages and repairs them. """
+    help = u"Checks the stored page counts and unit prices of albums against their actual pages " + \
+           u"and repairs the ones, which have drifted."
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option("--dry-run",
+            action = "store_true",
+            dest = "dry_run",
+            default = False,
+            help = "Only report the albums having a wrong page count or unit price, do not repair them"),
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity"))
+        dry_run = options.get("dry_run")
+
+        album_values = Album.objects.order_by().values_list("id", "title", "pageCount", "unitPrice") \
+                                    .annotate(actual_page_count = Count("page"))
+        number_of_albums = 0
+        repaired_values_by_album_id = {}
+        for (album_id, title, page_count, unit_price, actual_page_count) in album_values:
+            number_of_albums += 1
+            actual_unit_price = unit_price_for_page_count(actual_page_count)
+            if page_count != actual_page_count or unit_price != actual_unit_price:
+                repaired_values_by_album_id[album_id] = (actual_page_count, actual_unit_price)
+                if verbosity >= 2:
+                    message = u"Album %d \"%s\": stored %d pages and %.2f euros, actually %d pages and %.2f euros.\n" % \
+                                (album_id, title, page_count, unit_price, actual_page_count, actual_unit_price)
+                    self.stdout.write(message.encode("ascii", "backslashreplace"))
+
+        if not dry_run:
+            update_fields_by_pk(Album, ["pageCount", "unitPrice"], repaired_values_by_album_id)
+
+        if verbosity >= 1:
+            self.stdout.write(u"Checked %d albums, %d of which had a wrong page count or unit price%s.\n" %
+                              (number_of_albums, len(repaired_values_by_album_id),
+                               u"" if dry_run else u" and were repaired"))
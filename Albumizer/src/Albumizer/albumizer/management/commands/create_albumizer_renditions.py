@@ -0,0 +1,95 @@
+# This Python file uses the following encoding: utf-8
+
+import time
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from Albumizer.albumizer.models import PageContent
+from Albumizer.albumizer.renditions import create_renditions_in_processes, RENDITION_STATUS_PENDING, \
+                                           RENDITION_STATUS_READY
+
+
+
+
+RENDITION_BATCH_SIZE = 100
+
+
+
+
+class Command(BaseCommand):
+    """ Creates thumbnails of album images, which are still missing or whose creation has failed. """
+    help = u"Creates thumbnails of album images, which are still missing or whose creation has failed. " + \
+           u"Images uploaded to the site are only marked as pending, so this command must be run, or kept " + \
+           u"running with --wait, to create their thumbnails."
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option("--all",
+            action = "store_true",
+            dest = "all",
+            default = False,
+            help = "Recreate thumbnails of all images, including the ones already created"),
+        make_option("--workers",
+            action = "store",
+            type = "int",
+            dest = "workers",
+            default = getattr(settings, "RENDITION_WORKER_PROCESSES", 1),
+            help = "Number of worker processes creating the thumbnails, default settings.RENDITION_WORKER_PROCESSES"),
+        make_option("--wait",
+            action = "store_true",
+            dest = "wait",
+            default = False,
+            help = "Keep waiting for new pending images instead of stopping when all have been processed"),
+        make_option("--poll-interval",
+            action = "store",
+            type = "float",
+            dest = "poll_interval",
+            default = 5.0,
+            help = "Seconds to wait before checking for new pending images again, default 5"),
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity"))
+        number_of_workers = options.get("workers")
+        if number_of_workers < 1:
+            raise CommandError(u"There must be at least one worker.")
+
+        contents = PageContent.objects.exclude(image = "")
+        if not options.get("all"):
+            contents = contents.exclude(imageRenditionStatus = RENDITION_STATUS_READY)
+        (number_of_succeeded, number_of_failed) = self.process(contents, number_of_workers, verbosity)
+        if verbosity >= 1:
+            self.stdout.write(u"Thumbnails were created for %d images, %d failed.\n" %
+                              (number_of_succeeded, number_of_failed))
+
+        # failed images are not retried while waiting, as they would most likely fail again
+        pending_contents = PageContent.objects.exclude(image = "").filter(imageRenditionStatus = RENDITION_STATUS_PENDING)
+        while options.get("wait"):
+            time.sleep(options.get("poll_interval"))
+            self.process(pending_contents, number_of_workers, verbosity)
+
+    def process(self, contents, number_of_workers, verbosity):
+        """
+            Creates thumbnails of given page contents in batches ordered by their ids, so that each
+            content is processed only once even if its status does not change. The results are stored
+            in this process, one image at a time as soon as its thumbnails are ready. Returns the numbers
+            of images whose thumbnails were and were not created.
+        """
+        number_of_succeeded = 0
+        number_of_failed = 0
+        last_id = 0
+        while True:
+            batch = dict([(content.id, content) for content in
+                          contents.filter(id__gt = last_id).order_by("id")[:RENDITION_BATCH_SIZE]])
+            if not batch:
+                return (number_of_succeeded, number_of_failed)
+            last_id = max(batch.keys())
+
+            jobs = [(content_id,) + content.image.rendition_job() for (content_id, content) in batch.items()]
+            for (content_id, manifest) in create_renditions_in_processes(jobs, number_of_workers):
+                content = batch[content_id]
+                if content.image.store_renditions(manifest):
+                    number_of_succeeded += 1
+                else:
+                    number_of_failed += 1
+                    if verbosity >= 1:
+                        self.stdout.write(u"Creating thumbnails failed for image \"%s\".\n" % content.image.name)
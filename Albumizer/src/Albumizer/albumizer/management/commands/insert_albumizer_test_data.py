@@ -22,6 +22,7 @@ from random import Random
 from django import db
 from django.contrib.auth.models import User
 from django.core.files.images import ImageFile
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.db.models import Max, Q
 from Albumizer.albumizer.models import UserProfile, Album, Layout, Page, PageContent, \
@@ -361,6 +362,10 @@ class Command(BaseCommand):
                                min_number_of_orders, max_number_of_orders,
                                no_images_to_albums, image_base_path, albums_by_folders_only)
 
+        if verbosity >= 1:
+            self.stdout.write(u"\nCreating thumbnails of the images...\n")
+        call_command("create_albumizer_renditions", verbosity = verbosity)
+
         if verbosity >= 1:
             if not self._ids_of_generated_users:
                 self.stdout.write(u"\n\nExecution of program was aborted before any data was generated.")
@@ -733,6 +738,7 @@ class Command(BaseCommand):
                         if verbosity >= 2:
                             message = u"                  + captions:\n"
                             self.stdout.write(message.encode("ascii", "backslashreplace"))
+                        new_captions = []
                         for content_number in range(1, number_of_captions + 1):
                             if album_content_from_single_group and \
                                             len(caption_strings_of_added_images) >= content_number:
@@ -750,7 +756,7 @@ class Command(BaseCommand):
                                 placeHolderID = "%s_caption_%s" % (layout.name, content_number),
                                 content = text
                             )
-                            new_content.save()
+                            new_captions.append(new_content)
 
                             if verbosity >= 2:
                                 text = new_content.content
@@ -764,6 +770,9 @@ class Command(BaseCommand):
 
                             del new_content
 
+                        # the search index is updated once per page instead of once per caption
+                        new_page.save_contents(new_captions)
+
 
                     del new_page
 
@@ -894,7 +903,7 @@ class Command(BaseCommand):
 
                 if verbosity >= 2:
                     message = u"            Total price: %s euros including shipping and VAT\n" % \
-                                    convert_money_into_two_decimal_string(new_order.info().get("order_total_price"))
+                                    convert_money_into_two_decimal_string(new_order.total_price())
                     if order_number < number_of_orders - 1:
                         message += u"\n"
                     self.stdout.write(message.encode("ascii", "backslashreplace"))
@@ -1475,7 +1484,7 @@ class Command(BaseCommand):
 
         return {
             "order": order,
-            "amount": order.info().get("order_total_price", 0.00),
+            "amount": order.total_price(),
             "transactionDate": transactionDate,
             "referenceCode": self._orderRandomizer.randrange(1234567890, 9876543210),
             "clarification": ""
@@ -0,0 +1,142 @@
+# This Python file uses the following encoding: utf-8
+
+import logging, multiprocessing, os, socket, sys, time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+from Albumizer.albumizer.models import FulfilmentTask, FULFILMENT_LEASE_SECONDS
+
+
+
+
+commonLogger = logging.getLogger("albumizer")
+
+
+
+
+def _packing_list(order):
+    """ Returns a packing list of given order telling which albums are sent to which addresses. """
+    lines = [u"Order %d of %s, ordered %s:" % (order.id, order.orderer.username, order.purchaseDate)]
+    for item in order.items():
+        lines.append(u"    %d x %s -> %s" % (item.count, item.album.title, item.deliveryAddress))
+    return u"\n".join(lines) + u"\n"
+
+
+def _process_queue(worker_name, batch_size, lease_seconds, poll_interval, until_empty, output):
+    """
+        Claims batches of paid orders from the fulfilment queue and processes them by writing their
+        packing lists into given output and marking them as sent. Orders, which cannot be processed,
+        are returned into the queue to be retried. Returns the number of orders processed.
+
+        A packing list is written before its order is marked as sent, so that no order is ever marked
+        as sent without one. If the worker has lost its lease meanwhile, another packing list of the
+        order may be written by the worker having claimed it next.
+    """
+    number_of_processed_orders = 0
+    while True:
+        tasks = FulfilmentTask.claim_batch(worker_name, batch_size, lease_seconds)
+        if not tasks:
+            if until_empty:
+                return number_of_processed_orders
+            time.sleep(poll_interval)
+            continue
+
+        for task in tasks:
+            try:
+                packing_list = _packing_list(task.order)
+            except DatabaseError as e:
+                commonLogger.warning(u"Worker %s was unable to process order %s: %s" % (worker_name, task.order_id, e))
+                task.release(unicode(e)[:255])
+                continue
+
+            output.write(packing_list.encode("utf-8"))
+            output.flush()
+            if task.complete(u"processed by %s" % worker_name):
+                number_of_processed_orders += 1
+            else:
+                commonLogger.warning(u"Worker %s lost its lease of order %s after writing its packing list." %
+                                     (worker_name, task.order_id))
+
+
+def _run_worker(worker_name, batch_size, lease_seconds, poll_interval, until_empty):
+    """ Runs a worker in a process of its own. """
+    # every process needs a connection of its own
+    connection.close()
+    try:
+        number_of_processed_orders = _process_queue(worker_name, batch_size, lease_seconds, poll_interval,
+                                                    until_empty, sys.stdout)
+    except KeyboardInterrupt:
+        return
+    sys.stdout.write("Worker %s processed %d orders.\n" % (worker_name, number_of_processed_orders))
+    connection.close()
+
+
+
+
+class Command(BaseCommand):
+    """ Processes paid orders from the fulfilment queue using one or more worker processes. """
+    help = u"Claims paid orders from the fulfilment queue in batches, writes their packing lists into the standard " + \
+           u"output and marks them as sent. Several workers, also on different hosts, can process the queue at " + \
+           u"the same time without processing any order twice."
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option("--workers",
+            action = "store",
+            type = "int",
+            dest = "workers",
+            default = 1,
+            help = "Number of worker processes, default 1"),
+        make_option("--batch-size",
+            action = "store",
+            type = "int",
+            dest = "batch_size",
+            default = 10,
+            help = "Number of orders claimed by a worker at once, default 10"),
+        make_option("--lease",
+            action = "store",
+            type = "int",
+            dest = "lease",
+            default = FULFILMENT_LEASE_SECONDS,
+            help = "Seconds after which orders claimed but not processed can be claimed again, default %d" %
+                   FULFILMENT_LEASE_SECONDS),
+        make_option("--poll-interval",
+            action = "store",
+            type = "float",
+            dest = "poll_interval",
+            default = 5.0,
+            help = "Seconds to wait before checking an empty queue again, default 5"),
+        make_option("--until-empty",
+            action = "store_true",
+            dest = "until_empty",
+            default = False,
+            help = "Stop when there are no orders to be claimed instead of waiting for new ones"),
+        )
+
+    def handle(self, *args, **options):
+        number_of_workers = options.get("workers")
+        batch_size = options.get("batch_size")
+        if number_of_workers < 1 or batch_size < 1:
+            raise CommandError(u"There must be at least one worker and one order in a batch.")
+
+        worker_name_prefix = u"%s-%d" % (socket.gethostname(), os.getpid())
+        worker_parameters = (batch_size, options.get("lease"), options.get("poll_interval"),
+                             options.get("until_empty"))
+
+        if number_of_workers == 1:
+            number_of_processed_orders = _process_queue(worker_name_prefix, *(worker_parameters + (self.stdout,)))
+            self.stdout.write(u"Worker %s processed %d orders.\n" % (worker_name_prefix, number_of_processed_orders))
+            return
+
+        # the processes must not share the connection of this one
+        connection.close()
+        processes = [multiprocessing.Process(target = _run_worker,
+                                             args = (u"%s-%d" % (worker_name_prefix, worker_number),) + worker_parameters)
+                     for worker_number in range(1, number_of_workers + 1)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
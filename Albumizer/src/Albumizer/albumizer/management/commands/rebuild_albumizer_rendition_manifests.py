@@ -0,0 +1,32 @@
+# This Python file uses the following encoding: utf-8
+
+from django.core.management.base import BaseCommand
+from Albumizer.albumizer.models import PageContent
+
+
+
+
+class Command(BaseCommand):
+    """ Rebuilds the rendition manifests of album images based on the thumbnail files found from the file system. """
+    help = u"Rebuilds the rendition manifests of album images based on the thumbnail files found " + \
+           u"from the file system. Missing thumbnails are not created; use create_albumizer_renditions for that."
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity"))
+
+        number_of_complete = 0
+        number_of_incomplete = 0
+        for content in PageContent.objects.exclude(image = "").order_by("id").iterator():
+            if content.image.rebuild_rendition_manifest():
+                number_of_complete += 1
+            else:
+                number_of_incomplete += 1
+                if verbosity >= 2:
+                    self.stdout.write(u"Some thumbnails of image \"%s\" are missing.\n" % content.image.name)
+
+        if verbosity >= 1:
+            self.stdout.write(u"Manifests were rebuilt for %d images.\n" % (number_of_complete + number_of_incomplete))
+            if number_of_incomplete:
+                self.stdout.write(u"%d images are missing some of their thumbnails. " % number_of_incomplete +
+                                  u"Run create_albumizer_renditions to create them.\n")
@@ -0,0 +1,43 @@
+# This Python file uses the following encoding: utf-8
+
+from django.core.management.base import BaseCommand, CommandError
+from Albumizer.albumizer.models import Album, PageContent, ALBUM_SEARCH_INDEX
+
+
+
+
+def _search_index_values_of_all_albums():
+    """
+        Yields the search index values of all albums. The albums and their captions are read
+        with two queries, both ordered by the ids of the albums, and merged together.
+    """
+    captions = PageContent.captions().order_by("page__album", "page__pageNumber", "slot") \
+                                     .values_list("page__album", "content").iterator()
+    (caption_album_id, caption) = next(captions, (None, None))
+    for album in Album.objects.select_related("owner").order_by("id").iterator():
+        while caption_album_id is not None and caption_album_id < album.id:
+            (caption_album_id, caption) = next(captions, (None, None))
+        captions_of_album = []
+        while caption_album_id == album.id:
+            captions_of_album.append(caption)
+            (caption_album_id, caption) = next(captions, (None, None))
+        yield album.search_index_values(captions_of_album)
+
+
+
+
+class Command(BaseCommand):
+    """ Builds the search index of albums again from scratch. """
+    help = u"Builds the search index of albums again from scratch, e.g. after restoring the database " + \
+           u"or when the index has drifted because of rolled back transactions."
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity"))
+        if not ALBUM_SEARCH_INDEX.is_enabled():
+            raise CommandError(u"Searching is disabled, as SEARCH_INDEX_PATH is not set.")
+
+        number_of_albums = ALBUM_SEARCH_INDEX.rebuild(_search_index_values_of_all_albums())
+
+        if verbosity >= 1:
+            self.stdout.write(u"Search index was rebuilt for %d albums.\n" % number_of_albums)
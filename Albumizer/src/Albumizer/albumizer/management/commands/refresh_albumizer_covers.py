@@ -0,0 +1,29 @@
+# This Python file uses the following encoding: utf-8
+
+from django.core.management.base import BaseCommand
+from Albumizer.albumizer.models import Album, Page
+
+
+
+
+class Command(BaseCommand):
+    """ Resolves the covers of all albums and pages again and stores them into the database. """
+    help = u"Resolves the covers of all albums and pages again and stores them into the database."
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity"))
+
+        number_of_pages = 0
+        for page in Page.objects.order_by("id").iterator():
+            page.refresh_cover(refresh_album = False)
+            number_of_pages += 1
+
+        number_of_albums = 0
+        for album in Album.objects.order_by("id").iterator():
+            album.refresh_cover()
+            number_of_albums += 1
+
+        if verbosity >= 1:
+            self.stdout.write(u"Covers were refreshed for %d albums and %d pages.\n" %
+                              (number_of_albums, number_of_pages))
@@ -1,16 +1,25 @@
 ﻿# This Python file uses the following encoding: utf-8
 
-import hashlib, json, logging, os
+import hashlib, json, logging, os, sqlite3, uuid
 from datetime import datetime, timedelta
 from random import Random
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import ImageField, Max, Q
+from django.db import connection, models, transaction
+from django.db.models import F, ImageField, Q
 from django.db.models.fields.files import ImageFieldFile
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.utils.crypto import constant_time_compare, salted_hmac
 from django.utils.html import escape
-import Image
+from renditions import Rendition, create_renditions, inspect_renditions, renditions_processed, \
+                       RENDITION_STATUS_CHOICES, RENDITION_STATUS_PENDING, RENDITION_STATUS_READY, \
+                       RENDITION_STATUS_FAILED
+from pricing import money, unit_price_for_page_count, price_albums_excluding_vat_and_shipping, \
+                    price_albums_including_vat_and_shipping, snapshot_of_order_info, order_info_from_snapshot
+from lookups import CompiledStylesheet, IdIndex, LookupTable
+from search import AlbumSearchIndex, SEARCH_WEIGHT_TITLE, SEARCH_WEIGHT_OWNER, SEARCH_WEIGHT_DESCRIPTION, \
+                   SEARCH_WEIGHT_CAPTION
+from utils import delete_rows_by_pk, insert_rows, update_fields_by_pk
 
 
 
@@ -25,39 +34,124 @@ PATH_OF_MISSING_COVER_IMAGE_LARGE = settings.STATIC_URL + "images/missing-cover-
 FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL = "thumb-large"
 FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL = "thumb-small"
 
+
+CONTENT_KIND_IMAGE = "image"
+CONTENT_KIND_CAPTION = "caption"
+CONTENT_KIND_OTHER = "other"
+
+CONTENT_KIND_CHOICES = (
+    (CONTENT_KIND_IMAGE, u"image"),
+    (CONTENT_KIND_CAPTION, u"caption"),
+    (CONTENT_KIND_OTHER, u"other"),
+)
+
+
+
+
 class AlbumizerImageFieldFile(ImageFieldFile):
     """ 
-        ImageFieldFile subclass, which is able to save give image with small and large thumbnails.
+        ImageFieldFile subclass, which is able to save give image with thumbnails declared by the field.
     """
     @staticmethod
-    def _modify_to_thumbnail_path(path, extension_prefix_to_add):
+    def _modify_to_thumbnail_path(path, extension_prefix_to_add, extension = "jpg"):
         """ 
             Adds an prefix to files extension, e.g. "this.jpg" --> "this.thumb.jpg",
-            and changes the actual extension to "jpg" (because thumbnails are saved as jpegs).
+            and changes the actual extension to given one (thumbnails are saved as jpegs by default).
         """
         path_parts = path.split(".")
         path_parts.insert(-1, extension_prefix_to_add)
-        path_parts[-1] = "jpg"
+        path_parts[-1] = extension
         changed_path = ".".join(path_parts)
         return changed_path
 
-    def _create_thumbnail(self, width, height, target_path):
-        """ 
-            Creates a thumbnail image based on the original, which must be saved already.
+    def _rendition_specs(self):
         """
-        if not os.path.exists(self.path):
-            commonLogger.error(u"Thumbnail creation failed for image \"%s\": Image was not found." % self.path)
-            return
+            Returns a list describing the thumbnail images to be created, see renditions.create_renditions().
+        """
+        return [(rendition, self.rendition_path(rendition.name)) for rendition in self.field.renditions]
+
+    def _store_rendition_results(self, image_name, status, manifest):
+        """
+            Stores the rendition status and manifest of given image into the database, if the model owning
+            this file has fields for them and the image has not been replaced in the meantime.
+            Returns False, if the row of the model instance no longer contains the image.
+        """
+        if self.instance.pk is None:
+            return False
+
+        updated_values = {}
+        if self.field.rendition_status_field:
+            updated_values[self.field.rendition_status_field] = status
+        if self.field.rendition_manifest_field:
+            updated_values[self.field.rendition_manifest_field] = json.dumps(manifest, sort_keys = True)
+        if not updated_values:
+            return True
+
+        for (field_name, value) in updated_values.items():
+            setattr(self.instance, field_name, value)
+        filter_parameters = {"pk": self.instance.pk, self.field.attname: image_name}
+        return type(self.instance)._default_manager.filter(**filter_parameters).update(**updated_values) > 0
+
+    def _renditions_processed(self, image_name, manifest):
+        """
+            Updates the rendition status and manifest after the thumbnail images have been created.
+            Returns True, if all of the declared thumbnail images exist and their manifest was stored.
+        """
+        all_exist = len(manifest) == len(self.field.renditions)
+        if all_exist:
+            status = RENDITION_STATUS_READY
+        else:
+            status = RENDITION_STATUS_FAILED
+        if not self._store_rendition_results(image_name, status, manifest):
+            commonLogger.warning(u"Thumbnails of image \"%s\" were not stored, because the image has been " \
+                                 u"replaced or deleted meanwhile." % image_name)
+            return False
+        self._enforce_path_permissions(os.path.split(self.path)[0])
+        renditions_processed.send(sender = type(self.instance), instance = self.instance,
+                                  field_name = self.field.name, manifest = manifest)
+        return all_exist
+
+    def create_renditions(self):
+        """
+            Creates the thumbnail images in the current process. Returns True, if all of them were created.
+        """
+        return self._renditions_processed(self.name, create_renditions(self.path, self._rendition_specs()))
+
+    def rendition_job(self):
+        """
+            Returns the path of the image and a list describing the thumbnail images to be created,
+            for creating them in another process, see renditions.create_renditions_in_processes().
+        """
+        return (self.path, self._rendition_specs())
+
+    def store_renditions(self, manifest):
+        """
+            Stores the manifest of thumbnail images created in another process.
+            Returns True, if all of them were created.
+        """
+        return self._renditions_processed(self.name, manifest)
 
+    def rebuild_rendition_manifest(self):
+        """
+            Rebuilds the manifest of the thumbnail images based on the files found from the file system,
+            without creating any missing ones. Returns True, if all of the thumbnail images exist.
+        """
+        return self._renditions_processed(self.name, inspect_renditions(self._rendition_specs()))
+
+    def rendition_manifest(self):
+        """
+            Returns the manifest of the existing thumbnail images, see renditions.create_renditions().
+            The manifest is read from the model instance, so no file system access is needed.
+        """
+        if not self.field.rendition_manifest_field:
+            return {}
+        serialized_manifest = getattr(self.instance, self.field.rendition_manifest_field)
+        if not serialized_manifest:
+            return {}
         try:
-            thumbnail_image = Image.open(self.path)
-            thumbnail_image.thumbnail((width, height), Image.ANTIALIAS)
-            thumbnail_image.save(target_path, "JPEG")
-            if settings.FILE_UPLOAD_PERMISSIONS:
-                os.chmod(target_path, settings.FILE_UPLOAD_PERMISSIONS)
-        except Exception as e:
-            commonLogger.error(u"Thumbnail creation failed for image \"%s\": %s" %
-                               (self.path, unicode(e, errors = "ignore")))
+            return json.loads(serialized_manifest)
+        except ValueError:
+            return {}
 
     @staticmethod
     def _enforce_path_permissions(target_path):
@@ -95,47 +189,75 @@ class AlbumizerImageFieldFile(ImageFieldFile):
         if os.path.exists(path):
             os.remove(path)
 
+    def rendition_path(self, rendition_name):
+        """ 
+            Returns path of the thumbnail image declared with given name.
+        """
+        rendition = self.field.renditions_by_name[rendition_name]
+        return self._modify_to_thumbnail_path(self.path, rendition.name, rendition.file_extension)
+
+    def rendition_url(self, rendition_name):
+        """ 
+            Returns url of the thumbnail image declared with given name.
+        """
+        rendition = self.field.renditions_by_name[rendition_name]
+        return self._modify_to_thumbnail_path(self.url, rendition.name, rendition.file_extension)
+
+    def srcset(self):
+        """ 
+            Returns the existing thumbnail images as a value for the srcset attribute of an img element,
+            e.g. "/this.thumb-small.jpg 100w, /this.thumb-large.jpg 300w". Browsers use it to
+            download the smallest thumbnail, which is large enough for the display in question.
+        """
+        manifest = self.rendition_manifest()
+        rendition_names = sorted([name for name in manifest if name in self.field.renditions_by_name],
+                                 key = lambda name: manifest[name]["width"])
+        return u", ".join([u"%s %dw" % (self.rendition_url(name), manifest[name]["width"])
+                           for name in rendition_names])
+
     def large_thumbnail_path(self):
         """ 
             Returns path of the large thumbnail image.
         """
-        return self._modify_to_thumbnail_path(self.path, FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL)
+        return self.rendition_path(FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL)
 
     def small_thumbnail_path(self):
         """ 
             Returns path of the small thumbnail image.
         """
-        return self._modify_to_thumbnail_path(self.path, FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL)
+        return self.rendition_path(FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL)
 
     def large_thumbnail_url(self):
         """ 
             Returns url of the large thumbnail image.
         """
-        return self._modify_to_thumbnail_path(self.url, FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL)
+        return self.rendition_url(FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL)
 
     def small_thumbnail_url(self):
         """ 
             Returns url of the small thumbnail image.
         """
-        return self._modify_to_thumbnail_path(self.url, FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL)
+        return self.rendition_url(FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL)
 
     def save(self, name, content, save = True):
-        """ 
-            Lets the superclass to save the original image and creates the two thumbnail images.
         """
+            Lets the superclass to save the original image and marks the thumbnail images as pending.
+            The thumbnails are created by the create_albumizer_renditions management command, which
+            picks up pending images only after the transaction saving them has been committed.
+        """
+        if self.field.rendition_status_field:
+            setattr(self.instance, self.field.rendition_status_field, RENDITION_STATUS_PENDING)
+        if self.field.rendition_manifest_field:
+            setattr(self.instance, self.field.rendition_manifest_field, "")
         super(AlbumizerImageFieldFile, self).save(name, content, save)
-        self._create_thumbnail(self.field.small_thumb_width, self.field.small_thumb_height, \
-                                    self.small_thumbnail_path())
-        self._create_thumbnail(self.field.large_thumb_width, self.field.large_thumb_height, \
-                                    self.large_thumbnail_path())
         self._enforce_path_permissions(os.path.split(self.path)[0])
 
     def delete(self, save = True):
         """ 
             Deletes the thumbnail images and the lets the superclass to delete the original image.
         """
-        self._delete_thumbnail(self.small_thumbnail_path())
-        self._delete_thumbnail(self.large_thumbnail_path())
+        for rendition in self.field.renditions:
+            self._delete_thumbnail(self.rendition_path(rendition.name))
         super(AlbumizerImageFieldFile, self).delete(save)
 
 
@@ -143,24 +265,113 @@ class AlbumizerImageFieldFile(ImageFieldFile):
 
 class AlbumizerImageField(ImageField):
     """ 
-        ImageField subclass, which is able to save give image with small and large thumbnails.
+        ImageField subclass, which is able to save give image with any number of thumbnails.
+
+        The thumbnails are declared as a list of renditions.Rendition objects, e.g.
+
+            AlbumizerImageField(renditions = [
+                Rendition("thumb-small", 100, 100),
+                Rendition("thumb-large", 300, 300),
+                Rendition("thumb-xlarge", 600, 600, quality = 80)
+            ])
+
+        Renditions named "thumb-small" and "thumb-large" must always be declared, as they are
+        used by small_thumbnail_url() and large_thumbnail_url(). If no renditions are given,
+        they are created according to the small_thumb_* and large_thumb_* parameters.
     """
     attr_class = AlbumizerImageFieldFile
 
     def __init__(self, small_thumb_width = 100, small_thumb_height = 100,
-                 large_thumb_width = 300, large_thumb_height = 300, *args, **kwargs):
-        """ 
-            Store sizes of large and small thumbnail. 
-        """
-        self.small_thumb_width = small_thumb_width
-        self.small_thumb_height = small_thumb_height
-        self.large_thumb_width = large_thumb_width
-        self.large_thumb_height = large_thumb_height
+                 large_thumb_width = 300, large_thumb_height = 300, renditions = None,
+                 rendition_status_field = None, rendition_manifest_field = None, *args, **kwargs):
+        """
+            Store declarations of the thumbnails and the names of the model fields used to store
+            status of the thumbnails (see renditions.RENDITION_STATUS_CHOICES) and their manifest
+            (see renditions.create_renditions()).
+        """
+        if renditions is None:
+            renditions = [
+                Rendition(FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL, small_thumb_width, small_thumb_height),
+                Rendition(FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL, large_thumb_width, large_thumb_height)
+            ]
+        self.renditions = list(renditions)
+        self.renditions_by_name = dict([(rendition.name, rendition) for rendition in self.renditions])
+        if len(self.renditions_by_name) != len(self.renditions):
+            raise ValueError(u"Names of renditions must be unique.")
+        for required_name in (FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL, FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL):
+            if required_name not in self.renditions_by_name:
+                raise ValueError(u"A rendition named \"%s\" must be declared." % required_name)
+
+        self.rendition_status_field = rendition_status_field
+        self.rendition_manifest_field = rendition_manifest_field
         super(AlbumizerImageField, self).__init__(*args, **kwargs)
 
 
 
 
+class LookupVersion(models.Model):
+    """ 
+        Represents the version of database content cached in the memory of processes, like a table
+        of layouts. Processes load the content again when they notice that its version has changed.
+        See lookups.VersionedProcessCache.
+    """
+    name = models.CharField(
+        max_length = 100,
+        unique = True,
+        verbose_name = u"name",
+        help_text = u"name of the cached content"
+    )
+    version = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = u"version",
+        help_text = u"number incremented whenever the cached content changes"
+    )
+
+    def __unicode__(self):
+        return u"%s, %d" % (self.name, self.version)
+
+    class Meta():
+        verbose_name = u"lookup version"
+        verbose_name_plural = u"lookup versions"
+
+
+
+
+class LookupChange(models.Model):
+    """ 
+        Represents a single change of an index of primary keys cached in the memory of processes.
+        Processes apply the changes made after the version they have instead of loading the whole
+        index again. See lookups.IdIndex.
+    """
+    name = models.CharField(
+        max_length = 100,
+        verbose_name = u"name",
+        help_text = u"name of the cached index"
+    )
+    version = models.PositiveIntegerField(
+        verbose_name = u"version",
+        help_text = u"version of the index resulting from this change"
+    )
+    objectId = models.IntegerField(
+        verbose_name = u"object id",
+        help_text = u"primary key of the row, which joined or left the index"
+    )
+    isAdded = models.BooleanField(
+        verbose_name = u"added",
+        help_text = u"whether the row joined the index instead of leaving it"
+    )
+
+    def __unicode__(self):
+        return u"%s, %d" % (self.name, self.version)
+
+    class Meta():
+        unique_together = ("name", "version")
+        verbose_name = u"lookup change"
+        verbose_name_plural = u"lookup changes"
+
+
+
+
 class UserProfile(models.Model):
     """ 
         Represents additional information about a single user.
@@ -187,6 +398,11 @@ class UserProfile(models.Model):
         help_text = u"e.g. \"+358 44 123 4567\" (max. 20 characters)"
 
     )
+    cartVersion = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = u"cart version",
+        help_text = u"increased whenever the content of the user's shopping cart changes, maintained automatically"
+    )
 
     def __unicode__(self):
         return u"%s %s (%s)" % (self.user.first_name, self.user.last_name, self.user.username)
@@ -287,6 +503,33 @@ class Album(models.Model):
         null = True,
         verbose_name = u"creation date"
     )
+    coverContent = models.ForeignKey(
+        "PageContent",
+        null = True,
+        blank = True,
+        on_delete = models.SET_NULL,
+        related_name = "+",
+        verbose_name = u"cover content",
+        help_text = u"page content containing the cover image of this album, maintained automatically"
+    )
+    coverRenditions = models.TextField(
+        blank = True,
+        default = "",
+        verbose_name = u"cover renditions",
+        help_text = u"urls of the cover image as JSON, maintained automatically; empty if not resolved yet"
+    )
+    pageCount = models.IntegerField(
+        default = 0,
+        verbose_name = u"page count",
+        help_text = u"number of pages in this album, maintained automatically"
+    )
+    unitPrice = models.DecimalField(
+        max_digits = 10,
+        decimal_places = 2,
+        default = 0,
+        verbose_name = u"unit price",
+        help_text = u"price of a single piece of this album excluding VAT and shipping, maintained automatically"
+    )
 
     _randomizer = Random()
 
@@ -326,48 +569,84 @@ class Album(models.Model):
             Returns the url of this album's small cover image, if one can be found. "Cover image" is the first
             found when iterating through pages ordered by their pageNumber field.
             
-            If the small thumbnail of the image in question does not exist, existence of the larger thumbnail
-            is checked and its url is returned if the image exists. 
-            
-            If the large thumbnail of the image in question does not exist either,
+            If the thumbnails of the image in question have not been created yet,
             the url of the actual image is returned.
              
-            If there is no images in this album, this method returns an empty string. 
-        """
-        for page in self.pages():
-            image_content = page.image_content()
-            for content in image_content:
-                if content.image:
-                    if os.path.exists(content.image.small_thumbnail_path()):
-                        return content.image.small_thumbnail_url()
-                    if os.path.exists(content.image.large_thumbnail_path()):
-                        return content.image.large_thumbnail_url()
-                    return content.image.url
-        return PATH_OF_MISSING_COVER_IMAGE_SMALL
+            If there is no images in this album, the url of a placeholder image is returned. 
+        """
+        return self.cover_renditions().get("small", PATH_OF_MISSING_COVER_IMAGE_SMALL)
 
     def url_of_large_cover(self):
         """ 
             Returns the url of this album's large cover image, if one can be found. "Cover image" is the first
             found when iterating through pages ordered by their pageNumber field.
             
-            If the large thumbnail of the image in question does not exist, existence of the smaller thumbnail
-            is checked and its url is returned if the image exists.
-            
-            If the small thumbnail of the image in question does not exist either,
+            If the thumbnails of the image in question have not been created yet,
             the url of the actual image is returned.
              
-            If there is no images in this album, this method returns an empty string. 
-        """
-        for page in self.pages():
-            image_content = page.image_content()
-            for content in image_content:
-                if content.image:
-                    if os.path.exists(content.image.large_thumbnail_path()):
-                        return content.image.large_thumbnail_url()
-                    if os.path.exists(content.image.small_thumbnail_path()):
-                        return content.image.small_thumbnail_url()
-                    return content.image.url
-        return PATH_OF_MISSING_COVER_IMAGE_LARGE
+            If there is no images in this album, the url of a placeholder image is returned. 
+        """
+        return self.cover_renditions().get("large", PATH_OF_MISSING_COVER_IMAGE_LARGE)
+
+    def cover_renditions(self):
+        """ 
+            Returns urls of this album's cover image as a dictionary, see PageContent.cover_renditions().
+            The urls are stored into the album itself, so normally no queries are needed. If there are
+            no images in this album, an empty dictionary is returned.
+        """
+        if not self.coverRenditions:
+            self.refresh_cover()
+        return deserialize_cover_renditions(self.coverRenditions)
+
+    def refresh_cover(self):
+        """ 
+            Resolves the cover image of this album from the covers stored into its pages and stores it
+            into this album. Called automatically whenever the cover of one of the pages changes.
+        """
+        for page in Page.objects.filter(album = self, coverRenditions = ""):
+            page.refresh_cover(refresh_album = False)
+
+        cover_pages = Page.objects.filter(album = self, coverContent__isnull = False).order_by("pageNumber")
+        cover_values = cover_pages.values_list("coverContent", "coverRenditions")[:1]
+        if cover_values:
+            (self.coverContent_id, self.coverRenditions) = cover_values[0]
+        else:
+            (self.coverContent_id, self.coverRenditions) = (None, serialize_cover_renditions({}))
+
+        if self.pk is not None:
+            Album.objects.filter(pk = self.pk).update(coverContent = self.coverContent_id,
+                                                      coverRenditions = self.coverRenditions)
+
+    @staticmethod
+    def resolve_covers(albums):
+        """ 
+            Makes sure that the covers of given albums (a list, a queryset or a page of a Paginator)
+            have been resolved, so that showing them needs no further queries. Covers of the albums,
+            which have not been resolved yet, are resolved all at once with two queries no matter how many
+            albums or pages there are. Returns the albums as a list.
+        """
+        albums = list(getattr(albums, "object_list", albums))
+        unresolved_albums = [album for album in albums if not album.coverRenditions]
+        if not unresolved_albums:
+            return albums
+
+        unresolved_album_ids = [album.id for album in unresolved_albums]
+        cover_values_by_album_id = dict([(album_id, (None, serialize_cover_renditions({})))
+                                         for album_id in unresolved_album_ids])
+        image_contents = PageContent.objects.select_related("page") \
+                                .filter(page__album__in = unresolved_album_ids, kind = CONTENT_KIND_IMAGE) \
+                                .exclude(image = "").order_by("page__album", "page__pageNumber", "-slot")
+        albums_with_cover = set()
+        for content in image_contents:
+            if content.page.album_id not in albums_with_cover:
+                albums_with_cover.add(content.page.album_id)
+                cover_values_by_album_id[content.page.album_id] = \
+                        (content.id, serialize_cover_renditions(content.cover_renditions()))
+
+        update_fields_by_pk(Album, ["coverContent", "coverRenditions"], cover_values_by_album_id)
+        for album in unresolved_albums:
+            (album.coverContent_id, album.coverRenditions) = cover_values_by_album_id[album.id]
+        return albums
 
     def is_owned_by(self, user):
         """ 
@@ -405,7 +684,7 @@ class Album(models.Model):
         """ 
             Returns an album having given id, if one exists. Otherwise returns None.
         """
-        album_resultset = Album.objects.filter(id__exact = album_id)
+        album_resultset = Album.objects.select_related("owner").filter(id__exact = album_id)
         if not album_resultset:
             return None
         return album_resultset[0]
@@ -415,7 +694,8 @@ class Album(models.Model):
         """ 
             Returns an album having given id and secret hash, if one exists. Otherwise returns None.
         """
-        album_resultset = Album.objects.filter(id__exact = album_id, secretHash__exact = secret_hash)
+        album_resultset = Album.objects.select_related("owner") \
+                                       .filter(id__exact = album_id, secretHash__exact = secret_hash)
         if not album_resultset:
             return None
         return album_resultset[0]
@@ -446,24 +726,58 @@ class Album(models.Model):
         """
         return Page.objects.filter(album__exact = self).exists()
 
-    def price_excluding_vat_and_shipping(self, quantity = None, cumulative_total = None):
+    def detail_info(self):
+        """ 
+            Returns information needed for showing this album with all of its pages. Everything is
+            fetched at once, so that showing the album needs a fixed number of queries no matter
+            how many pages it has.
+            
+            Returns a dictionary containing keys "album" containing this Album instance, "pages" containing
+            a list of its pages with their layouts and resolved covers, "page_count" and "unit_price",
+            which is the price of a single piece of this album excluding VAT and shipping.
+        """
+        pages = list(self.pages().select_related("layout"))
+        for page in pages:
+            page.album = self
+        Page.resolve_covers(pages)
+
+        page_count = len(pages)
+        return {
+            "album": self,
+            "pages": pages,
+            "page_count": page_count,
+            "unit_price": self.price_excluding_vat_and_shipping(page_count = page_count)[0]
+        }
+
+    def refresh_page_count(self):
+        """ 
+            Counts the pages of this album and stores the count and the unit price based on it
+            into this album. Called automatically whenever pages are added or deleted.
+        """
+        self.pageCount = Page.objects.filter(album = self).count()
+        self.unitPrice = unit_price_for_page_count(self.pageCount)
+        if self.pk is not None:
+            Album.objects.filter(pk = self.pk).update(pageCount = self.pageCount, unitPrice = self.unitPrice)
+
+    def price_excluding_vat_and_shipping(self, quantity = None, cumulative_total = None, page_count = None):
         """ 
             Calculates a price for a number of a single album, excluding VAT and shipping.
+            Unless the number of pages in this album is given, the stored page count and unit price are used,
+            so no queries are needed. The prices are returned as Decimals.
         """
         if quantity and quantity < 0:
             raise ValueError, "Quantity of an album cannot be negative"
 
-        price_of_single_album = 0.00
-
-        page_count = self.pages().count()
-        if page_count > 0:
-            price_of_single_album += settings.PRICE_PER_ALBUM
-            price_of_single_album += page_count * settings.PRICE_PER_ALBUM_PAGE
+        if page_count is None:
+            page_count = self.pageCount
+            price_of_single_album = money(self.unitPrice)
+        else:
+            price_of_single_album = unit_price_for_page_count(page_count)
 
         result_list = [price_of_single_album]
 
         if quantity:
-            price_of_albums = 0.00
+            price_of_albums = money(0)
             if page_count > 0:
                 price_of_albums = quantity * price_of_single_album
             result_list.append(price_of_albums)
@@ -475,108 +789,108 @@ class Album(models.Model):
 
         return result_list
 
-    @staticmethod
-    def price_for_several_albums_excluding_vat_and_shipping(album_info_list):
+    def _lock_page_order(self):
         """ 
-            Calculates a prices for several albums, excluding VAT and shipping.
-            
-            album_info_list is a list of lists containing an Album object and a quantity, like
-            [[album1, 3], [album2, 23], [album3, 1]] .
-        """
-        item_infos = {}
-        sub_total_price_for_all_albums = 0.00
-        for (album, quantity) in album_info_list:
-            unit_price, sub_total_for_single_album, sub_total_price_for_all_albums = \
-                album.price_excluding_vat_and_shipping(quantity, sub_total_price_for_all_albums)
-            item_infos[album] = {
-                "quantity": quantity,
-                "unit_price": unit_price,
-                "sub_total": sub_total_for_single_album
-            }
-
-        return {
-            "items": item_infos,
-            "sub_total": sub_total_price_for_all_albums
-        }
+            Locks the row of this album until the end of the current transaction, so that concurrent
+            changes to the order of its pages are serialized. As Django does not support SELECT ... FOR
+            UPDATE, the row is locked by updating it without changing anything. Returns the number
+            of pages in this album.
+        """
+        Album.objects.filter(pk = self.pk).update(pageCount = F("pageCount"))
+        return Page.objects.filter(album = self).count()
 
-    @staticmethod
-    def price_for_several_albums_including_vat_and_shipping(album_info_list):
+    def _park_pages(self, first_page_number, last_page_number, offset):
         """ 
-            Calculates a prices for several albums, including VAT and shipping.
-            
-            album_info_list is a list of lists containing an Album object and a quantity, like
-            [[album1, 3, address1], [album2, 23, address2], [album3, 1, address3]] .
-        """
-        items_by_address = {}
-        sub_total_price_for_all_albums = 0.00
-        for (album, quantity, address) in album_info_list:
-            unit_price, sub_total_for_single_album, sub_total_price_for_all_albums = \
-                album.price_excluding_vat_and_shipping(quantity, sub_total_price_for_all_albums)
-
-            if not address in items_by_address.keys():
-                items_by_address[address] = {"items": []}
-
-            items_by_address[address]["items"].append({
-                "album": album,
-                "quantity": quantity,
-                "unit_price": unit_price,
-                "sub_total": sub_total_for_single_album
-            })
-
-        current_date = datetime.now()
-        dispatch_timedelta = timedelta(days = 3)
-        delivery_timedelta = timedelta(days = 14)
-
-        single_shipping_expense = settings.SHIPPING_EXPENSES
-        sub_total_shipping_expenses = 0.00
-        for address, items in items_by_address.items():
-            items_by_address[address]["estimated_dispatch_date"] = current_date + dispatch_timedelta
-            items_by_address[address]["estimated_delivery_date"] = current_date + delivery_timedelta
+            Shifts the numbers of the pages between given page numbers (inclusive, and until the last page,
+            if last_page_number is None) by given offset and negates them with a single UPDATE. Because
+            the parked pages have negative numbers, they cannot collide with other pages of this album.
+            The numbers are made positive again by _unpark_pages().
+        """
+        pages = Page.objects.filter(album = self, pageNumber__gte = first_page_number)
+        if last_page_number is not None:
+            pages = pages.filter(pageNumber__lte = last_page_number)
+        pages.update(pageNumber = F("pageNumber") * -1 - offset)
 
-            item_group_subtotal_before_shipping = 0.00
-            for item_info in items["items"]:
-                item_group_subtotal_before_shipping += item_info["sub_total"]
+    def _unpark_pages(self):
+        """ 
+            Makes the numbers of the pages parked by _park_pages() positive again with a single UPDATE.
+        """
+        Page.objects.filter(album = self, pageNumber__lt = 0).update(pageNumber = F("pageNumber") * -1)
 
-            items_by_address[address]["item_group_subtotal_before_shipping"] = item_group_subtotal_before_shipping
+    @transaction.commit_on_success
+    def insert_page(self, layout, page_number = None):
+        """ 
+            Creates a new page having given layout into given position of this album, or after the
+            last page, if no position is given. The following pages are renumbered with two UPDATEs
+            no matter how many of them there are. Returns the new page.
+        """
+        page_count = self._lock_page_order()
+        if page_number is None or page_number > page_count:
+            page_number = page_count + 1
+        page_number = max(page_number, 1)
 
-            items_by_address[address]["shipping_expenses"] = single_shipping_expense
+        if page_number <= page_count:
+            self._park_pages(page_number, None, 1)
+            self._unpark_pages()
 
-            item_group_subtotal_with_shipping = item_group_subtotal_before_shipping + single_shipping_expense
-            items_by_address[address]["item_group_subtotal_with_shipping"] = item_group_subtotal_with_shipping
+        page = Page(album = self, pageNumber = page_number, layout = layout)
+        page.save()
+        return page
 
-            sub_total_shipping_expenses += single_shipping_expense
+    @transaction.commit_on_success
+    def move_page(self, page_number, new_page_number):
+        """ 
+            Moves the page having given number of this album into a new position, renumbering the pages
+            in between with three UPDATEs no matter how many of them there are. Raises Page.DoesNotExist,
+            if this album has no page having the given number.
+        """
+        page_count = self._lock_page_order()
+        if not 1 <= page_number <= page_count:
+            raise Page.DoesNotExist("Album %s has no page %s." % (self.pk, page_number))
+        new_page_number = min(max(new_page_number, 1), page_count)
+        if new_page_number == page_number:
+            return
 
-        order_total_price_before_vat = sub_total_price_for_all_albums + sub_total_shipping_expenses
+        Page.objects.filter(album = self, pageNumber = page_number).update(pageNumber = -new_page_number)
+        if new_page_number > page_number:
+            self._park_pages(page_number + 1, new_page_number, -1)
+        else:
+            self._park_pages(new_page_number, page_number - 1, 1)
+        self._unpark_pages()
+        self.refresh_cover()
 
-        vat_percentage = settings.VAT_PERCENTAGE
-        vat_amount = vat_percentage / 100.0 * order_total_price_before_vat
-        order_total_price = order_total_price_before_vat + vat_amount
+    @transaction.commit_on_success
+    def delete_page(self, page_number):
+        """ 
+            Deletes the page having given number from this album, renumbering the following pages
+            with two UPDATEs no matter how many of them there are. Returns True, if the page existed.
+        """
+        self._lock_page_order()
+        pages = list(Page.objects.filter(album = self, pageNumber = page_number)[:1])
+        if not pages:
+            return False
 
-        return {
-            "items_by_address": items_by_address,
-            "price_of_items": sub_total_price_for_all_albums,
-            "shipping_expenses": sub_total_shipping_expenses,
-            "order_total_price_before_vat": order_total_price_before_vat,
-            "vat_percentage": vat_percentage,
-            "vat_amount": vat_amount,
-            "order_total_price": order_total_price
-        }
+        pages[0].delete()
+        self._park_pages(page_number + 1, None, -1)
+        self._unpark_pages()
+        return True
 
-    def deletePage(self, page_number):
+    @transaction.commit_on_success
+    def reorder_pages(self, page_ids):
         """ 
-            Deletes the given page from this album.
+            Renumbers all pages of this album according to a list of their ids in the new order,
+            with a single UPDATE per BULK_UPDATE_CHUNK_SIZE pages and one more. Raises ValueError,
+            if the list does not contain the id of each page of this album exactly once.
         """
-        query = self.pages().filter(pageNumber = page_number)[:1]
-        if query:
-            #delete page
-            query[0].delete()
-            #then fix page numbers
-            query = self.pages().order_by("pageNumber")
-            counter = 0
-            for page in query.all():
-                counter += 1
-                page.pageNumber = counter
-                page.save()
+        self._lock_page_order()
+        current_page_ids = Page.objects.filter(album = self).values_list("id", flat = True)
+        if sorted(current_page_ids) != sorted(page_ids):
+            raise ValueError("The order must contain each page of album %s exactly once." % self.pk)
+
+        update_fields_by_pk(Page, ["pageNumber"],
+                            dict([(page_id, (-index,)) for (index, page_id) in enumerate(page_ids, 1)]))
+        self._unpark_pages()
+        self.refresh_cover()
 
     def as_api_dict(self):
         """ 
@@ -597,7 +911,7 @@ class Album(models.Model):
         """ 
             Returns a list of albums as an dictionary containing values wanted to be exposed in the public api.
         """
-        return [album.as_api_dict() for album in album_list]
+        return [album.as_api_dict() for album in Album.resolve_covers(album_list)]
 
     @staticmethod
     def latest_public_ones(how_many = 20):
@@ -608,7 +922,7 @@ class Album(models.Model):
             how_many = 1
         if how_many > 99:
             how_many = 99
-        return Album.objects.filter(isPublic__exact = True).order_by("-creationDate")[:how_many]
+        return Album.objects.select_related("owner").filter(isPublic__exact = True).order_by("-creationDate")[:how_many]
 
     @classmethod
     def latest_public_ones_as_json(cls, how_many = 20):
@@ -620,33 +934,21 @@ class Album(models.Model):
     @classmethod
     def pseudo_random_public_ones(cls, how_many = 4):
         """ 
-            Returns some pseudo-random publicly visible albums.
+            Returns some different publicly visible albums picked uniformly at random. The ids are
+            picked from an in-memory index of public albums, so only the albums themselves are queried.
+            Albums made private after the index was loaded are left out.
         """
         if how_many < 1:
             how_many = 1
         if how_many > 9:
             how_many = 9
 
-        max_album_id = Album.objects.aggregate(Max("id")).values()[0]
-        if not max_album_id:
+        album_ids = PUBLIC_ALBUM_IDS.sample(how_many, cls._randomizer)
+        if not album_ids:
             return []
 
-        albums = []
-        album_ids = []
-        missed_tries = 0
-        while len(albums) < how_many and missed_tries < 10:
-            base_album_id = cls._randomizer.randrange(0, max_album_id)
-            albumQuery = Album.objects.filter(id__gte = base_album_id, isPublic__exact = True).order_by("id")[:1]
-            album = albumQuery[0] if albumQuery else None
-            if album is None:
-                break
-            if not album.id in album_ids:
-                albums.append(album)
-                album_ids.append(album.id)
-            else:
-                missed_tries += 1
-
-        return albums
+        albums_by_id = Album.objects.filter(isPublic = True).select_related("owner").in_bulk(album_ids)
+        return [albums_by_id[album_id] for album_id in album_ids if album_id in albums_by_id]
 
     @classmethod
     def pseudo_random_public_ones_as_json(cls, how_many = 4):
@@ -655,12 +957,60 @@ class Album(models.Model):
         """
         return serialize_into_json(cls.list_as_api_dict(cls.pseudo_random_public_ones(how_many)))
 
+    def search_index_values(self, captions):
+        """ 
+            Returns a tuple of the values describing this album and its given captions
+            in the search index, in the order of the parameters of AlbumSearchIndex.update_album().
+        """
+        weighted_texts = [(self.title, SEARCH_WEIGHT_TITLE),
+                          (self.owner.username, SEARCH_WEIGHT_OWNER),
+                          (self.description, SEARCH_WEIGHT_DESCRIPTION)]
+        weighted_texts.extend([(caption, SEARCH_WEIGHT_CAPTION) for caption in captions])
+        return (self.id, self.owner_id, self.owner.username, self.isPublic, weighted_texts)
+
+    def update_search_index(self):
+        """ 
+            Stores the current title, description, owner's username and captions of this album
+            into the search index. Called automatically whenever they are changed.
+        """
+        if not ALBUM_SEARCH_INDEX.is_enabled():
+            return
+        captions = PageContent.captions().filter(page__album = self).values_list("content", flat = True)
+        ALBUM_SEARCH_INDEX.update_album(*self.search_index_values(captions))
+
+    @staticmethod
+    def update_search_index_by_id(album_id):
+        """ 
+            Updates the search index for an album having given id, or removes the album from the index,
+            if it does not exist anymore.
+        """
+        try:
+            Album.objects.select_related("owner").get(id = album_id).update_search_index()
+        except Album.DoesNotExist:
+            ALBUM_SEARCH_INDEX.remove_album(album_id)
+
+    @staticmethod
+    def search(query, user, how_many = 50):
+        """ 
+            Returns a list of at most how_many albums visible to given user and containing all the words
+            of the query in their titles, descriptions, owners' usernames or captions, best matches first.
+        """
+        user_id = user.id if user.is_authenticated() else None
+        results = ALBUM_SEARCH_INDEX.search(query, user_id, how_many = how_many)
+        albums_by_id = Album.objects.select_related("owner").in_bulk([album_id for (album_id, score) in results])
+        return [albums_by_id[album_id] for (album_id, score) in results
+                if album_id in albums_by_id and albums_by_id[album_id].is_visible_to_user(user)]
+
     class Meta():
         unique_together = ("owner", "title")
         ordering = ["owner", "title"]
         verbose_name = u"album"
         verbose_name_plural = u"albums"
 
+PUBLIC_ALBUM_IDS = IdIndex(Album, isPublic = True)
+
+ALBUM_SEARCH_INDEX = AlbumSearchIndex(getattr(settings, "SEARCH_INDEX_PATH", None))
+
 
 
 
@@ -704,6 +1054,16 @@ class Layout(models.Model):
         verbose_name = u"page layout"
         verbose_name_plural = u"page layouts"
 
+LAYOUT_TABLE = LookupTable(Layout)
+LAYOUT_STYLESHEET = CompiledStylesheet(Layout, "cssContent")
+
+@models.permalink
+def url_of_layout_stylesheet():
+    """ 
+        Returns the url of the current version of the stylesheet compiled from the CSS of all layouts.
+    """
+    return ("layout_stylesheet", (), {"version_hash": LAYOUT_STYLESHEET.version_hash()})
+
 
 
 
@@ -716,6 +1076,21 @@ class Page(models.Model):
         verbose_name = u"page number"
     )
     layout = models.ForeignKey(Layout)
+    coverContent = models.ForeignKey(
+        "PageContent",
+        null = True,
+        blank = True,
+        on_delete = models.SET_NULL,
+        related_name = "+",
+        verbose_name = u"cover content",
+        help_text = u"page content containing the cover image of this page, maintained automatically"
+    )
+    coverRenditions = models.TextField(
+        blank = True,
+        default = "",
+        verbose_name = u"cover renditions",
+        help_text = u"urls of the cover image as JSON, maintained automatically; empty if not resolved yet"
+    )
 
     def __unicode__(self):
         return u"%s, %s" % (self.album, self.pageNumber)
@@ -744,44 +1119,83 @@ class Page(models.Model):
             Returns the url of this page's small cover image, if one can be found. "Cover image" is the first
             found when iterating through pages content in ascending order.
             
-            If the small thumbnail of the image in question does not exist, existence of the larger thumbnail
-            is checked and its url is returned if the image exists. 
-            
-            If the large thumbnail of the image in question does not exist either,
+            If the thumbnails of the image in question have not been created yet,
             the url of the actual image is returned.
              
-            If there are no images on this page, this method returns an empty string. 
+            If there are no images on this page, the url of a placeholder image is returned. 
         """
-        for content in self.image_content():
-            if content.image:
-                if os.path.exists(content.image.small_thumbnail_path()):
-                    return content.image.small_thumbnail_url()
-                if os.path.exists(content.image.large_thumbnail_path()):
-                    return content.image.large_thumbnail_url()
-                return content.image.url
-        return PATH_OF_MISSING_COVER_IMAGE_SMALL
+        return self.cover_renditions().get("small", PATH_OF_MISSING_COVER_IMAGE_SMALL)
 
     def url_of_large_cover(self):
         """ 
             Returns the url of this page's large cover image, if one can be found. "Cover image" is the first
             found when iterating through pages content in ascending order.
             
-            If the large thumbnail of the image in question does not exist, existence of the smaller thumbnail
-            is checked and its url is returned if the image exists.
-            
-            If the small thumbnail of the image in question does not exist either,
+            If the thumbnails of the image in question have not been created yet,
             the url of the actual image is returned.
              
-            If there are no images on this page, this method returns an empty string. 
+            If there are no images on this page, the url of a placeholder image is returned. 
+        """
+        return self.cover_renditions().get("large", PATH_OF_MISSING_COVER_IMAGE_LARGE)
+
+    def cover_renditions(self):
+        """ 
+            Returns urls of this page's cover image as a dictionary, see PageContent.cover_renditions().
+            The urls are stored into the page itself, so normally no queries are needed. If there are
+            no images on this page, an empty dictionary is returned.
         """
+        if not self.coverRenditions:
+            self.refresh_cover(refresh_album = False)
+        return deserialize_cover_renditions(self.coverRenditions)
+
+    def refresh_cover(self, refresh_album = True):
+        """ 
+            Resolves the cover image of this page from its content and stores it into this page.
+            Unless told otherwise, refreshes also the cover of the album this page belongs to.
+            Called automatically whenever images of the page change.
+        """
+        self.coverContent = None
+        self.coverRenditions = serialize_cover_renditions({})
         for content in self.image_content():
             if content.image:
-                if os.path.exists(content.image.large_thumbnail_path()):
-                    return content.image.large_thumbnail_url()
-                if os.path.exists(content.image.small_thumbnail_path()):
-                    return content.image.small_thumbnail_url()
-                return content.image.url
-        return PATH_OF_MISSING_COVER_IMAGE_LARGE
+                self.coverContent = content
+                self.coverRenditions = serialize_cover_renditions(content.cover_renditions())
+                break
+
+        if self.pk is not None:
+            Page.objects.filter(pk = self.pk).update(coverContent = self.coverContent,
+                                                     coverRenditions = self.coverRenditions)
+        if refresh_album:
+            self.album.refresh_cover()
+
+    @staticmethod
+    def resolve_covers(pages):
+        """ 
+            Makes sure that the covers of given pages have been resolved, so that showing them needs
+            no further queries. Covers of the pages, which have not been resolved yet, are resolved all
+            at once with two queries no matter how many pages there are. Returns the pages as a list.
+        """
+        pages = list(pages)
+        unresolved_pages = [page for page in pages if not page.coverRenditions]
+        if not unresolved_pages:
+            return pages
+
+        unresolved_page_ids = [page.id for page in unresolved_pages]
+        cover_values_by_page_id = dict([(page_id, (None, serialize_cover_renditions({})))
+                                        for page_id in unresolved_page_ids])
+        image_contents = PageContent.objects.filter(page__in = unresolved_page_ids, kind = CONTENT_KIND_IMAGE) \
+                                .exclude(image = "").order_by("page", "-slot")
+        pages_with_cover = set()
+        for content in image_contents:
+            if content.page_id not in pages_with_cover:
+                pages_with_cover.add(content.page_id)
+                cover_values_by_page_id[content.page_id] = \
+                        (content.id, serialize_cover_renditions(content.cover_renditions()))
+
+        update_fields_by_pk(Page, ["coverContent", "coverRenditions"], cover_values_by_page_id)
+        for page in unresolved_pages:
+            (page.coverContent_id, page.coverRenditions) = cover_values_by_page_id[page.id]
+        return pages
 
     def content(self):
         """  
@@ -793,13 +1207,31 @@ class Page(models.Model):
         """  
         
         """
-        return self.content().filter(placeHolderID__contains = "_image_").order_by("-placeHolderID")
+        return self.content().filter(kind = CONTENT_KIND_IMAGE).order_by("-slot")
 
     def caption_content(self):
         """  
         
         """
-        return self.content().filter(placeHolderID__contains = "_caption_").order_by("-placeHolderID")
+        return self.content().filter(kind = CONTENT_KIND_CAPTION).order_by("-slot")
+
+    def layout_content(self, kind):
+        """ 
+            Returns a queryset of the contents of given kind in the placeholders of the current layout
+            of this page, leaving out the contents left from the layouts this page may have had before.
+        """
+        return PageContent.objects.filter(page = self, kind = kind, placeHolderID__startswith = self.layout.name + "_")
+
+    def save_contents(self, contents):
+        """ 
+            Saves given new or changed contents of this page, updating the search index only once
+            for all of them instead of once per caption saved.
+        """
+        for content in contents:
+            content._search_index_update_deferred = True
+            content.save()
+        if [content for content in contents if content.kind == CONTENT_KIND_CAPTION]:
+            update_search_index_after_page_contents_save(Page, self)
 
     @staticmethod
     def by_album_id_and_page_number(album_id, page_number):
@@ -827,6 +1259,86 @@ class Page(models.Model):
             return None
         return page_queryset[0]
 
+    @staticmethod
+    def view_info(album_id, page_number, secret_hash = None):
+        """ 
+            Returns everything needed for showing a single page of an album with links to its neighbouring
+            pages, see Page.window_info(). If a secret hash is given, the album must have it.
+            
+            Returns a dictionary containing keys "album" and "page", which are None if they do not exist,
+            "contents" containing a list of the page's content, and "has_previous_page" and "has_next_page".
+        """
+        window = Page.window_info(album_id, page_number, 1, secret_hash)
+        if window["pages"]:
+            info = window["pages"][0]
+        else:
+            info = {"page": None, "contents": [], "has_previous_page": False, "has_next_page": False}
+        info["album"] = window["album"]
+        return info
+
+    @staticmethod
+    def window_info(album_id, first_page_number, how_many, secret_hash = None):
+        """ 
+            Returns everything needed for showing a window of consecutive pages of an album with links
+            to their neighbouring pages. The pages are fetched together with their album and the pages
+            right before and after the window in one query, and their content in another one. Layouts
+            are taken from the layout table cached in memory. If a secret hash is given, the album must have it.
+            
+            Returns a dictionary containing keys "album", which is None if the album does not exist,
+            and "pages" containing a list of the existing pages of the window in ascending order. Each of
+            them is a dictionary containing keys "page", "contents" containing a list of the page's content,
+            and "has_previous_page" and "has_next_page".
+        """
+        first_page_number = int(first_page_number)
+        last_page_number = first_page_number + max(int(how_many), 1) - 1
+        page_queryset = Page.objects.select_related("album__owner").filter(
+            album__id__exact = album_id,
+            pageNumber__range = (first_page_number - 1, last_page_number + 1)
+        )
+        if secret_hash is not None:
+            page_queryset = page_queryset.filter(album__secretHash__exact = secret_hash)
+
+        album = None
+        existing_page_numbers = set()
+        pages = []
+        for page in page_queryset.order_by("pageNumber"):
+            album = page.album
+            existing_page_numbers.add(page.pageNumber)
+            if first_page_number <= page.pageNumber <= last_page_number:
+                page.layout = LAYOUT_TABLE.by_pk(page.layout_id)
+                pages.append(page)
+
+        if album is None:
+            if secret_hash is None:
+                album = Album.by_id(album_id)
+            else:
+                album = Album.by_id_and_secret_hash(album_id, secret_hash)
+            return {"album": album, "pages": []}
+
+        contents_by_page_id = Page.contents_by_page_id(pages)
+        page_infos = []
+        for page in pages:
+            page.album = album
+            page_infos.append({
+                "page": page,
+                "contents": contents_by_page_id[page.id],
+                "has_previous_page": page.pageNumber - 1 in existing_page_numbers,
+                "has_next_page": page.pageNumber + 1 in existing_page_numbers
+            })
+        return {"album": album, "pages": page_infos}
+
+    @staticmethod
+    def contents_by_page_id(pages):
+        """ 
+            Fetches the content of given pages all at once with a single query, no matter how many pages
+            there are. Returns a dictionary mapping the id of each page to a list of its content.
+        """
+        contents_by_page_id = dict([(page.id, []) for page in pages])
+        if contents_by_page_id:
+            for content in PageContent.objects.filter(page__in = contents_by_page_id.keys()):
+                contents_by_page_id[content.page_id].append(content)
+        return contents_by_page_id
+
     class Meta():
         unique_together = ("album", "pageNumber")
         ordering = ["album", "pageNumber"]
@@ -843,7 +1355,7 @@ def get_album_photo_upload_path(page_content_model_instance, original_filename):
     user_id = unicode(page_content_model_instance.page.album.owner.id)
     album_id = unicode(page_content_model_instance.page.album.id)
     page_number = unicode(page_content_model_instance.page.pageNumber)
-    placeholder_number = unicode(page_content_model_instance.placeHolderID.split("_")[-1])
+    placeholder_number = unicode(parse_placeholder_id(page_content_model_instance.placeHolderID)[1])
     extension = original_filename.split('.')[-1]
 
     security_hash_base = user_id + album_id + page_number + placeholder_number + unicode(settings.SECRET_KEY)
@@ -859,6 +1371,18 @@ def get_album_photo_upload_path(page_content_model_instance, original_filename):
 
     return path
 
+def parse_placeholder_id(placeholder_id):
+    """
+        Returns a tuple of the kind of content and the slot number declared by given placeholder id,
+        like (CONTENT_KIND_IMAGE, 2) for "SingleImage_image_2".
+    """
+    parts = placeholder_id.split("_")
+    kind = CONTENT_KIND_OTHER
+    if len(parts) >= 3 and parts[-2] in (CONTENT_KIND_IMAGE, CONTENT_KIND_CAPTION):
+        kind = parts[-2]
+    slot = int(parts[-1]) if parts[-1].isdigit() else 0
+    return (kind, slot)
+
 class PageContent(models.Model):
     """ 
         Represents a single piece of content in a placeholder.
@@ -868,23 +1392,286 @@ class PageContent(models.Model):
         max_length = 255,
         verbose_name = u"placeholder id"
     )
+    kind = models.CharField(
+        max_length = 10,
+        choices = CONTENT_KIND_CHOICES,
+        default = CONTENT_KIND_OTHER,
+        verbose_name = u"kind",
+        help_text = u"kind of the content, parsed automatically from the placeholder id"
+    )
+    slot = models.PositiveSmallIntegerField(
+        default = 0,
+        verbose_name = u"slot",
+        help_text = u"number of the placeholder among the ones of the same kind in the layout, " +
+                    u"parsed automatically from the placeholder id"
+    )
     content = models.CharField(
         max_length = 255
     )
     image = AlbumizerImageField(
         upload_to = get_album_photo_upload_path,
         blank = True,
-        max_length = 255
+        max_length = 255,
+        renditions = [
+            Rendition(FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL, 100, 100),
+            Rendition("thumb-medium", 200, 200),
+            Rendition(FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL, 300, 300),
+            Rendition("thumb-xlarge", 600, 600, quality = 80)
+        ],
+        rendition_status_field = "imageRenditionStatus",
+        rendition_manifest_field = "imageRenditions"
+    )
+    imageRenditionStatus = models.CharField(
+        max_length = 10,
+        choices = RENDITION_STATUS_CHOICES,
+        default = RENDITION_STATUS_READY,
+        verbose_name = u"image rendition status",
+        help_text = u"state of creating the thumbnails of the image, which is done in the background"
+    )
+    imageRenditions = models.TextField(
+        blank = True,
+        default = "",
+        verbose_name = u"image renditions",
+        help_text = u"manifest of the existing thumbnails of the image as JSON, " +
+                    u"containing their widths, heights and sizes in bytes"
     )
 
     def __unicode__(self):
         return u"%s, %s, %s" % (self.page, self.placeHolderID, self.content)
 
+    def save(self, *args, **kwargs):
+        """ 
+            Saves this content, keeping its kind and slot number in line with its placeholder id.
+        """
+        (self.kind, self.slot) = parse_placeholder_id(self.placeHolderID)
+        super(PageContent, self).save(*args, **kwargs)
+
+    @staticmethod
+    def captions():
+        """ 
+            Returns a queryset of the non-empty captions of all pages.
+        """
+        return PageContent.objects.filter(kind = CONTENT_KIND_CAPTION).exclude(content = "")
+
+    def url_of_rendition(self, *rendition_names):
+        """ 
+            Returns the url of the first existing thumbnail of this content's image out of the ones
+            with given names, or the url of the image itself, if none of them exist. Existence
+            is checked from the rendition manifest, so no file system access is needed.
+        """
+        manifest = self.image.rendition_manifest()
+        for rendition_name in rendition_names:
+            if rendition_name in manifest:
+                return self.image.rendition_url(rendition_name)
+        return self.image.url
+
+    def url_of_small_rendition(self):
+        """ 
+            Returns the url of the small thumbnail of this content's image. If the small thumbnail does
+            not exist, the url of the large thumbnail is returned, or the url of the image itself,
+            if neither of them exist.
+        """
+        return self.url_of_rendition(FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL, FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL)
+
+    def url_of_large_rendition(self):
+        """ 
+            Returns the url of the large thumbnail of this content's image. If the large thumbnail does
+            not exist, the url of the small thumbnail is returned, or the url of the image itself,
+            if neither of them exist.
+        """
+        return self.url_of_rendition(FILE_EXTENSION_PREFIX_LARGE_THUMBNAIL, FILE_EXTENSION_PREFIX_SMALL_THUMBNAIL)
+
+    def rendition_srcset(self):
+        """ 
+            Returns a srcset attribute value listing the existing thumbnails of this content's image,
+            or an empty string, if there are none.
+        """
+        return self.image.srcset()
+
+    def cover_renditions(self):
+        """ 
+            Returns urls needed to show this content's image as a cover as a dictionary containing
+            keys "small" and "large" for the urls of the small and large cover images and "srcset"
+            for the srcset attribute listing all thumbnails.
+        """
+        return {
+            "small": self.url_of_small_rendition(),
+            "large": self.url_of_large_rendition(),
+            "srcset": self.rendition_srcset()
+        }
+
     class Meta():
         unique_together = ("page", "placeHolderID")
         verbose_name = u"page content"
         verbose_name_plural = u"page contents"
 
+def refresh_page_cover_after_content_save(sender, instance, created, **kwargs):
+    """
+        Post-save event handler to keep the cover of a page up to date when its images are changed.
+    """
+    if instance.kind == CONTENT_KIND_IMAGE and (instance.image or not created):
+        instance.page.refresh_cover()
+
+def refresh_page_cover_after_content_delete(sender, instance, **kwargs):
+    """
+        Post-delete event handler to keep the cover of a page up to date when its images are deleted.
+    """
+    if instance.image:
+        try:
+            instance.page.refresh_cover()
+        except (Page.DoesNotExist, Album.DoesNotExist):
+            pass
+
+def refresh_page_cover_after_renditions(sender, instance, **kwargs):
+    """
+        Event handler to update urls of a cover image after its thumbnails have been created.
+    """
+    try:
+        instance.page.refresh_cover()
+    except (Page.DoesNotExist, Album.DoesNotExist):
+        pass
+
+def refresh_album_page_count_after_page_change(sender, instance, created = True, **kwargs):
+    """
+        Post-save and post-delete event handler to keep the page count and the unit price of an album
+        up to date when pages are added or deleted.
+    """
+    if created:
+        try:
+            instance.album.refresh_page_count()
+        except Album.DoesNotExist:
+            pass
+
+def refresh_album_cover_after_page_delete(sender, instance, **kwargs):
+    """
+        Post-delete event handler to keep the cover of an album up to date when its pages are deleted.
+    """
+    try:
+        instance.album.refresh_cover()
+    except Album.DoesNotExist:
+        pass
+
+post_save.connect(refresh_page_cover_after_content_save, sender = PageContent,
+                  dispatch_uid = "albumizer-models-page-cover-content-save")
+post_delete.connect(refresh_page_cover_after_content_delete, sender = PageContent,
+                    dispatch_uid = "albumizer-models-page-cover-content-delete")
+renditions_processed.connect(refresh_page_cover_after_renditions, sender = PageContent,
+                             dispatch_uid = "albumizer-models-page-cover-renditions")
+post_delete.connect(refresh_album_cover_after_page_delete, sender = Page,
+                    dispatch_uid = "albumizer-models-album-cover-page-delete")
+post_save.connect(refresh_album_page_count_after_page_change, sender = Page,
+                  dispatch_uid = "albumizer-models-album-page-count-page-save")
+post_delete.connect(refresh_album_page_count_after_page_change, sender = Page,
+                    dispatch_uid = "albumizer-models-album-page-count-page-delete")
+
+def search_index_errors_logged(handler):
+    """
+        Decorator for event handlers updating the search index. Errors of the index, like a full disk,
+        are logged instead of making the saving or deleting fail, as the index can be rebuilt later
+        with the rebuild_albumizer_search_index management command.
+    """
+    def handle_event(sender, instance, **kwargs):
+        try:
+            handler(sender, instance, **kwargs)
+        except (sqlite3.Error, OSError) as e:
+            commonLogger.error(u"Updating the search index failed after a change of %s %s: %s" %
+                               (sender.__name__, instance.pk, unicode(str(e), errors = "ignore")))
+    return handle_event
+
+# ids of the albums being deleted mapped to the ids of their pages, so that the search index is not
+# updated for every page and caption deleted along with an album
+_pages_of_albums_being_deleted = {}
+
+def _is_deleted_along_with_album(page_id):
+    for page_ids in _pages_of_albums_being_deleted.values():
+        if page_id in page_ids:
+            return True
+    return False
+
+def remember_album_being_deleted(sender, instance, **kwargs):
+    """
+        Pre-delete event handler remembering the pages of an album being deleted, so that their deletion
+        does not update the search index, from which the whole album is removed anyway.
+    """
+    _pages_of_albums_being_deleted[instance.id] = \
+        frozenset(Page.objects.filter(album = instance.id).values_list("id", flat = True))
+
+@search_index_errors_logged
+def update_search_index_after_album_save(sender, instance, raw = False, **kwargs):
+    """
+        Post-save event handler to keep the search index up to date when albums are changed.
+    """
+    # an album is saved after a failed deletion only if it still exists
+    _pages_of_albums_being_deleted.pop(instance.id, None)
+    if not raw:
+        instance.update_search_index()
+
+@search_index_errors_logged
+def update_search_index_after_album_delete(sender, instance, **kwargs):
+    """
+        Post-delete event handler to remove deleted albums from the search index.
+    """
+    _pages_of_albums_being_deleted.pop(instance.id, None)
+    ALBUM_SEARCH_INDEX.remove_album(instance.id)
+
+@search_index_errors_logged
+def update_search_index_after_page_delete(sender, instance, **kwargs):
+    """
+        Post-delete event handler to keep the search index up to date when pages having captions are deleted.
+        Pages deleted along with their album are skipped.
+    """
+    if instance.album_id in _pages_of_albums_being_deleted:
+        return
+    Album.update_search_index_by_id(instance.album_id)
+
+@search_index_errors_logged
+def update_search_index_after_content_change(sender, instance, created = False, raw = False, **kwargs):
+    """
+        Post-save and post-delete event handler to keep the search index up to date when captions are changed.
+        Deleted captions of deleted pages are handled by update_search_index_after_page_delete(), and
+        the contents saved with Page.save_contents() by update_search_index_after_page_contents_save().
+        Captions deleted along with their album are skipped.
+    """
+    if raw or instance.kind != CONTENT_KIND_CAPTION or (created and not instance.content):
+        return
+    if getattr(instance, "_search_index_update_deferred", False) or _is_deleted_along_with_album(instance.page_id):
+        return
+    try:
+        Album.update_search_index_by_id(instance.page.album_id)
+    except Page.DoesNotExist:
+        pass
+
+@search_index_errors_logged
+def update_search_index_after_page_contents_save(sender, instance, **kwargs):
+    """
+        Keeps the search index up to date after Page.save_contents() has saved several contents of a page.
+    """
+    Album.update_search_index_by_id(instance.album_id)
+
+@search_index_errors_logged
+def update_search_index_after_user_save(sender, instance, raw = False, **kwargs):
+    """
+        Post-save event handler to keep the search index up to date when usernames are changed.
+    """
+    if not raw:
+        for album_id in ALBUM_SEARCH_INDEX.album_ids_with_stale_owner_name(instance.id, instance.username):
+            Album.update_search_index_by_id(album_id)
+
+post_save.connect(update_search_index_after_album_save, sender = Album,
+                  dispatch_uid = "albumizer-models-search-index-album-save")
+pre_delete.connect(remember_album_being_deleted, sender = Album,
+                   dispatch_uid = "albumizer-models-search-index-album-pre-delete")
+post_delete.connect(update_search_index_after_album_delete, sender = Album,
+                    dispatch_uid = "albumizer-models-search-index-album-delete")
+post_delete.connect(update_search_index_after_page_delete, sender = Page,
+                    dispatch_uid = "albumizer-models-search-index-page-delete")
+post_save.connect(update_search_index_after_content_change, sender = PageContent,
+                  dispatch_uid = "albumizer-models-search-index-content-save")
+post_delete.connect(update_search_index_after_content_change, sender = PageContent,
+                    dispatch_uid = "albumizer-models-search-index-content-delete")
+post_save.connect(update_search_index_after_user_save, sender = User,
+                  dispatch_uid = "albumizer-models-search-index-user-save")
+
 
 
 
@@ -912,16 +1699,18 @@ class Country(models.Model):
         """ 
             Returns a country having given code, if one exists. Otherwise returns None.
         """
-        country_resultset = Country.objects.filter(code__exact = country_code)
-        if not country_resultset:
+        try:
+            return COUNTRY_TABLE.by_pk(country_code)
+        except Country.DoesNotExist:
             return None
-        return country_resultset[0]
 
     class Meta():
         ordering = ["name"]
         verbose_name = u"country"
         verbose_name_plural = u"countries"
 
+COUNTRY_TABLE = LookupTable(Country)
+
 
 
 
@@ -942,6 +1731,8 @@ class State(models.Model):
         verbose_name = u"state"
         verbose_name_plural = u"states"
 
+STATE_TABLE = LookupTable(State)
+
 
 
 
@@ -1014,6 +1805,13 @@ class Address(models.Model):
         """
         return Address.objects.filter(owner__exact = user)
 
+    @staticmethod
+    def addresses_of_user_with_owners_and_regions(user):
+        """ 
+            Return a queryset of all addresses of given user preloading their owners, states and countries.
+        """
+        return Address.objects.select_related('owner', 'state', 'country').filter(owner__exact = user)
+
     class Meta():
         ordering = ["owner", "postAddressLine1"]
         verbose_name = u"address"
@@ -1022,6 +1820,10 @@ class Address(models.Model):
 
 
 
+CHECKOUT_STEP_DELIVERY_ADDRESSES = "delivery-addresses"
+CHECKOUT_STEP_ORDER_SUMMARY = "order-summary"
+CHECKOUT_STEP_PLACE_ORDER = "place-order"
+
 class ShoppingCartItem(models.Model):
     """ 
         Contains items, which a user currently has his/her shopping cart.
@@ -1067,25 +1869,27 @@ class ShoppingCartItem(models.Model):
         """ 
             Return a queryset of all items in given user's shopping cart preloading albums. 
         """
-        return ShoppingCartItem.objects.select_related('album').filter(user__exact = user)
+        return ShoppingCartItem.objects.select_related('album', 'album__owner').filter(user__exact = user)
 
     @staticmethod
     def items_of_user_with_albums_and_addresses(user):
         """ 
             Return a queryset of all items in given user's shopping cart preloading albums and addresses.
         """
-        return ShoppingCartItem.objects.select_related('album', 'deliveryAddress').filter(user__exact = user)
+        return ShoppingCartItem.objects.select_related('album', 'album__owner', 'deliveryAddress',
+                                                       'deliveryAddress__state', 'deliveryAddress__country') \
+                                       .filter(user__exact = user)
 
     @staticmethod
     def cart_info_for_user(user):
         """ 
             Returns information about items in given user's shopping cart.
             
-            Returns a dictionary, see Album.price_for_several_albums_excluding_vat_and_shipping().
+            Returns a dictionary, see pricing.price_albums_excluding_vat_and_shipping().
         """
         items = ShoppingCartItem.items_of_user_with_albums(user)
         album_count_list = [(i.album, i.count) for i in items]
-        return Album.price_for_several_albums_excluding_vat_and_shipping(album_count_list)
+        return price_albums_excluding_vat_and_shipping(album_count_list)
 
     @staticmethod
     def order_info_for_user(user):
@@ -1093,11 +1897,11 @@ class ShoppingCartItem(models.Model):
             Returns information about items in given user's shopping cart
             treating the cart content as a complete order.
             
-            Returns a dictionary, see Album.price_for_several_albums_including_vat_and_shipping().
+            Returns a dictionary, see pricing.price_albums_including_vat_and_shipping().
         """
-        items = ShoppingCartItem.items_of_user_with_albums(user)
+        items = ShoppingCartItem.items_of_user_with_albums_and_addresses(user)
         album_count_address_list = [(i.album, i.count, i.deliveryAddress) for i in items]
-        return Album.price_for_several_albums_including_vat_and_shipping(album_count_address_list)
+        return price_albums_including_vat_and_shipping(album_count_address_list)
 
     @staticmethod
     def does_exist(user, album_id):
@@ -1124,53 +1928,138 @@ class ShoppingCartItem(models.Model):
         """
         ShoppingCartItem.objects.get(user = user, album = album_id).delete()
 
+    @staticmethod
+    @transaction.commit_on_success
+    def update_items_of_user(user, new_counts_by_album_id):
+        """ 
+            Updates the counts of several items in given user's shopping cart at once. new_counts_by_album_id
+            is a dictionary mapping ids of albums to their new counts, zero meaning removal of the item.
+            Items are removed with a single DELETE and the counts updated with a single UPDATE per
+            BULK_UPDATE_CHUNK_SIZE items, and only albums not found from the cart are checked for existence,
+            so the whole update needs a handful of queries no matter how many items there are.
+            
+            Returns a dictionary containing keys "missing_album_ids" and "missing_item_album_ids" containing
+            sorted lists of ids of the albums, which do not exist or are not in the cart, respectively,
+            "items" containing a list of the items left in the cart with their albums, and "cart_info"
+            containing information about them, see cart_info_for_user().
+        """
+        items = list(ShoppingCartItem.items_of_user_with_albums(user))
+        items_by_album_id = dict([(item.album_id, item) for item in items])
+
+        album_ids_not_in_cart = [album_id for album_id in new_counts_by_album_id if album_id not in items_by_album_id]
+        existing_album_ids = set()
+        if album_ids_not_in_cart:
+            existing_album_ids = set(Album.objects.filter(id__in = album_ids_not_in_cart)
+                                                  .values_list("id", flat = True))
+
+        ids_of_items_to_remove = []
+        new_counts_by_item_id = {}
+        for (album_id, new_count) in new_counts_by_album_id.items():
+            item = items_by_album_id.get(album_id)
+            if item is None:
+                continue
+            if new_count == 0:
+                ids_of_items_to_remove.append(item.id)
+                del items_by_album_id[album_id]
+            elif new_count != item.count:
+                new_counts_by_item_id[item.id] = (new_count,)
+                item.count = new_count
+
+        delete_rows_by_pk(ShoppingCartItem, ids_of_items_to_remove)
+        update_fields_by_pk(ShoppingCartItem, ["count"], new_counts_by_item_id)
+        if ids_of_items_to_remove or new_counts_by_item_id:
+            ShoppingCartItem.cart_changed(user)
+
+        items = [item for item in items if item.album_id in items_by_album_id]
+        return {
+            "missing_album_ids": sorted([album_id for album_id in album_ids_not_in_cart
+                                         if album_id not in existing_album_ids]),
+            "missing_item_album_ids": sorted([album_id for album_id in album_ids_not_in_cart
+                                              if album_id in existing_album_ids]),
+            "items": items,
+            "cart_info": price_albums_excluding_vat_and_shipping([(item.album, item.count) for item in items])
+        }
+
     @staticmethod
     def remove_all_items_of_user(user):
         """ 
             Removes all items of given user from user's shopping cart. 
             Caller handles all exceptions (e.g. ShoppingCartItem.DoesNotExist).
         """
-        ShoppingCartItem.objects.filter(user__exact = user).delete()
+        item_ids = list(ShoppingCartItem.objects.filter(user__exact = user).values_list("id", flat = True))
+        if item_ids:
+            delete_rows_by_pk(ShoppingCartItem, item_ids)
+            ShoppingCartItem.cart_changed(user)
 
     @staticmethod
-    def validation_hash_for_shopping_cart(request, exclude_addresses = True, extra_key = None):
+    def set_delivery_addresses(user, item_address_pairs):
         """ 
-            Generates a hash which can be used to ensure that content
-            of shopping cart does not change during checkout process.
+            Sets delivery addresses of items in given user's shopping cart. item_address_pairs
+            is a sequence of tuples of an item and its new delivery address. The items, whose
+            address changes, are updated in a single statement.
         """
-        hash_base = unicode(request.user.username) + request.META.get("REMOTE_ADDR", "") + \
-                    request.META.get("REMOTE_HOST", "") + request.META.get("HTTP_USER_AGENT", "") + \
-                    settings.SECRET_KEY
+        new_addresses_by_item_id = {}
+        for (item, address) in item_address_pairs:
+            if item.deliveryAddress_id != address.pk:
+                new_addresses_by_item_id[item.pk] = (address.pk,)
+                item.deliveryAddress = address
 
-        if extra_key:
-            hash_base += extra_key
+        if new_addresses_by_item_id:
+            update_fields_by_pk(ShoppingCartItem, ["deliveryAddress"], new_addresses_by_item_id)
+            ShoppingCartItem.cart_changed(user)
 
-        items = ShoppingCartItem.items_of_user(request.user)
-        if exclude_addresses:
-            for item in items:
-                hash_base += unicode(item.album) + unicode(item.count)
-        else:
-            for item in items:
-                hash_base += unicode(item.album) + unicode(item.count) + unicode(item.deliveryAddress)
+    @staticmethod
+    def cart_changed(user):
+        """ 
+            Increases the version of given user's shopping cart, so that the checkout tokens given for
+            the previous versions are not valid anymore. Called automatically whenever a single item is
+            saved or deleted, also when it is deleted along with its album, but must be called once after
+            changing items in bulk with QuerySet.update(), update_fields_by_pk() or delete_rows_by_pk().
 
-        return hashlib.sha256(hash_base.encode("ascii", "backslashreplace")).hexdigest()
+            Returns the new version. It is read in the same transaction as it is increased in, so no
+            other request can change the cart in between, and the caller can tell whether the cart
+            has changed since a version it knows.
+        """
+        if transaction.is_managed():
+            return ShoppingCartItem._increase_cart_version(user)
+        return transaction.commit_on_success(ShoppingCartItem._increase_cart_version)(user)
 
     @staticmethod
-    def is_validation_hash_valid(request, exclude_addresses = True, extra_key = None):
+    def _increase_cart_version(user):
+        UserProfile.objects.filter(user = user).update(cartVersion = F("cartVersion") + 1)
+        return ShoppingCartItem.cart_version_of_user(user)
+
+    @staticmethod
+    def cart_version_of_user(user):
         """ 
-            Validates hash returned by ShoppingCartItem.validation_hash_for_shopping_cart().
+            Returns the current version of given user's shopping cart.
         """
-        if request.method == "GET":
-            given_hash = request.GET.get("v")
-        else:
-            given_hash = request.POST.get("v")
+        versions = UserProfile.objects.filter(user = user).values_list("cartVersion", flat = True)[:1]
+        return versions[0] if versions else 0
 
-        if not given_hash:
-            return False
-
-        our_hash = ShoppingCartItem.validation_hash_for_shopping_cart(request, exclude_addresses, extra_key)
+    @staticmethod
+    def checkout_token(user, step, cart_version = None):
+        """ 
+            Returns a token, which lets given user proceed to given step of the checkout process
+            (one of the CHECKOUT_STEP_* constants) as long as the shopping cart does not change.
+            The token is a HMAC of the user, the step and the version of the cart, so creating
+            and validating it needs at most a single query no matter how many items there are.
+        """
+        if cart_version is None:
+            cart_version = ShoppingCartItem.cart_version_of_user(user)
+        value = u"%s:%s:%s" % (user.id, cart_version, step)
+        return salted_hmac("albumizer.models.ShoppingCartItem.checkout_token", value).hexdigest()
 
-        return our_hash == given_hash
+    @staticmethod
+    def is_checkout_token_valid(user, step, token, cart_version = None):
+        """ 
+            Validates a token returned by ShoppingCartItem.checkout_token() against the current
+            version of given user's shopping cart.
+        """
+        if not token:
+            return False
+        return constant_time_compare(token.encode("ascii", "replace"),
+                                     ShoppingCartItem.checkout_token(user, step, cart_version))
 
     def __unicode__(self):
         return u"%s, %s, %d, %s" % (self.user, self.album, self.count, self.additionDate)
@@ -1181,6 +2070,19 @@ class ShoppingCartItem(models.Model):
         verbose_name = u"shopping cart item"
         verbose_name_plural = u"shopping cart items"
 
+def change_cart_version_after_item_change(sender, instance, **kwargs):
+    """
+        Post-save and post-delete event handler to invalidate the checkout tokens of a user whenever
+        a single item in his/her shopping cart is saved or deleted, also when it is deleted along with
+        its album or edited in the admin site. Items changed in bulk are handled by the callers.
+    """
+    ShoppingCartItem.cart_changed(instance.user_id)
+
+post_save.connect(change_cart_version_after_item_change, sender = ShoppingCartItem,
+                  dispatch_uid = "albumizer-models-cart-version-item-save")
+post_delete.connect(change_cart_version_after_item_change, sender = ShoppingCartItem,
+                    dispatch_uid = "albumizer-models-cart-version-item-delete")
+
 
 
 
@@ -1193,6 +2095,8 @@ class OrderStatus(models.Model):
         in use, and absence of any of those records is an error situation anyway. If we had logging and
         email capability, the existence of those records could be checked e.g. at startup or so and a report
         could be made if necessary.    
+        
+        The records are read from ORDER_STATUS_TABLE, so they are fetched from the database only once.
     """
     code = models.CharField(
         unique = True,
@@ -1205,14 +2109,14 @@ class OrderStatus(models.Model):
         """ 
             Returns an OrderStatus, in which the order has been made but not paid yet. 
         """
-        return OrderStatus.objects.get(code__exact = "ordered")
+        return ORDER_STATUS_TABLE.get("ordered")
 
     @staticmethod
     def paid_and_being_processed():
         """ 
             Returns an OrderStatus, in which the order is already paid and is currently being processed. 
         """
-        return OrderStatus.objects.get(code__exact = "paid")
+        return ORDER_STATUS_TABLE.get("paid")
 
     @staticmethod
     def blocked():
@@ -1220,14 +2124,21 @@ class OrderStatus(models.Model):
             Returns an OrderStatus, in which the order is already paid but the
             processing of the order is prevented for some reason.
         """
-        return OrderStatus.objects.get(code__exact = "blocked")
+        return ORDER_STATUS_TABLE.get("blocked")
 
     @staticmethod
     def sent():
         """ 
             Returns an OrderStatus, in which the order is already processed and sent to the customer. 
         """
-        return OrderStatus.objects.get(code__exact = "sent")
+        return ORDER_STATUS_TABLE.get("sent")
+
+    @staticmethod
+    def by_id(status_id):
+        """ 
+            Returns an OrderStatus having given id. 
+        """
+        return ORDER_STATUS_TABLE.by_pk(status_id)
 
     def __unicode__(self):
         return self.code
@@ -1237,6 +2148,8 @@ class OrderStatus(models.Model):
         verbose_name = u"order status"
         verbose_name_plural = u"order statuses"
 
+ORDER_STATUS_TABLE = LookupTable(OrderStatus, "code")
+
 
 
 
@@ -1255,6 +2168,21 @@ class Order(models.Model):
         max_length = 255,
         help_text = u"clarification of the current state of the order and the reasons for it, if necessary"
     )
+    totalPrice = models.DecimalField(
+        max_digits = 10,
+        decimal_places = 2,
+        null = True,
+        blank = True,
+        verbose_name = u"total price [€]",
+        help_text = u"price of the order including VAT and shipping at the time of ordering"
+    )
+    priceSnapshot = models.TextField(
+        blank = True,
+        default = "",
+        verbose_name = u"price snapshot",
+        help_text = u"totals of the order as JSON at the time of ordering; " + \
+                    u"empty for old orders until they are shown for the first time"
+    )
 
     @staticmethod
     def by_id(order_id):
@@ -1267,52 +2195,114 @@ class Order(models.Model):
         return order_resultset[0]
 
     @staticmethod
-    def create_from_shopping_cart_for_user(user):
+    @transaction.commit_on_success
+    def create_from_shopping_cart_for_user(user, expected_cart_version = None):
         """
             Creates a new order based on the current content of given user's shopping cart.
             Returns the created Order instance.
             
-            If given user's shopping cart is empty, a ShoppingCartEmptyError will be raised. 
-        """
-        cart_items = ShoppingCartItem.items_of_user(user)
+            If given user's shopping cart is empty, a ShoppingCartEmptyError will be raised. If an expected
+            version of the cart is given, e.g. the one the user has seen the summary of the order of, and
+            the cart has changed since that version, a ShoppingCartChangedError will be raised.
+
+            The order is created in a single transaction, so that either the whole order is created
+            and the cart emptied or nothing changes. The items are inserted with one statement, and
+            the cart is locked first by increasing its version, so that two concurrent requests of
+            the same user cannot order the same cart twice.
+        """
+        cart_version = ShoppingCartItem.cart_changed(user)
+        if expected_cart_version is not None and cart_version != expected_cart_version + 1:
+            raise ShoppingCartChangedError("The shopping cart has changed after the order was confirmed.")
+        cart_items = list(ShoppingCartItem.items_of_user_with_albums_and_addresses(user))
         if not cart_items:
             raise ShoppingCartEmptyError("Unable to create an order from an empty shopping cart.")
 
+        order_info = price_albums_including_vat_and_shipping(
+                        [(i.album, i.count, i.deliveryAddress) for i in cart_items])
         new_order = Order(
             orderer = user,
-            status = OrderStatus.ordered()
+            status = OrderStatus.ordered(),
+            totalPrice = order_info["order_total_price"],
+            priceSnapshot = json.dumps(snapshot_of_order_info(order_info), sort_keys = True)
         )
         new_order.save()
+        OrderStatusChange(order = new_order, status = new_order.status).save()
 
-        for cart_item in cart_items:
-            new_order_item = OrderItem(
-                order = new_order,
-                album = cart_item.album,
-                count = cart_item.count,
-                deliveryAddress = cart_item.deliveryAddress
-            )
-            new_order_item.save()
+        insert_rows(OrderItem, ["order", "album", "count", "deliveryAddress", "unitPrice"],
+                    [(new_order.pk, i.album_id, i.count, i.deliveryAddress_id, money(i.album.unitPrice))
+                     for i in cart_items])
 
-        cart_items.delete()
+        # only the items ordered are removed, so that items added meanwhile are left in the cart;
+        # the version of the cart has already been changed above
+        delete_rows_by_pk(ShoppingCartItem, [i.pk for i in cart_items])
 
         return new_order
 
+    def store_price_snapshot(self, items = None):
+        """ 
+            Prices this order based on the unit prices stored on its items and stores the result as
+            the prices of this order at the time of ordering. Orders made before price snapshots
+            existed get their snapshot automatically when they are shown for the first time.
+
+            Only items having no unit price yet, i.e. the ones of orders made before unit prices were
+            stored on the items, get the current price of their album, so that the prices of an order
+            never drift along with the prices of the albums.
+        """
+        if items is None:
+            items = list(self.items())
+
+        items_without_price = [i for i in items if i.unitPrice is None]
+        for item in items_without_price:
+            item.unitPrice = money(item.album.unitPrice)
+        update_fields_by_pk(OrderItem, ["unitPrice"], dict([(i.pk, (i.unitPrice,)) for i in items_without_price]))
+
+        order_info = price_albums_including_vat_and_shipping(
+                        [(i.album, i.count, i.deliveryAddress, i.unitPrice) for i in items], self.purchaseDate)
+        self.totalPrice = order_info["order_total_price"]
+        self.priceSnapshot = json.dumps(snapshot_of_order_info(order_info), sort_keys = True)
+        Order.objects.filter(pk = self.pk).update(totalPrice = self.totalPrice, priceSnapshot = self.priceSnapshot)
+
+    def total_price(self):
+        """ 
+            Returns the price of this order including VAT and shipping at the time of ordering.
+        """
+        if not self.priceSnapshot:
+            self.store_price_snapshot()
+        return self.totalPrice
 
     def info(self):
         """ 
             Returns information about items belonging to this order.
             
-            Returns a dictionary, see Album.price_for_several_albums_including_vat_and_shipping().
+            Returns a dictionary, see pricing.price_albums_including_vat_and_shipping(). The prices are read
+            from the snapshot stored at the time of ordering, so they do not change along with the albums.
+            If the snapshot does not cover the items anymore, e.g. because they have been changed in the
+            admin site, the mismatch is logged and the snapshot is rebuilt from the unit prices stored on
+            the items, like for orders made before snapshots existed.
             In addition, the returned dictionary contains keys "order" containing this Order instance,
             and if this order has been paid, "payment" containing the corresponding SPSPayment instance. 
         """
-        album_count_address_list = [(i.album, i.count, i.deliveryAddress) for i in self.items()]
-        order_info = Album.price_for_several_albums_including_vat_and_shipping(album_count_address_list)
+        items = list(self.items())
+        if not self.priceSnapshot:
+            self.store_price_snapshot(items)
+
+        try:
+            order_info = self._info_from_price_snapshot(items)
+        except (ValueError, KeyError) as e:
+            commonLogger.error(u"The price snapshot of order %s does not match its items and is replaced: %s" %
+                               (self.pk, unicode(str(e), errors = "ignore")))
+            self.store_price_snapshot(items)
+            order_info = self._info_from_price_snapshot(items)
         order_info["order"] = self
         if self.is_paid():
             order_info["payment_info"] = self.payment().info()
         return order_info
 
+    def _info_from_price_snapshot(self, items):
+        album_count_address_price_list = [(i.album, i.count, i.deliveryAddress, i.unitPrice) for i in items]
+        return order_info_from_snapshot(json.loads(self.priceSnapshot), album_count_address_price_list,
+                                        self.purchaseDate)
+
     @models.permalink
     def get_absolute_url(self):
         view_parameters = {"order_id": self.id}
@@ -1334,25 +2324,73 @@ class Order(models.Model):
         """ 
             Returns True if this order has just been ordered but has not been paid yet, otherwise False. 
         """
-        return self.status == OrderStatus.ordered()
+        return self.status_id == OrderStatus.ordered().id
 
     def is_paid_and_being_processed(self):
         """ 
             Returns True if this order has been paid and is currently being processed, otherwise False. 
         """
-        return self.status == OrderStatus.paid_and_being_processed()
+        return self.status_id == OrderStatus.paid_and_being_processed().id
 
     def is_sent(self):
         """ 
             Returns True if this order has already been sent to the delivery address, otherwise False. 
         """
-        return self.status == OrderStatus.sent()
+        return self.status_id == OrderStatus.sent().id
 
     def is_blocked(self):
         """ 
             Returns True if this order is currently blocked for some reason, otherwise False. 
         """
-        return self.status == OrderStatus.blocked()
+        return self.status_id == OrderStatus.blocked().id
+
+    def current_status(self):
+        """ 
+            Returns the current status of this order without querying the database. 
+        """
+        return OrderStatus.by_id(self.status_id)
+
+    @transaction.commit_on_success
+    def change_status(self, new_status, actor = u"", clarification = u""):
+        """ 
+            Changes the status of this order and appends the change into the status history of the order.
+            Keeps the fulfilment queue in sync with the status: an order becoming paid is queued for
+            fulfilment, and an order leaving the paid status is removed from the queue. All of this is
+            done in a single transaction, so a failure leaves neither the history nor the queue behind.
+        """
+        self._change_status(new_status, actor, clarification)
+
+    @transaction.commit_on_success
+    def record_payment(self, payment):
+        """ 
+            Saves given payment of this order and marks the order as paid and being processed, which
+            queues it for fulfilment, in a single transaction.
+        """
+        payment.save()
+        self._change_status(OrderStatus.paid_and_being_processed(), payment.service_name())
+
+    def _change_status(self, new_status, actor, clarification):
+        """ 
+            Does the same as change_status() without committing anything, for callers managing a transaction
+            of their own. Nesting change_status() in such a transaction would commit the whole transaction
+            of the caller as soon as the status has been changed.
+        """
+        self.status = new_status
+        self.statusClarification = clarification
+        Order.objects.filter(pk = self.pk).update(status = new_status, statusClarification = clarification)
+        OrderStatusChange(order = self, status = new_status, actor = actor, clarification = clarification).save()
+
+        if self.is_paid_and_being_processed():
+            if not FulfilmentTask.objects.filter(order = self).exists():
+                FulfilmentTask(order = self).save()
+        else:
+            FulfilmentTask.objects.filter(order = self).delete()
+
+    def status_changes(self):
+        """ 
+            Returns the status history of this order from the oldest change to the newest.
+        """
+        return OrderStatusChange.objects.filter(order__exact = self).order_by("changeDate", "id")
 
     def payment(self):
         """ 
@@ -1466,6 +2504,14 @@ class OrderItem(models.Model):
         Address,
         verbose_name = u"delivery address"
     )
+    unitPrice = models.DecimalField(
+        max_digits = 10,
+        decimal_places = 2,
+        null = True,
+        blank = True,
+        verbose_name = u"unit price [€]",
+        help_text = u"price of a single piece of the album excluding VAT and shipping at the time of ordering"
+    )
 
     def __unicode__(self):
         return u"%s, %s, %s, %d piece(s)" % (self.order.orderer, self.order.purchaseDate,
@@ -1476,7 +2522,9 @@ class OrderItem(models.Model):
         """ 
             Returns items of given order, if there are any.
         """
-        return OrderItem.objects.filter(order__exact = order)
+        return OrderItem.objects.select_related('album', 'album__owner', 'deliveryAddress',
+                                                'deliveryAddress__state', 'deliveryAddress__country') \
+                                .filter(order__exact = order)
 
     class Meta():
         unique_together = ("order", "album")
@@ -1487,6 +2535,189 @@ class OrderItem(models.Model):
 
 
 
+class OrderStatusChange(models.Model):
+    """ 
+        Represents a single change in the status of an order. The changes are only appended,
+        never modified, so that they form the full history of the order.
+    """
+    order = models.ForeignKey(Order)
+    status = models.ForeignKey(OrderStatus)
+    changeDate = models.DateTimeField(
+        auto_now_add = True,
+        verbose_name = u"change date"
+    )
+    actor = models.CharField(
+        blank = True,
+        max_length = 100,
+        help_text = u"user or fulfilment worker, who changed the status"
+    )
+    clarification = models.CharField(
+        blank = True,
+        max_length = 255,
+        help_text = u"reasons for the change, if necessary"
+    )
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise AlbumizerModelError("Status changes of orders cannot be modified.")
+        super(OrderStatusChange, self).save(*args, **kwargs)
+
+    def __unicode__(self):
+        return u"%s, %s, %s" % (self.order_id, self.changeDate, self.status)
+
+    class Meta():
+        ordering = ["order", "changeDate", "id"]
+        verbose_name = u"order status change"
+        verbose_name_plural = u"order status changes"
+
+
+
+
+FULFILMENT_LEASE_SECONDS = 300
+FULFILMENT_RETRY_DELAY_SECONDS = 60
+FULFILMENT_MAX_ATTEMPTS = 3
+
+# Databases, on which the tasks to be claimed are locked with SELECT ... FOR UPDATE
+ROW_LOCKING_DATABASE_VENDORS = ("postgresql", "mysql")
+
+class FulfilmentTask(models.Model):
+    """ 
+        Represents a paid order waiting to be fulfilled. Workers claim tasks in batches with
+        FulfilmentTask.claim_batch() and hold them for a lease time, after which the tasks can be
+        claimed again, if the worker has not completed or released them. A task is removed when
+        its order leaves the paid status, so the queue contains only the orders still to be processed.
+
+        Tasks are claimed in the order of availableDate, for which there is an index on
+        (availableDate, id), so finding the next batch does not depend on the number of orders.
+    """
+    order = models.OneToOneField(Order)
+    availableDate = models.DateTimeField(
+        default = datetime.now,
+        verbose_name = u"available date",
+        help_text = u"time after which the task can be claimed, i.e. the time of queuing or the end of the current lease"
+    )
+    claimedBy = models.CharField(
+        blank = True,
+        max_length = 100,
+        verbose_name = u"claimed by",
+        help_text = u"name of the worker, which claimed the task most recently"
+    )
+    claimToken = models.CharField(
+        blank = True,
+        max_length = 32,
+        db_index = True,
+        verbose_name = u"claim token",
+        help_text = u"identifies the batch, in which the task was claimed most recently"
+    )
+    attempts = models.PositiveIntegerField(
+        default = 0,
+        help_text = u"number of times the task has been claimed"
+    )
+
+    @staticmethod
+    def claim_batch(worker_name, how_many, lease_seconds = FULFILMENT_LEASE_SECONDS):
+        """ 
+            Claims at most given number of available tasks for given worker for a lease time, and
+            returns them along with their orders. A task is never claimed by two workers at the same
+            time: the claim is an UPDATE conditional on the task still being available. Where the
+            database supports it, the tasks are also locked first, so that concurrent workers wait
+            for each other instead of trying to claim the same tasks.
+
+            If other workers claim all the tasks found in between, the next available ones are tried
+            in a new transaction, so that an empty list is returned only when no tasks are available.
+        """
+        while True:
+            (claimed_tasks, tasks_were_available) = FulfilmentTask._try_to_claim_batch(worker_name, how_many,
+                                                                                        lease_seconds)
+            if claimed_tasks or not tasks_were_available:
+                return claimed_tasks
+
+    @staticmethod
+    @transaction.commit_on_success
+    def _try_to_claim_batch(worker_name, how_many, lease_seconds):
+        """ 
+            Tries to claim a batch of tasks once, see claim_batch(). Returns a tuple of a list of the
+            claimed tasks and a boolean telling whether there were available tasks to be claimed.
+        """
+        now = datetime.now()
+        claim_token = uuid.uuid4().hex
+        available_tasks = FulfilmentTask.objects.filter(availableDate__lte = now)
+
+        if connection.vendor in ROW_LOCKING_DATABASE_VENDORS:
+            quote_name = connection.ops.quote_name
+            cursor = connection.cursor()
+            cursor.execute("SELECT %s FROM %s WHERE %s <= %%s ORDER BY %s, %s LIMIT %d FOR UPDATE" %
+                           (quote_name("id"), quote_name(FulfilmentTask._meta.db_table),
+                            quote_name("availableDate"), quote_name("availableDate"), quote_name("id"),
+                            int(how_many)),
+                           [now])
+            task_ids = [row[0] for row in cursor.fetchall()]
+            if not task_ids:
+                # after waiting for tasks locked by another worker, the database leaves out the ones
+                # claimed by it without looking for others, so an empty result does not mean that
+                # no tasks are available; that is checked without locking the tasks
+                return ([], available_tasks.exists())
+        else:
+            task_ids = list(available_tasks.order_by("availableDate", "id").values_list("id", flat = True)[:how_many])
+            if not task_ids:
+                return ([], False)
+
+        number_of_claimed_tasks = FulfilmentTask.objects.filter(id__in = task_ids, availableDate__lte = now).update(
+            availableDate = now + timedelta(seconds = lease_seconds),
+            claimedBy = worker_name,
+            claimToken = claim_token,
+            attempts = F("attempts") + 1
+        )
+        if not number_of_claimed_tasks:
+            return ([], True)
+        return (list(FulfilmentTask.objects.select_related("order", "order__orderer")
+                                           .filter(claimToken = claim_token).order_by("id")), True)
+
+    def _end_lease(self, **updated_values):
+        """ 
+            Ends the lease of this task, if it has not been claimed by anyone else meanwhile.
+            Returns True, if the lease was still held.
+        """
+        updated_values["claimToken"] = u""
+        return FulfilmentTask.objects.filter(pk = self.pk, claimToken = self.claimToken).update(**updated_values) > 0
+
+    @transaction.commit_on_success
+    def complete(self, clarification = u""):
+        """ 
+            Marks the order of this task as sent, which removes the task from the queue. Ending the lease
+            and changing the status are done in a single transaction. Returns False without changing
+            anything, if the lease of the task has been lost to another worker.
+        """
+        if not self._end_lease():
+            return False
+        self.order._change_status(OrderStatus.sent(), self.claimedBy, clarification)
+        return True
+
+    @transaction.commit_on_success
+    def release(self, clarification = u""):
+        """ 
+            Returns this task into the queue to be retried after a delay, when processing it has failed.
+            After FULFILMENT_MAX_ATTEMPTS attempts the order is blocked instead, which removes the task
+            from the queue. Returns False, if the lease of the task has been lost to another worker.
+        """
+        retry_date = datetime.now() + timedelta(seconds = FULFILMENT_RETRY_DELAY_SECONDS)
+        if not self._end_lease(availableDate = retry_date):
+            return False
+        if self.attempts >= FULFILMENT_MAX_ATTEMPTS:
+            self.order._change_status(OrderStatus.blocked(), self.claimedBy, clarification)
+        return True
+
+    def __unicode__(self):
+        return u"%s, %s" % (self.order_id, self.availableDate)
+
+    class Meta():
+        ordering = ["availableDate", "id"]
+        verbose_name = u"fulfilment task"
+        verbose_name_plural = u"fulfilment tasks"
+
+
+
+
 class AlbumizerModelError(Exception):
     """
         Base class for exceptions defined in this module.
@@ -1506,6 +2737,16 @@ class ShoppingCartEmptyError(AlbumizerModelError):
 
 
 
+class ShoppingCartChangedError(AlbumizerModelError):
+    """
+        This exception is raised when a shopping cart has changed after the user has confirmed its content.
+    """
+    def __init__(self, error_message):
+        self.message = error_message
+
+
+
+
 def json_serialization_handler(object_to_serialize):
     """ 
         Serializes objects, which are not supported by the Python's json package.
@@ -1532,3 +2773,24 @@ def serialize_into_json(object_to_serialize):
 
 
 
+def serialize_cover_renditions(cover_renditions):
+    """ 
+        Serializes urls of a cover image (see PageContent.cover_renditions()) to be stored into the database.
+    """
+    return json.dumps(cover_renditions, sort_keys = True)
+
+
+
+
+def deserialize_cover_renditions(serialized_cover_renditions):
+    """ 
+        Deserializes urls of a cover image stored with serialize_cover_renditions().
+    """
+    try:
+        return json.loads(serialized_cover_renditions)
+    except ValueError:
+        return {}
+
+
+
+
@@ -0,0 +1,170 @@
+﻿# This Python file uses the following encoding: utf-8
+
+import base64
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import simplejson as json
+
+
+
+
+KEYSET_COUNT_TIMEOUT = 5 * 60     # seconds
+
+CURSOR_DIRECTION_NEXT = "n"
+CURSOR_DIRECTION_PREVIOUS = "p"
+
+
+
+
+class KeysetPage(object):
+    """
+        A single page of objects returned by KeysetPaginator. Can be used like the pages of Django's
+        Paginator, except that the pages are not numbered. Instead, the neighbouring pages are
+        referred to with opaque cursors, which are passed back to KeysetPaginator.page().
+    """
+
+    def __init__(self, paginator, object_list, previous_cursor, next_cursor):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+
+
+class KeysetPaginator(object):
+    """
+        Splits a queryset into pages using keyset pagination. Instead of counting all rows and skipping
+        the ones of the preceding pages with OFFSET, each page is fetched with a single query, which
+        continues from the sort key of the last (or first) object of the previous page. Fetching a deep
+        page is therefore as fast as fetching the first one, provided that there is an index on the
+        fields of the key.
+
+        ordering is a sequence of non-null field names like ("title", "id") or ("-creationDate", "-id").
+        The last field must be unique, so that the key identifies a single row. The total number of
+        objects is only approximate, as it is cached under count_cache_key for KEYSET_COUNT_TIMEOUT seconds.
+    """
+
+    def __init__(self, queryset, ordering, per_page, count_cache_key):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.count_cache_key = count_cache_key
+        self._key_fields = [(queryset.model._meta.get_field(name.lstrip("-")), name.startswith("-"))
+                            for name in self.ordering]
+
+    def approximate_count(self):
+        """
+            Returns the total number of objects, which is counted at most once in KEYSET_COUNT_TIMEOUT seconds.
+        """
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(self.count_cache_key, count, KEYSET_COUNT_TIMEOUT)
+        return count
+
+    def last_page_cursor(self):
+        """
+            Returns a cursor referring to the last page.
+        """
+        return self._encode_cursor(CURSOR_DIRECTION_PREVIOUS, [])
+
+    def page(self, cursor = None):
+        """
+            Returns the page referred to by given cursor, or the first page if the cursor is missing or invalid.
+            If there are no objects after (or before) the cursor anymore, the last (or first) page is returned.
+        """
+        (direction, key) = self._decode_cursor(cursor)
+        page = self._page(direction, key)
+        if not page.object_list and key:
+            if direction == CURSOR_DIRECTION_NEXT:
+                page = self._page(CURSOR_DIRECTION_PREVIOUS, [])
+            else:
+                page = self._page(CURSOR_DIRECTION_NEXT, [])
+        return page
+
+    def _page(self, direction, key):
+        is_backwards = direction == CURSOR_DIRECTION_PREVIOUS
+        queryset = self.queryset
+        if key:
+            queryset = queryset.filter(self._condition_following_key(key, is_backwards))
+        if is_backwards:
+            ordering = [name[1:] if name.startswith("-") else "-" + name for name in self.ordering]
+        else:
+            ordering = self.ordering
+        objects = list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if is_backwards:
+            objects.reverse()
+            (has_previous, has_next) = (has_more, bool(key))
+        else:
+            (has_previous, has_next) = (bool(key), has_more)
+
+        previous_cursor = None
+        next_cursor = None
+        if objects and has_previous:
+            previous_cursor = self._encode_cursor(CURSOR_DIRECTION_PREVIOUS, self._key_of(objects[0]))
+        if objects and has_next:
+            next_cursor = self._encode_cursor(CURSOR_DIRECTION_NEXT, self._key_of(objects[-1]))
+        return KeysetPage(self, objects, previous_cursor, next_cursor)
+
+    def _condition_following_key(self, key, is_backwards):
+        """
+            Returns a Q object matching the rows, which come after given key in the ordering
+            (or before it, if is_backwards is true).
+        """
+        condition = None
+        for (index, (field, is_descending)) in enumerate(self._key_fields):
+            lookups = dict([(str(previous_field.attname), value)
+                            for ((previous_field, _), value) in zip(self._key_fields[:index], key[:index])])
+            operator = "lt" if is_descending != is_backwards else "gt"
+            lookups["%s__%s" % (field.attname, operator)] = key[index]
+            condition = Q(**lookups) if condition is None else condition | Q(**lookups)
+        return condition
+
+    def _key_of(self, obj):
+        return [getattr(obj, field.attname) for (field, _) in self._key_fields]
+
+    def _encode_cursor(self, direction, key):
+        values = [value if isinstance(value, (int, long)) else unicode(value) for value in key]
+        return base64.urlsafe_b64encode(json.dumps([direction] + values)).rstrip("=")
+
+    def _decode_cursor(self, cursor):
+        """
+            Returns a tuple of the direction and the key encoded into given cursor. Missing and invalid
+            cursors refer to the first page.
+        """
+        if cursor:
+            try:
+                cursor = str(cursor)
+                values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+                direction = values[0]
+                key = values[1:]
+                if direction in (CURSOR_DIRECTION_NEXT, CURSOR_DIRECTION_PREVIOUS) and \
+                        len(key) in (0, len(self._key_fields)):
+                    return (direction, [field.to_python(value)
+                                        for ((field, _), value) in zip(self._key_fields, key)])
+            except (ValueError, TypeError, KeyError, IndexError, UnicodeError, ValidationError):
+                pass
+        return (CURSOR_DIRECTION_NEXT, [])
@@ -0,0 +1,200 @@
+﻿# This Python file uses the following encoding: utf-8
+
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+
+
+
+
+CENT = Decimal("0.01")
+
+ESTIMATED_DISPATCH_TIME = timedelta(days = 3)
+ESTIMATED_DELIVERY_TIME = timedelta(days = 14)
+
+ORDER_TOTAL_KEYS = ("price_of_items", "shipping_expenses", "order_total_price_before_vat",
+                    "vat_percentage", "vat_amount", "order_total_price")
+ITEM_GROUP_TOTAL_KEYS = ("item_group_subtotal_before_shipping", "shipping_expenses",
+                         "item_group_subtotal_with_shipping")
+
+
+
+
+def money(amount):
+    """
+        Converts given amount into a Decimal rounded to whole cents. Floats are converted
+        through their shortest representation, so that e.g. 0.1 becomes exactly 0.10.
+    """
+    if not isinstance(amount, Decimal):
+        amount = Decimal(repr(float(amount)))
+    return amount.quantize(CENT, ROUND_HALF_UP)
+
+
+def unit_price_for_page_count(page_count):
+    """
+        Calculates a price for a single album having given number of pages, excluding VAT and shipping.
+    """
+    if page_count > 0:
+        return money(settings.PRICE_PER_ALBUM) + page_count * money(settings.PRICE_PER_ALBUM_PAGE)
+    return money(0)
+
+
+
+
+def price_albums_excluding_vat_and_shipping(album_quantities):
+    """
+        Calculates prices for several albums, excluding VAT and shipping. The stored unit prices
+        of the albums are used, so no queries are made.
+
+        album_quantities is a list of tuples containing an Album object and a quantity, like
+        [(album1, 3), (album2, 23), (album3, 1)] .
+
+        Returns a dictionary containing keys "items" containing a dictionary mapping the albums
+        to dictionaries of their "quantity", "unit_price" and "sub_total", and "sub_total" of all albums.
+    """
+    item_infos = {}
+    sub_total_price_for_all_albums = money(0)
+    for (album, quantity) in album_quantities:
+        unit_price = money(album.unitPrice)
+        sub_total_for_single_album = quantity * unit_price
+        item_infos[album] = {
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "sub_total": sub_total_for_single_album
+        }
+        sub_total_price_for_all_albums += sub_total_for_single_album
+
+    return {
+        "items": item_infos,
+        "sub_total": sub_total_price_for_all_albums
+    }
+
+
+def _new_item_group(order_date):
+    """
+        Returns a dictionary for collecting the items of a single delivery address.
+    """
+    return {
+        "items": [],
+        "estimated_dispatch_date": order_date + ESTIMATED_DISPATCH_TIME,
+        "estimated_delivery_date": order_date + ESTIMATED_DELIVERY_TIME
+    }
+
+
+def price_albums_including_vat_and_shipping(album_quantity_addresses, order_date = None):
+    """
+        Calculates prices for several albums grouped by their delivery addresses, including VAT
+        and shipping. The stored unit prices of the albums are used, so no queries are made.
+
+        album_quantity_addresses is a list of tuples containing an Album object, a quantity and
+        an Address object, like [(album1, 3, address1), (album2, 23, address2), (album3, 1, address1)] .
+        A tuple may contain a unit price as its fourth item, which is then used instead of the one
+        stored on the album, e.g. to reprice an order with the prices at the time of ordering.
+        The estimated dates are counted from order_date, which defaults to the current time.
+
+        Returns a dictionary containing keys "items_by_address" containing a dictionary mapping the
+        addresses to dictionaries of their "items", subtotals, shipping expenses and estimated dates,
+        and keys "price_of_items", "shipping_expenses", "order_total_price_before_vat",
+        "vat_percentage", "vat_amount" and "order_total_price" for the whole order.
+    """
+    order_date = order_date or datetime.now()
+    single_shipping_expense = money(settings.SHIPPING_EXPENSES)
+
+    items_by_address = {}
+    sub_total_price_for_all_albums = money(0)
+    for album_quantity_address in album_quantity_addresses:
+        (album, quantity, address) = album_quantity_address[:3]
+        item_group = items_by_address.get(address)
+        if item_group is None:
+            item_group = _new_item_group(order_date)
+            item_group["item_group_subtotal_before_shipping"] = money(0)
+            item_group["shipping_expenses"] = single_shipping_expense
+            items_by_address[address] = item_group
+
+        if len(album_quantity_address) > 3:
+            unit_price = money(album_quantity_address[3])
+        else:
+            unit_price = money(album.unitPrice)
+        sub_total_for_single_album = quantity * unit_price
+        item_group["items"].append({
+            "album": album,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "sub_total": sub_total_for_single_album
+        })
+        item_group["item_group_subtotal_before_shipping"] += sub_total_for_single_album
+        sub_total_price_for_all_albums += sub_total_for_single_album
+
+    for item_group in items_by_address.values():
+        item_group["item_group_subtotal_with_shipping"] = \
+            item_group["item_group_subtotal_before_shipping"] + single_shipping_expense
+
+    sub_total_shipping_expenses = len(items_by_address) * single_shipping_expense
+    order_total_price_before_vat = sub_total_price_for_all_albums + sub_total_shipping_expenses
+
+    vat_percentage = settings.VAT_PERCENTAGE
+    vat_amount = money(order_total_price_before_vat * money(vat_percentage) / 100)
+    order_total_price = order_total_price_before_vat + vat_amount
+
+    return {
+        "items_by_address": items_by_address,
+        "price_of_items": sub_total_price_for_all_albums,
+        "shipping_expenses": sub_total_shipping_expenses,
+        "order_total_price_before_vat": order_total_price_before_vat,
+        "vat_percentage": vat_percentage,
+        "vat_amount": vat_amount,
+        "order_total_price": order_total_price
+    }
+
+
+
+
+def snapshot_of_order_info(order_info):
+    """
+        Returns the totals of given order information (see price_albums_including_vat_and_shipping())
+        as a dictionary of strings, which can be stored as JSON and turned back into order information
+        with order_info_from_snapshot(). The subtotals of the delivery addresses are keyed by their ids.
+    """
+    snapshot = dict([(key, unicode(order_info[key])) for key in ORDER_TOTAL_KEYS])
+    snapshot["addresses"] = dict([(unicode(address.pk), dict([(key, unicode(item_group[key]))
+                                                              for key in ITEM_GROUP_TOTAL_KEYS]))
+                                  for (address, item_group) in order_info["items_by_address"].items()])
+    return snapshot
+
+
+def order_info_from_snapshot(snapshot, album_quantity_address_prices, order_date):
+    """
+        Builds order information having the same structure as the one returned by
+        price_albums_including_vat_and_shipping() from a snapshot made with snapshot_of_order_info().
+        Nothing is recalculated except the subtotals of single lines.
+
+        album_quantity_address_prices is a list of tuples containing an Album object, a quantity,
+        an Address object and the unit price of the album at the time of ordering.
+
+        Raises ValueError, if the snapshot does not cover the items, e.g. because an item has been
+        moved to another address or has no unit price.
+    """
+    items_by_address = {}
+    for (album, quantity, address, unit_price) in album_quantity_address_prices:
+        if unit_price is None:
+            raise ValueError("The unit price of album %s at the time of ordering is missing." % album.pk)
+        item_group = items_by_address.get(address)
+        if item_group is None:
+            address_totals = snapshot["addresses"].get(unicode(address.pk))
+            if address_totals is None:
+                raise ValueError("The price snapshot contains no totals for address %s." % address.pk)
+            item_group = _new_item_group(order_date)
+            for (key, value) in address_totals.items():
+                item_group[key] = Decimal(value)
+            items_by_address[address] = item_group
+
+        item_group["items"].append({
+            "album": album,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "sub_total": quantity * unit_price
+        })
+
+    order_info = dict([(key, Decimal(snapshot[key])) for key in ORDER_TOTAL_KEYS])
+    order_info["items_by_address"] = items_by_address
+    return order_info
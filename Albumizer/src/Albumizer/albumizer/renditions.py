@@ -0,0 +1,238 @@
+﻿# This Python file uses the following encoding: utf-8
+
+import logging, multiprocessing, os
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+import Image
+
+
+
+
+commonLogger = logging.getLogger("albumizer")
+
+
+RENDITION_STATUS_PENDING = "pending"
+RENDITION_STATUS_READY = "ready"
+RENDITION_STATUS_FAILED = "failed"
+
+RENDITION_STATUS_CHOICES = (
+    (RENDITION_STATUS_PENDING, u"pending"),
+    (RENDITION_STATUS_READY, u"ready"),
+    (RENDITION_STATUS_FAILED, u"failed"),
+)
+
+
+RENDITION_FILE_EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "GIF": "gif",
+}
+
+
+# Sent after the rendition status and manifest of an image have been stored, i.e. after the
+# thumbnails have been created or their manifest has been rebuilt.
+renditions_processed = Signal(providing_args = ["instance", "field_name", "manifest"])
+
+
+
+
+class Rendition(object):
+    """
+        Declares a single rendition, i.e. a downscaled version, of an image. The image is scaled to fit
+        inside a box of given width and height, preserving its aspect ratio, and then saved
+        in given format. Quality is used only for lossy formats.
+
+        The name of the rendition is added in front of the extension of the original file
+        name, e.g. "this.jpg" --> "this.thumb-large.jpg", so it must be unique per field.
+    """
+    def __init__(self, name, width, height, format = "JPEG", quality = 85):
+        if format not in RENDITION_FILE_EXTENSIONS:
+            raise ValueError(u"Unsupported rendition format: %s" % format)
+        self.name = name
+        self.width = width
+        self.height = height
+        self.format = format
+        self.quality = quality
+
+    def __repr__(self):
+        return "<Rendition %s: %dx%d %s>" % (self.name, self.width, self.height, self.format)
+
+    @property
+    def file_extension(self):
+        return RENDITION_FILE_EXTENSIONS[self.format]
+
+    def save_options(self):
+        """
+            Returns keyword arguments for PIL's Image.save() to save this rendition.
+        """
+        if self.format == "JPEG":
+            return {"quality": self.quality, "optimize": True}
+        if self.format == "PNG":
+            return {"optimize": True}
+        return {}
+
+
+
+
+def fitted_size(image_size, rendition):
+    """
+        Returns the size of given rendition of an image of given size, i.e. the size the image has
+        when scaled to fit inside the box of the rendition preserving its aspect ratio.
+        Images are never enlarged.
+    """
+    (image_width, image_height) = image_size
+    scale = min(float(rendition.width) / image_width, float(rendition.height) / image_height, 1.0)
+    return (max(int(image_width * scale), 1), max(int(image_height * scale), 1))
+
+
+
+
+def _decode_for_scaling(image, largest_size):
+    """
+        Decodes an opened image, which is to be scaled to given size or smaller. JPEG images are
+        decoded in draft mode, which lets the decoder to scale the image down by 1/2, 1/4 or 1/8
+        while decoding it, as long as the result is not smaller than the requested size.
+        This reduces both the time and the memory needed to decode large photos considerably.
+    """
+    if image.format == "JPEG":
+        image.draft(image.mode, largest_size)
+    image.load()
+
+    if image.mode not in ("RGB", "RGBA", "L"):
+        if image.mode in ("LA", "PA") or "transparency" in image.info:
+            image = image.convert("RGBA")
+        else:
+            image = image.convert("RGB")
+    return image
+
+
+
+
+def _save_rendition(image, rendition, target_path):
+    if rendition.format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.save(target_path, rendition.format, **rendition.save_options())
+    if settings.FILE_UPLOAD_PERMISSIONS:
+        os.chmod(target_path, settings.FILE_UPLOAD_PERMISSIONS)
+
+
+
+
+def _manifest_entry(width, height, target_path):
+    return {"width": width, "height": height, "bytes": os.path.getsize(target_path)}
+
+
+
+
+def inspect_renditions(rendition_specs):
+    """
+        Returns a manifest of the already existing renditions of an image (see create_renditions()),
+        based on the rendition files found from the file system.
+    """
+    manifest = {}
+    for (rendition, target_path) in rendition_specs:
+        if not os.path.exists(target_path):
+            continue
+        try:
+            (width, height) = Image.open(target_path).size
+            manifest[rendition.name] = _manifest_entry(width, height, target_path)
+        except Exception as e:
+            commonLogger.error(u"Inspecting thumbnail \"%s\" failed: %s" %
+                               (target_path, unicode(str(e), errors = "ignore")))
+    return manifest
+
+
+
+
+def create_renditions(source_path, rendition_specs):
+    """
+        Creates all renditions of an image. rendition_specs is a list of tuples
+        containing a Rendition and the target path of the rendition, like
+        [(Rendition("thumb-small", 100, 100), "/path/image.thumb-small.jpg")] .
+
+        The original image is decoded only once, at the lowest resolution sufficient for
+        the largest rendition (see _decode_for_scaling()). Each smaller rendition is then
+        scaled down from the previous, larger one instead of the full-sized original.
+
+        Returns a manifest of the successfully created renditions, i.e. a dictionary mapping names of
+        the renditions to dictionaries containing their width, height and size in bytes, like
+        {"thumb-small": {"width": 100, "height": 75, "bytes": 2817}} .
+
+        This function is run in the worker processes of the rendition pool,
+        so it must not use the database or any other shared resources.
+    """
+    manifest = {}
+    if not rendition_specs:
+        return manifest
+
+    if not os.path.exists(source_path):
+        commonLogger.error(u"Thumbnail creation failed for image \"%s\": Image was not found." % source_path)
+        return manifest
+
+    try:
+        source_image = Image.open(source_path)
+        sized_specs = [(fitted_size(source_image.size, rendition), rendition, target_path)
+                            for (rendition, target_path) in rendition_specs]
+        sized_specs.sort(key = lambda spec: spec[0][0] * spec[0][1], reverse = True)
+        scaled_image = _decode_for_scaling(source_image, sized_specs[0][0])
+    except Exception as e:
+        commonLogger.error(u"Thumbnail creation failed for image \"%s\": %s" %
+                           (source_path, unicode(str(e), errors = "ignore")))
+        return manifest
+
+    for (size, rendition, target_path) in sized_specs:
+        try:
+            if scaled_image.size != size:
+                scaled_image = scaled_image.resize(size, Image.ANTIALIAS)
+            _save_rendition(scaled_image, rendition, target_path)
+            manifest[rendition.name] = _manifest_entry(size[0], size[1], target_path)
+        except Exception as e:
+            commonLogger.error(u"Creation of thumbnail \"%s\" failed for image \"%s\": %s" %
+                               (rendition.name, source_path, unicode(str(e), errors = "ignore")))
+    return manifest
+
+
+
+
+def _create_renditions_of_job(job):
+    """
+        Runs create_renditions() for a job of create_renditions_in_processes() in a worker process.
+        Any error is logged and reported as an empty manifest, i.e. as failure of all renditions.
+    """
+    (key, source_path, rendition_specs) = job
+    try:
+        return (key, create_renditions(source_path, rendition_specs))
+    except Exception as e:
+        commonLogger.error(u"Thumbnail creation failed for image \"%s\": %s" %
+                           (source_path, unicode(str(e), errors = "ignore")))
+        return (key, {})
+
+
+
+
+def create_renditions_in_processes(jobs, number_of_processes):
+    """
+        Creates renditions of several images using a pool of worker processes. jobs is a list of
+        tuples containing a key identifying an image, the path of the image and its rendition specs
+        (see create_renditions()). Yields tuples of the key and the manifest of each image as soon as
+        its renditions have been processed, so that the caller can store the results in its own
+        process and thread, where the database is used as usual.
+
+        Forking a pool is meant for management commands, not for the processes of a web server.
+        If number_of_processes is less than two, the renditions are created in the current process.
+    """
+    if number_of_processes < 2:
+        for job in jobs:
+            yield _create_renditions_of_job(job)
+        return
+
+    # the worker processes must not share the connection of this one
+    connection.close()
+    process_pool = multiprocessing.Pool(number_of_processes)
+    try:
+        for result in process_pool.imap_unordered(_create_renditions_of_job, jobs):
+            yield result
+    finally:
+        process_pool.terminate()
+        process_pool.join()
@@ -0,0 +1,352 @@
+﻿# This Python file uses the following encoding: utf-8
+
+import math, os, re, sqlite3, threading, unicodedata
+
+
+
+
+# Weights of the different parts of an album, by which the occurrences of words are multiplied
+SEARCH_WEIGHT_TITLE = 3
+SEARCH_WEIGHT_OWNER = 2
+SEARCH_WEIGHT_DESCRIPTION = 1
+SEARCH_WEIGHT_CAPTION = 1
+
+# Parameters of the Okapi BM25 ranking function
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Maximum number of words taken from a query
+MAX_QUERY_TERMS = 8
+
+# Number of albums containing the rarest word of a query, which are scored at once when the query
+# has several words; the ones having the highest impacts of the word are scored first
+CANDIDATE_PAGE_SIZE = 2000
+
+# Number of rows written at once when the index is built in bulk
+BULK_BATCH_SIZE = 20000
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Postings are clustered by their primary key when SQLite supports it, so that looking up
+# the impact of a word for an album needs no separate lookup of the row
+_POSTINGS_TABLE_OPTIONS = " WITHOUT ROWID" if sqlite3.sqlite_version_info >= (3, 8, 2) else ""
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS documents (
+           album_id INTEGER PRIMARY KEY,
+           owner_id INTEGER NOT NULL,
+           owner_name TEXT NOT NULL,
+           is_public INTEGER NOT NULL,
+           length INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS terms (
+           term TEXT PRIMARY KEY,
+           document_count INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS postings (
+           term TEXT NOT NULL,
+           album_id INTEGER NOT NULL,
+           impact REAL NOT NULL,
+           PRIMARY KEY (term, album_id))%s""" % _POSTINGS_TABLE_OPTIONS,
+    """CREATE TABLE IF NOT EXISTS statistics (
+           id INTEGER PRIMARY KEY CHECK (id = 1),
+           document_count INTEGER NOT NULL,
+           total_length INTEGER NOT NULL)""",
+    """INSERT OR IGNORE INTO statistics VALUES (1, 0, 0)""",
+)
+
+_INDEXES = (
+    """CREATE INDEX IF NOT EXISTS postings_by_impact ON postings (term, impact DESC, album_id)""",
+    """CREATE INDEX IF NOT EXISTS postings_by_album ON postings (album_id)""",
+    """CREATE INDEX IF NOT EXISTS documents_by_owner ON documents (owner_id)""",
+)
+
+
+
+
+def tokenize(text):
+    """
+        Splits given text into lowercase words without diacritics, so that e.g. "Kesä" matches "kesa".
+        Single letters are left out.
+    """
+    text = unicodedata.normalize("NFKD", unicode(text).lower())
+    text = u"".join([character for character in text if not unicodedata.combining(character)])
+    return [word for word in _WORD_PATTERN.findall(text) if len(word) > 1 or word.isdigit()]
+
+
+def weighted_term_frequencies(weighted_texts):
+    """
+        Returns a dictionary of the weighted numbers of occurrences of words in given texts and
+        the total number of words. weighted_texts is a list of tuples containing a text and its weight.
+    """
+    frequencies = {}
+    length = 0
+    for (text, weight) in weighted_texts:
+        for word in tokenize(text or u""):
+            frequencies[word] = frequencies.get(word, 0) + weight
+            length += 1
+    return (frequencies, length)
+
+
+def _impact(frequency, length, average_length):
+    """
+        Returns the contribution of a word to the score of an album according to BM25,
+        excluding the inverse document frequency, which is applied when searching.
+    """
+    average_length = average_length or length or 1
+    return frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+
+
+def _inverse_document_frequency(document_count, total_document_count):
+    return math.log(1.0 + (total_document_count - document_count + 0.5) / (document_count + 0.5))
+
+
+
+
+class AlbumSearchIndex(object):
+    """
+        Inverted index of albums stored into an SQLite database file of its own. For each word, the index
+        contains the albums having the word in their title, description, owner's username or captions,
+        together with a precomputed impact of the word to the BM25 score of the album. Finding the best
+        matches of a word is a single range scan, no matter how many albums there are.
+
+        The index is updated one album at a time by the event handlers in models.py. As it is not part
+        of the transactions of the actual database, it may drift if those are rolled back, and can be
+        rebuilt with the rebuild_albumizer_search_index management command.
+
+        If path is empty, the index is disabled: updating it does nothing and searches find nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def is_enabled(self):
+        return bool(self.path)
+
+    def _connection(self):
+        """
+            Returns the connection of the current thread to the index database, creating the database if needed.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout = 30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            # The index can always be rebuilt, so waiting for the disk at every commit is not needed
+            connection.execute("PRAGMA synchronous = NORMAL")
+            # Creating the tables would wait for the index being rebuilt, so it is done only when needed
+            if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'statistics'").fetchone():
+                with connection:
+                    for statement in _SCHEMA + _INDEXES:
+                        connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def _average_length(self, connection):
+        (document_count, total_length) = connection.execute(
+                "SELECT document_count, total_length FROM statistics WHERE id = 1").fetchone()
+        return float(total_length) / document_count if document_count else 0.0
+
+    def _remove(self, connection, album_id):
+        document = connection.execute("SELECT length FROM documents WHERE album_id = ?", (album_id,)).fetchone()
+        if document is None:
+            return
+        terms = connection.execute("SELECT term FROM postings WHERE album_id = ?", (album_id,)).fetchall()
+        connection.executemany("UPDATE terms SET document_count = document_count - 1 WHERE term = ?", terms)
+        connection.executemany("DELETE FROM terms WHERE term = ? AND document_count <= 0", terms)
+        connection.execute("DELETE FROM postings WHERE album_id = ?", (album_id,))
+        connection.execute("DELETE FROM documents WHERE album_id = ?", (album_id,))
+        connection.execute("UPDATE statistics SET document_count = document_count - 1, " +
+                           "total_length = total_length - ? WHERE id = 1", document)
+
+    def update_album(self, album_id, owner_id, owner_name, is_public, weighted_texts):
+        """
+            Adds an album to the index or replaces the indexed words of an album.
+            weighted_texts is a list of tuples containing a text and its weight.
+        """
+        if not self.is_enabled():
+            return
+        (frequencies, length) = weighted_term_frequencies(weighted_texts)
+        connection = self._connection()
+        with connection:
+            self._remove(connection, album_id)
+            average_length = self._average_length(connection)
+            connection.execute("INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+                               (album_id, owner_id, owner_name, int(bool(is_public)), length))
+            connection.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                                   [(term, album_id, _impact(frequency, length, average_length))
+                                    for (term, frequency) in frequencies.items()])
+            terms = [(term,) for term in frequencies]
+            connection.executemany("INSERT OR IGNORE INTO terms VALUES (?, 0)", terms)
+            connection.executemany("UPDATE terms SET document_count = document_count + 1 WHERE term = ?", terms)
+            connection.execute("UPDATE statistics SET document_count = document_count + 1, " +
+                               "total_length = total_length + ? WHERE id = 1", (length,))
+
+    def remove_album(self, album_id):
+        """
+            Removes an album from the index.
+        """
+        if not self.is_enabled():
+            return
+        connection = self._connection()
+        with connection:
+            self._remove(connection, album_id)
+
+    def album_ids_with_stale_owner_name(self, owner_id, owner_name):
+        """
+            Returns the ids of the indexed albums of given owner, which have been indexed with another name.
+        """
+        if not self.is_enabled():
+            return []
+        return [row[0] for row in self._connection().execute(
+                "SELECT album_id FROM documents WHERE owner_id = ? AND owner_name != ?", (owner_id, owner_name))]
+
+    def rebuild(self, albums):
+        """
+            Replaces the contents of the index with given albums, which is an iterable of tuples
+            containing the same values as the parameters of update_album(). Much faster than
+            updating the albums one at a time, as the rows are written in large batches, the impacts
+            of the words are computed with a single statement after the average length of albums
+            is known, and the indexes of the tables are created only after that.
+
+            The index is replaced in a single transaction, so searches find the albums of the old index
+            until the new one is complete, and a failed rebuild leaves the old index intact.
+        """
+        if not self.is_enabled():
+            return 0
+        connection = self._connection()
+        # The sqlite3 module of Python 2 commits the current transaction before statements like
+        # DROP TABLE, so the transaction is begun and ended explicitly instead
+        connection.isolation_level = None
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                document_count = self._replace_contents(connection, albums)
+            except:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.isolation_level = ""
+        connection.execute("ANALYZE")
+        return document_count
+
+    def _replace_contents(self, connection, albums):
+        for table in ("documents", "terms", "postings", "statistics"):
+            connection.execute("DROP TABLE %s" % table)
+        for statement in _SCHEMA:
+            connection.execute(statement)
+
+        # The raw frequencies are stored first and turned into impacts at the end
+        document_count = 0
+        total_length = 0
+        document_counts_by_term = {}
+        documents = []
+        postings = []
+        for (album_id, owner_id, owner_name, is_public, weighted_texts) in albums:
+            (frequencies, length) = weighted_term_frequencies(weighted_texts)
+            documents.append((album_id, owner_id, owner_name, int(bool(is_public)), length))
+            for (term, frequency) in frequencies.iteritems():
+                postings.append((term, album_id, frequency))
+                document_counts_by_term[term] = document_counts_by_term.get(term, 0) + 1
+            document_count += 1
+            total_length += length
+            if len(postings) >= BULK_BATCH_SIZE:
+                connection.executemany("INSERT INTO documents VALUES (?, ?, ?, ?, ?)", documents)
+                connection.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+                documents = []
+                postings = []
+        connection.executemany("INSERT INTO documents VALUES (?, ?, ?, ?, ?)", documents)
+        connection.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+        connection.executemany("INSERT INTO terms VALUES (?, ?)", document_counts_by_term.iteritems())
+        connection.execute("UPDATE statistics SET document_count = ?, total_length = ? WHERE id = 1",
+                           (document_count, total_length))
+
+        average_length = float(total_length) / document_count if document_count else 1.0
+        connection.execute(
+            "UPDATE postings SET impact = impact * ? / (impact + ? * (? + ? * " +
+            "(SELECT length FROM documents WHERE documents.album_id = postings.album_id)))",
+            (BM25_K1 + 1, BM25_K1, 1 - BM25_B, BM25_B / average_length))
+        for statement in _INDEXES:
+            connection.execute(statement)
+        return document_count
+
+    def search(self, query, user_id = None, include_private = False, how_many = 50):
+        """
+            Returns a list of tuples containing the id and the score of at most how_many albums, which
+            contain all the words of the query, best matches first. Only public albums and the albums
+            owned by given user are included, unless include_private is true.
+
+            The albums containing the rarest word are scored in pages in the order of the impact of that
+            word, until no remaining album could score higher than the results found so far. Usually
+            the first page suffices, but no matching album is ever left out.
+        """
+        words = []
+        for word in tokenize(query):
+            if word not in words:
+                words.append(word)
+        words = words[:MAX_QUERY_TERMS]
+        if not words or not self.is_enabled():
+            return []
+
+        connection = self._connection()
+        document_counts_by_term = dict(connection.execute(
+                "SELECT term, document_count FROM terms WHERE term IN (%s)" % ", ".join(["?"] * len(words)), words))
+        if len(document_counts_by_term) < len(words):
+            return []
+        total_document_count = connection.execute(
+                "SELECT document_count FROM statistics WHERE id = 1").fetchone()[0]
+
+        # The rarest word limits the candidates, and the rest of the words are looked up only for them
+        words.sort(key = lambda word: document_counts_by_term[word])
+        inverse_document_frequencies = [_inverse_document_frequency(document_counts_by_term[word], total_document_count)
+                                        for word in words]
+        if include_private:
+            visibility_condition = ""
+            visibility_parameters = []
+        else:
+            visibility_condition = "AND (documents.is_public = 1 OR documents.owner_id = ?)"
+            visibility_parameters = [user_id if user_id is not None else -1]
+        page_size = how_many if len(words) == 1 else max(how_many, CANDIDATE_PAGE_SIZE)
+
+        # The highest score, which the other words can add to the score of a candidate
+        other_words_maximum_score = 0.0
+        for (word, inverse_document_frequency) in zip(words[1:], inverse_document_frequencies[1:]):
+            (maximum_impact,) = connection.execute("SELECT MAX(impact) FROM postings WHERE term = ?", (word,)).fetchone()
+            other_words_maximum_score += inverse_document_frequency * maximum_impact
+
+        # Pages of candidates are read with a keyset, so that reading a page does not get slower
+        # the further the pages go
+        impacts = ", ".join(["candidates.impact"] + ["p%d.impact" % index for index in range(1, len(words))])
+        joins = " ".join(["LEFT JOIN postings AS p%d ON p%d.term = ? AND p%d.album_id = candidates.album_id" %
+                          (index, index, index) for index in range(1, len(words))])
+        statement = "SELECT candidates.album_id, %s FROM (" \
+                    "SELECT postings.album_id, postings.impact FROM postings " \
+                    "JOIN documents ON documents.album_id = postings.album_id " \
+                    "WHERE postings.term = ? %s %%s ORDER BY postings.impact DESC, postings.album_id LIMIT %d) " \
+                    "AS candidates %s ORDER BY candidates.impact DESC, candidates.album_id" % \
+                    (impacts, visibility_condition, page_size, joins)
+        keyset_condition = "AND (postings.impact < ? OR (postings.impact = ? AND postings.album_id > ?))"
+
+        results = []
+        keyset_parameters = []
+        while True:
+            candidates = connection.execute(statement % (keyset_condition if keyset_parameters else ""),
+                                            [words[0]] + visibility_parameters + keyset_parameters + words[1:]).fetchall()
+            for candidate in candidates:
+                if None in candidate:
+                    # the album lacks some of the other words
+                    continue
+                score = sum([impact * inverse_document_frequency
+                             for (impact, inverse_document_frequency) in zip(candidate[1:], inverse_document_frequencies)])
+                results.append((candidate[0], score))
+            results.sort(key = lambda result: (-result[1], result[0]))
+            del results[how_many:]
+            if len(candidates) < page_size:
+                return results
+            (last_album_id, last_impact) = candidates[-1][:2]
+            maximum_remaining_score = inverse_document_frequencies[0] * last_impact + other_words_maximum_score
+            if len(results) == how_many and results[-1][1] >= maximum_remaining_score:
+                return results
+            keyset_parameters = [last_impact, last_impact, last_album_id]
@@ -6,7 +6,9 @@ from django.template.base import Library, Node, TemplateSyntaxError, resolve_var
 from django.template.defaulttags import token_kwargs
 from django.template.loader import get_template
 from django.contrib.auth.models import User
-from Albumizer.albumizer.models import Album
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from Albumizer.albumizer.models import Album, PATH_OF_MISSING_COVER_IMAGE_LARGE
 from Albumizer.albumizer.utils import convert_money_into_two_decimal_string
 
 
@@ -50,7 +52,7 @@ def random_picks_album_list(context, number_of_random_picks = 4):
     """ 
         Outputs HTML and JavaScript code needed to render the Random Picks list of albums.
     """
-    random_picks = Album.pseudo_random_public_ones(number_of_random_picks)
+    random_picks = Album.resolve_covers(Album.pseudo_random_public_ones(number_of_random_picks))
 
     if random_picks:
         number_of_random_picks = len(random_picks)
@@ -252,6 +254,28 @@ def order_details(parser, token):
 
 
 
+@register.simple_tag
+def cover_image_attributes(album_or_page, sizes):
+    """ 
+        Outputs src, srcset and sizes attributes of an img element showing the cover image of an album or a page.
+        Browsers supporting srcset download the smallest thumbnail, which fills the image slot of given size,
+        whereas other browsers show the large thumbnail.
+
+            <img {% cover_image_attributes album "14.8em" %} alt="" />
+    """
+    cover_renditions = album_or_page.cover_renditions()
+    if not cover_renditions:
+        return mark_safe(u"src=\"%s\"" % escape(PATH_OF_MISSING_COVER_IMAGE_LARGE))
+
+    attributes = u"src=\"%s\"" % escape(cover_renditions["large"])
+    srcset = cover_renditions.get("srcset")
+    if srcset:
+        attributes += u" srcset=\"%s\" sizes=\"%s\"" % (escape(srcset), escape(sizes))
+    return mark_safe(attributes)
+
+
+
+
 @register.filter
 def mto2dstr(value):
     return convert_money_into_two_decimal_string(value)
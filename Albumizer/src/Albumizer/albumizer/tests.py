@@ -0,0 +1,440 @@
+﻿# This Python file uses the following encoding: utf-8
+
+import base64
+from datetime import datetime, timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson as json
+import models
+from models import Address, Album, FulfilmentTask, Layout, Order, OrderStatus, Page, PageContent, ShoppingCartItem, \
+                   ShoppingCartChangedError, ShoppingCartEmptyError, ALBUM_SEARCH_INDEX, CHECKOUT_STEP_ORDER_SUMMARY, \
+                   CHECKOUT_STEP_PLACE_ORDER, FULFILMENT_MAX_ATTEMPTS
+from pagination import KeysetPaginator, CURSOR_DIRECTION_NEXT, CURSOR_DIRECTION_PREVIOUS
+
+
+
+
+NUMBER_OF_ALBUMS = 20
+
+
+
+
+class SearchIndexDisablingMixin(object):
+    """ 
+        Keeps the albums created by tests out of the search index of the site.
+    """
+
+    def setUp(self):
+        super(SearchIndexDisablingMixin, self).setUp()
+        self.search_index_path = ALBUM_SEARCH_INDEX.path
+        ALBUM_SEARCH_INDEX.path = None
+
+    def tearDown(self):
+        ALBUM_SEARCH_INDEX.path = self.search_index_path
+        super(SearchIndexDisablingMixin, self).tearDown()
+
+
+
+
+class AlbumListQueryCountTest(SearchIndexDisablingMixin, TestCase):
+    """ 
+        Makes sure that the number of database queries needed to list albums does not depend on
+        how many pages the albums have, whether their covers have been resolved or not.
+    """
+
+    def setUp(self):
+        super(AlbumListQueryCountTest, self).setUp()
+        self.user = User.objects.create_user("querycounter", "querycounter@example.com", "password")
+        self.layout = Layout.objects.get(name = "SingleImage")
+        self.client.login(username = "querycounter", password = "password")
+
+    def create_albums(self, pages_per_album):
+        """ Replaces the albums of the test user with new ones having an image on their last page. """
+        Album.objects.filter(owner = self.user).delete()
+        for album_number in range(NUMBER_OF_ALBUMS):
+            album = Album(owner = self.user, title = u"Album number %d" % album_number, isPublic = True)
+            album.save()
+            for page_number in range(1, pages_per_album + 1):
+                page = Page(album = album, pageNumber = page_number, layout = self.layout)
+                page.save()
+                PageContent(page = page, placeHolderID = "SingleImage_caption_1", content = u"Caption").save()
+                if page_number == pages_per_album:
+                    PageContent(page = page, placeHolderID = "SingleImage_image_1",
+                                image = u"album_photos/%d/%d.jpg" % (album.id, page_number)).save()
+
+    def forget_covers(self):
+        """ Makes the covers of the albums of the test user to be resolved again when listing them. """
+        Album.objects.filter(owner = self.user).update(coverRenditions = "")
+
+    def get(self, url):
+        """ Gets given url as the test user with the cache emptied. """
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def number_of_queries(self, url):
+        """ Returns the number of queries needed to get given url. """
+        old_use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            reset_queries()
+            self.get(url)
+            return len(connection.queries)
+        finally:
+            connection.use_debug_cursor = old_use_debug_cursor
+
+    def assert_queries_do_not_depend_on_page_count(self, url):
+        # the first request fills caches living as long as the process, such as the one of the current site
+        self.get(url)
+
+        self.create_albums(2)
+        self.forget_covers()
+        queries_with_unresolved_covers = self.number_of_queries(url)
+        queries_with_resolved_covers = self.number_of_queries(url)
+
+        self.create_albums(40)
+        self.forget_covers()
+        self.assertNumQueries(queries_with_unresolved_covers, self.get, url)
+        self.assertNumQueries(queries_with_resolved_covers, self.get, url)
+
+    def test_list_of_public_albums(self):
+        self.assert_queries_do_not_depend_on_page_count("/album/")
+
+    def test_profile(self):
+        self.assert_queries_do_not_depend_on_page_count("/accounts/profile/")
+
+
+
+
+class PageOrderTest(SearchIndexDisablingMixin, TestCase):
+    """ 
+        Makes sure that inserting, moving, deleting and reordering pages keeps the pages of an album
+        numbered from one without gaps, in the expected order.
+    """
+
+    def setUp(self):
+        super(PageOrderTest, self).setUp()
+        self.layout = Layout.objects.get(name = "SingleImage")
+        self.album = Album(owner = User.objects.create_user("pageorderer", "pageorderer@example.com", "password"),
+                           title = u"Page order", isPublic = True)
+        self.album.save()
+        self.page_ids = [self.album.insert_page(self.layout).id for page_number in range(5)]
+
+    def page_ids_in_order(self):
+        """ Returns the ids of the pages of the album in the order of their numbers, which must have no gaps. """
+        pages = list(Page.objects.filter(album = self.album).order_by("pageNumber").values_list("pageNumber", "id"))
+        self.assertEqual([page_number for (page_number, page_id) in pages], range(1, len(pages) + 1))
+        self.assertEqual(Album.objects.get(pk = self.album.pk).pageCount, len(pages))
+        return [page_id for (page_number, page_id) in pages]
+
+    def test_insert_page(self):
+        (p1, p2, p3, p4, p5) = self.page_ids
+        middle = self.album.insert_page(self.layout, 2).id
+        self.assertEqual(self.page_ids_in_order(), [p1, middle, p2, p3, p4, p5])
+        first = self.album.insert_page(self.layout, 0).id
+        last = self.album.insert_page(self.layout, 100).id
+        self.assertEqual(self.page_ids_in_order(), [first, p1, middle, p2, p3, p4, p5, last])
+
+    def test_move_page_forwards(self):
+        (p1, p2, p3, p4, p5) = self.page_ids
+        self.album.move_page(2, 4)
+        self.assertEqual(self.page_ids_in_order(), [p1, p3, p4, p2, p5])
+        self.album.move_page(1, 100)
+        self.assertEqual(self.page_ids_in_order(), [p3, p4, p2, p5, p1])
+
+    def test_move_page_backwards(self):
+        (p1, p2, p3, p4, p5) = self.page_ids
+        self.album.move_page(5, 1)
+        self.assertEqual(self.page_ids_in_order(), [p5, p1, p2, p3, p4])
+        self.album.move_page(4, 3)
+        self.assertEqual(self.page_ids_in_order(), [p5, p1, p3, p2, p4])
+
+    def test_move_missing_page(self):
+        self.assertRaises(Page.DoesNotExist, self.album.move_page, 6, 1)
+        self.assertEqual(self.page_ids_in_order(), self.page_ids)
+
+    def test_delete_page(self):
+        (p1, p2, p3, p4, p5) = self.page_ids
+        self.assertTrue(self.album.delete_page(3))
+        self.assertEqual(self.page_ids_in_order(), [p1, p2, p4, p5])
+        self.assertTrue(self.album.delete_page(1))
+        self.assertEqual(self.page_ids_in_order(), [p2, p4, p5])
+        self.assertFalse(self.album.delete_page(4))
+
+    def test_reorder_pages(self):
+        (p1, p2, p3, p4, p5) = self.page_ids
+        self.album.reorder_pages([p4, p2, p5, p1, p3])
+        self.assertEqual(self.page_ids_in_order(), [p4, p2, p5, p1, p3])
+
+    def test_reorder_pages_with_invalid_order(self):
+        (p1, p2, p3, p4, p5) = self.page_ids
+        for page_ids in ([p1, p2, p3, p4], [p1, p2, p3, p4, p4], [p1, p2, p3, p4, p5, -1]):
+            self.assertRaises(ValueError, self.album.reorder_pages, page_ids)
+        self.assertEqual(self.page_ids_in_order(), self.page_ids)
+
+
+
+
+class KeysetPaginatorTest(SearchIndexDisablingMixin, TestCase):
+    """ 
+        Makes sure that the cursors of KeysetPaginator survive encoding and decoding, invalid cursors
+        refer to the first page, and following the cursors goes through all objects in both directions.
+    """
+
+    def setUp(self):
+        super(KeysetPaginatorTest, self).setUp()
+        # the titles repeat, so that the ids decide the order of some albums
+        owners = [User.objects.create_user("paginator%d" % owner_number, "paginator@example.com", "password")
+                  for owner_number in range(3)]
+        for album_number in range(7):
+            Album(owner = owners[album_number // 3], title = u"Paginated album %d" % (album_number % 3),
+                  isPublic = True).save()
+        self.albums = Album.objects.filter(title__startswith = u"Paginated album ")
+        cache.clear()
+
+    def paginator(self, ordering):
+        return KeysetPaginator(self.albums, ordering, 3, "test-keyset-paginator-count")
+
+    def test_cursor_round_trip(self):
+        for ordering in (("title", "id"), ("-creationDate", "-id")):
+            paginator = self.paginator(ordering)
+            for album in self.albums:
+                key = paginator._key_of(album)
+                for direction in (CURSOR_DIRECTION_NEXT, CURSOR_DIRECTION_PREVIOUS):
+                    cursor = paginator._encode_cursor(direction, key)
+                    self.assertTrue(cursor.replace("-", "").replace("_", "").isalnum())
+                    self.assertEqual(paginator._decode_cursor(cursor), (direction, key))
+
+    def test_invalid_cursors_refer_to_first_page(self):
+        paginator = self.paginator(("-creationDate", "-id"))
+        encode = lambda values: base64.urlsafe_b64encode(json.dumps(values)).rstrip("=")
+        for cursor in (None, "", "not base64!", u"\u00e4", base64.urlsafe_b64encode("not json"),
+                       encode("n"), encode([]), encode(["x"]), encode(["n", 1]), encode(["n", "not a date", 1]),
+                       encode(["p", "2012-01-01 12:00:00", 1, 2])):
+            self.assertEqual(paginator._decode_cursor(cursor), (CURSOR_DIRECTION_NEXT, []))
+
+    def test_pages_cover_all_objects(self):
+        for ordering in (("title", "id"), ("-creationDate", "-id")):
+            paginator = self.paginator(ordering)
+            expected_ids = list(self.albums.order_by(*ordering).values_list("id", flat = True))
+
+            page = paginator.page()
+            self.assertFalse(page.has_previous())
+            ids = [album.id for album in page]
+            while page.has_next():
+                page = paginator.page(page.next_cursor)
+                ids.extend([album.id for album in page])
+            self.assertEqual(ids, expected_ids)
+
+            page = paginator.page(paginator.last_page_cursor())
+            self.assertFalse(page.has_next())
+            ids = [album.id for album in page]
+            while page.has_previous():
+                page = paginator.page(page.previous_cursor)
+                ids[:0] = [album.id for album in page]
+            self.assertEqual(ids, expected_ids)
+
+
+
+
+class CheckoutTokenTest(SearchIndexDisablingMixin, TestCase):
+    """ 
+        Makes sure that checkout tokens are valid only for their user and step, and only until
+        the shopping cart of the user changes.
+    """
+
+    def setUp(self):
+        super(CheckoutTokenTest, self).setUp()
+        self.user = User.objects.create_user("tokenuser", "tokenuser@example.com", "password")
+        self.other_user = User.objects.create_user("othertokenuser", "othertokenuser@example.com", "password")
+        self.albums = []
+        for album_number in range(3):
+            album = Album(owner = self.user, title = u"Album %d" % album_number, isPublic = True)
+            album.save()
+            self.albums.append(album)
+            ShoppingCartItem.add(self.user, album.id)
+
+    def test_token_is_valid_for_its_user_and_step(self):
+        token = ShoppingCartItem.checkout_token(self.user, CHECKOUT_STEP_ORDER_SUMMARY)
+        self.assertTrue(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_ORDER_SUMMARY, token))
+        self.assertFalse(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_PLACE_ORDER, token))
+        self.assertFalse(ShoppingCartItem.is_checkout_token_valid(self.other_user, CHECKOUT_STEP_ORDER_SUMMARY, token))
+        for invalid_token in (None, "", u"\u00e4", token[:-1], token.upper()):
+            self.assertFalse(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_ORDER_SUMMARY,
+                                                                      invalid_token))
+
+    def test_token_expires_when_cart_changes(self):
+        token = ShoppingCartItem.checkout_token(self.user, CHECKOUT_STEP_PLACE_ORDER)
+        ShoppingCartItem.objects.get(user = self.user, album = self.albums[0]).delete()
+        self.assertFalse(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_PLACE_ORDER, token))
+
+        token = ShoppingCartItem.checkout_token(self.user, CHECKOUT_STEP_PLACE_ORDER)
+        ShoppingCartItem.add(self.user, self.albums[0].id)
+        self.assertFalse(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_PLACE_ORDER, token))
+
+    def test_token_for_given_cart_version(self):
+        cart_version = ShoppingCartItem.cart_version_of_user(self.user)
+        token = ShoppingCartItem.checkout_token(self.user, CHECKOUT_STEP_PLACE_ORDER, cart_version)
+        self.assertTrue(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_PLACE_ORDER, token))
+        self.assertFalse(ShoppingCartItem.is_checkout_token_valid(self.user, CHECKOUT_STEP_PLACE_ORDER, token,
+                                                                  cart_version + 1))
+
+    def test_bulk_update_changes_cart_version_once(self):
+        cart_version = ShoppingCartItem.cart_version_of_user(self.user)
+        ShoppingCartItem.update_items_of_user(self.user, {self.albums[0].id: 3, self.albums[1].id: 0})
+        self.assertEqual(ShoppingCartItem.cart_version_of_user(self.user), cart_version + 1)
+        self.assertEqual(list(ShoppingCartItem.objects.filter(user = self.user).order_by("album")
+                                                      .values_list("album", "count")),
+                         [(self.albums[0].id, 3), (self.albums[2].id, 1)])
+
+        ShoppingCartItem.update_items_of_user(self.user, {self.albums[0].id: 3})
+        self.assertEqual(ShoppingCartItem.cart_version_of_user(self.user), cart_version + 1)
+
+        ShoppingCartItem.remove_all_items_of_user(self.user)
+        self.assertEqual(ShoppingCartItem.cart_version_of_user(self.user), cart_version + 2)
+
+    def test_cart_changed_returns_new_version(self):
+        cart_version = ShoppingCartItem.cart_version_of_user(self.user)
+        self.assertEqual(ShoppingCartItem.cart_changed(self.user), cart_version + 1)
+        self.assertEqual(ShoppingCartItem.cart_version_of_user(self.user), cart_version + 1)
+
+
+
+
+class OrderPlacementTest(SearchIndexDisablingMixin, TransactionTestCase):
+    """ 
+        Makes sure that an order is created from a shopping cart in a single transaction. Transactions
+        are really committed and rolled back in these tests, so they cannot be run inside the
+        transaction of a TestCase.
+    """
+
+    def setUp(self):
+        super(OrderPlacementTest, self).setUp()
+        self.user = User.objects.create_user("orderer", "orderer@example.com", "password")
+        self.address = Address(owner = self.user, postAddressLine1 = u"Street 1", zipCode = u"00100",
+                               city = u"Helsinki")
+        self.address.save()
+        layout = Layout.objects.get(name = "SingleImage")
+        for album_number in range(3):
+            album = Album(owner = self.user, title = u"Album %d" % album_number, isPublic = True)
+            album.save()
+            for page_number in range(album_number + 1):
+                album.insert_page(layout)
+            ShoppingCartItem.add(self.user, album.id)
+        ShoppingCartItem.objects.filter(user = self.user).update(deliveryAddress = self.address)
+
+    def test_order_is_created_from_cart(self):
+        order = Order.create_from_shopping_cart_for_user(self.user)
+        items = list(order.items())
+        self.assertEqual(len(items), 3)
+        self.assertEqual(sorted([item.unitPrice for item in items]),
+                         sorted([album.unitPrice for album in Album.objects.filter(owner = self.user)]))
+        self.assertEqual(order.info()["order_total_price"], order.total_price())
+        self.assertFalse(ShoppingCartItem.objects.filter(user = self.user).exists())
+        self.assertRaises(ShoppingCartEmptyError, Order.create_from_shopping_cart_for_user, self.user)
+
+    def test_failed_order_changes_nothing(self):
+        cart_version = ShoppingCartItem.cart_version_of_user(self.user)
+        number_of_orders = Order.objects.count()
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("Inserting the items failed.")
+        original_insert_rows = models.insert_rows
+        models.insert_rows = fail
+        try:
+            self.assertRaises(RuntimeError, Order.create_from_shopping_cart_for_user, self.user)
+        finally:
+            models.insert_rows = original_insert_rows
+
+        self.assertEqual(Order.objects.count(), number_of_orders)
+        self.assertEqual(ShoppingCartItem.objects.filter(user = self.user).count(), 3)
+        self.assertEqual(ShoppingCartItem.cart_version_of_user(self.user), cart_version)
+
+    def test_cart_changed_after_confirmation_is_not_ordered(self):
+        confirmed_cart_version = ShoppingCartItem.cart_version_of_user(self.user)
+        number_of_orders = Order.objects.count()
+
+        album = Album(owner = self.user, title = u"Album added in another tab", isPublic = True)
+        album.save()
+        ShoppingCartItem.add(self.user, album.id)
+        cart_version = ShoppingCartItem.cart_version_of_user(self.user)
+
+        self.assertRaises(ShoppingCartChangedError, Order.create_from_shopping_cart_for_user, self.user,
+                          confirmed_cart_version)
+        self.assertEqual(Order.objects.count(), number_of_orders)
+        self.assertEqual(ShoppingCartItem.objects.filter(user = self.user).count(), 4)
+        self.assertEqual(ShoppingCartItem.cart_version_of_user(self.user), cart_version)
+
+        order = Order.create_from_shopping_cart_for_user(self.user, cart_version)
+        self.assertEqual(len(list(order.items())), 4)
+
+
+
+
+class FulfilmentQueueTest(SearchIndexDisablingMixin, TestCase):
+    """ 
+        Makes sure that the tasks of the fulfilment queue are leased to a single worker at a time,
+        and that completing or releasing them changes the statuses of their orders.
+    """
+
+    def setUp(self):
+        super(FulfilmentQueueTest, self).setUp()
+        self.orders = []
+        for order_number in range(3):
+            user = User.objects.create_user("fulfilled%d" % order_number, "fulfilled@example.com", "password")
+            order = Order(orderer = user, status = OrderStatus.ordered())
+            order.save()
+            order.change_status(OrderStatus.paid_and_being_processed(), u"payer")
+            self.orders.append(order)
+
+    def make_tasks_available(self):
+        FulfilmentTask.objects.update(availableDate = datetime.now() - timedelta(seconds = 1))
+
+    def test_paid_orders_are_queued(self):
+        self.assertEqual(sorted(FulfilmentTask.objects.values_list("order", flat = True)),
+                         sorted([order.id for order in self.orders]))
+
+    def test_claimed_tasks_are_not_claimed_again(self):
+        first_batch = FulfilmentTask.claim_batch("first", 2)
+        second_batch = FulfilmentTask.claim_batch("second", 5)
+        self.assertEqual(len(first_batch), 2)
+        self.assertEqual(len(second_batch), 1)
+        self.assertEqual(FulfilmentTask.claim_batch("third", 5), [])
+        self.assertEqual(sorted([task.order_id for task in first_batch + second_batch]),
+                         sorted([order.id for order in self.orders]))
+        for task in first_batch + second_batch:
+            self.assertEqual(task.attempts, 1)
+
+    def test_completing_task_sends_order(self):
+        task = FulfilmentTask.claim_batch("worker", 1)[0]
+        self.assertTrue(task.complete(u"packed"))
+        self.assertTrue(Order.objects.get(pk = task.order_id).is_sent())
+        self.assertFalse(FulfilmentTask.objects.filter(pk = task.pk).exists())
+
+    def test_expired_lease_is_lost(self):
+        task = FulfilmentTask.claim_batch("slow", 1)[0]
+        self.make_tasks_available()
+        tasks_of_fast_worker = dict([(t.pk, t) for t in FulfilmentTask.claim_batch("fast", 3)])
+        self.assertTrue(task.pk in tasks_of_fast_worker)
+
+        self.assertFalse(task.complete())
+        self.assertFalse(task.release())
+        self.assertTrue(Order.objects.get(pk = task.order_id).is_paid_and_being_processed())
+        self.assertTrue(tasks_of_fast_worker[task.pk].complete())
+        self.assertTrue(Order.objects.get(pk = task.order_id).is_sent())
+
+    def test_released_task_is_retried_until_order_is_blocked(self):
+        order = self.orders[0]
+        for attempt in range(1, FULFILMENT_MAX_ATTEMPTS + 1):
+            self.make_tasks_available()
+            task = [t for t in FulfilmentTask.claim_batch("failing", 3) if t.order_id == order.id][0]
+            self.assertEqual(task.attempts, attempt)
+            self.assertTrue(task.release(u"printer jammed"))
+            if attempt < FULFILMENT_MAX_ATTEMPTS:
+                self.assertTrue(Order.objects.get(pk = order.pk).is_paid_and_being_processed())
+                self.assertTrue(FulfilmentTask.objects.get(pk = task.pk).availableDate > datetime.now())
+        self.assertTrue(Order.objects.get(pk = order.pk).is_blocked())
+        self.assertFalse(FulfilmentTask.objects.filter(order = order).exists())
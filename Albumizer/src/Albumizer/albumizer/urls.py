@@ -15,10 +15,21 @@ urlpatterns = patterns('albumizer.views',
     (r'^$', 'welcome_page'),
 
     (r'^album/$', 'list_all_public_albums'),
+    (r'^album/search/$', 'search_albums'),
     (r'^album/(?P<album_id>\d+)/s/(?P<secret_hash>[a-z0-9]{64})/$', 'show_single_album_with_hash'),
     (r'^album/(?P<album_id>\d+)/(?P<page_number>\d+)/s/(?P<secret_hash>[a-z0-9]{64})/$', 'show_single_page_with_hash'),
+    (r'^album/(?P<album_id>\d+)/(?P<page_number>\d+)/bundle/(?P<how_many>\d{1,2})/$',
+        'show_page_bundle', {}, 'show_page_bundle'),
+    (r'^album/(?P<album_id>\d+)/(?P<page_number>\d+)/bundle/(?P<how_many>\d{1,2})/s/(?P<secret_hash>[a-z0-9]{64})/$',
+        'show_page_bundle_with_hash'),
     (r'^album/(?P<album_id>\d+)/slideshow/$', 'view_album_slideshow'),
     (r'^album/(?P<album_id>\d+)/slideshow/s/(?P<secret_hash>[a-z0-9]{64})/$', 'view_album_slideshow_with_hash'),
+    (r'^album/(?P<album_id>\d+)/slideshow/(?P<page_number>\d+)/(?P<how_many>\d{1,2})/$',
+        'show_slideshow_slides', {}, 'show_slideshow_slides'),
+    (r'^album/(?P<album_id>\d+)/slideshow/(?P<page_number>\d+)/(?P<how_many>\d{1,2})/s/(?P<secret_hash>[a-z0-9]{64})/$',
+        'show_slideshow_slides_with_hash'),
+
+    (r'^layouts/(?P<version_hash>[0-9a-f]{12})\.css$', 'layout_stylesheet', {}, 'layout_stylesheet'),
 
     (r'^accounts/$', redirect_to, {'url': 'accounts/profile/'}),
     (r'^accounts/logout/$', 'log_out'),
@@ -31,6 +42,7 @@ urlpatterns = patterns('albumizer.views',
     (r'^api/json/album/random/$', redirect_to, {'url': '/api/json/album/random/4/'}),
     (r'^api/json/album/random/(?P<how_many>\d)/$', 'api_json_get_random_albums'),
     (r'^api/json/album/count/$', 'api_json_get_album_count'),
+    (r'^api/json/album/(?P<album_id>\d+)/reorder_pages/$', 'api_json_reorder_pages', {}, 'reorder_pages'),
     (r'^api/json/user/count/$', 'api_json_get_user_count'),
 )
 
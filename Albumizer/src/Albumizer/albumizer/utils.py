@@ -1,22 +1,135 @@
 ﻿# This Python file uses the following encoding: utf-8
 
+from django.db import connections, router, transaction
+from pricing import money
+
 
 
 
 def convert_money_into_two_decimal_string(amount):
-    """ Returns the price of this album as a string with two decimal places. """
-    amount_str = unicode(round(amount, 2))
-    period_pos = amount_str.find(".")
-    if period_pos == -1:
-        amount_str += ".00"
-    else:
-        numbers_after_period = len(amount_str) - period_pos - 1
-        if numbers_after_period == 1:
-            amount_str += "0"
-        elif numbers_after_period == 0:
-            amount_str += "00"
-
-    return amount_str
+    """ Returns given amount of money as a string with two decimal places. """
+    return unicode(money(amount))
+
+
+
+
+BULK_UPDATE_CHUNK_SIZE = 100
+
+def update_fields_by_pk(model, field_names, values_by_pk):
+    """ 
+        Updates given fields of several rows of a model in a single UPDATE statement per
+        BULK_UPDATE_CHUNK_SIZE rows, when each row gets its own values. values_by_pk is a dictionary
+        mapping primary keys of the rows to tuples of values in the same order as field_names, e.g.
+
+            update_fields_by_pk(Page, ["pageNumber"], {12: (1,), 15: (2,)})
+
+        Like QuerySet.update(), this bypasses Model.save() and sends no signals.
+    """
+    if not values_by_pk:
+        return
+
+    database_alias = router.db_for_write(model)
+    connection = connections[database_alias]
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(field_name) for field_name in field_names]
+    primary_key_column = quote_name(model._meta.pk.column)
+
+    primary_keys = values_by_pk.keys()
+    cursor = connection.cursor()
+    for chunk_start in range(0, len(primary_keys), BULK_UPDATE_CHUNK_SIZE):
+        chunk_of_primary_keys = primary_keys[chunk_start:chunk_start + BULK_UPDATE_CHUNK_SIZE]
+
+        assignments = []
+        parameters = []
+        for (field_index, field) in enumerate(fields):
+            cases = []
+            for primary_key in chunk_of_primary_keys:
+                cases.append("WHEN %s THEN %s")
+                parameters.append(primary_key)
+                parameters.append(field.get_db_prep_save(values_by_pk[primary_key][field_index],
+                                                         connection = connection))
+            # The rows are limited by the WHERE clause, so the ELSE branch is never taken. It makes the type
+            # of the CASE expression that of the column, even if all the values are NULLs, without casts,
+            # whose types differ between databases.
+            column = quote_name(field.column)
+            assignments.append("%s = CASE %s %s ELSE %s END" % (column, primary_key_column, " ".join(cases), column))
+
+        parameters.extend(chunk_of_primary_keys)
+        cursor.execute("UPDATE %s SET %s WHERE %s IN (%s)" % (quote_name(model._meta.db_table), ", ".join(assignments),
+                                                                primary_key_column,
+                                                                ", ".join(["%s"] * len(chunk_of_primary_keys))),
+                       parameters)
+
+    transaction.commit_unless_managed(using = database_alias)
+
+
+
+
+def delete_rows_by_pk(model, primary_keys):
+    """ 
+        Deletes several rows of a model with a single DELETE statement per BULK_UPDATE_CHUNK_SIZE rows.
+        Unlike QuerySet.delete(), this neither loads the rows nor sends signals, and rows referring to
+        the deleted ones are not deleted along with them, so it suits only models, which no other
+        model refers to.
+    """
+    if not primary_keys:
+        return
+
+    database_alias = router.db_for_write(model)
+    connection = connections[database_alias]
+    quote_name = connection.ops.quote_name
+
+    primary_keys = list(primary_keys)
+    cursor = connection.cursor()
+    for chunk_start in range(0, len(primary_keys), BULK_UPDATE_CHUNK_SIZE):
+        chunk_of_primary_keys = primary_keys[chunk_start:chunk_start + BULK_UPDATE_CHUNK_SIZE]
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (quote_name(model._meta.db_table),
+                                                             quote_name(model._meta.pk.column),
+                                                             ", ".join(["%s"] * len(chunk_of_primary_keys))),
+                       chunk_of_primary_keys)
+
+    transaction.commit_unless_managed(using = database_alias)
+
+
+
+
+BULK_INSERT_CHUNK_SIZE = 100
+
+def insert_rows(model, field_names, rows):
+    """ 
+        Inserts several rows of a model with a single multi-row INSERT statement per
+        BULK_INSERT_CHUNK_SIZE rows. rows is a sequence of tuples of values in the same
+        order as field_names, e.g.
+
+            insert_rows(OrderItem, ["order", "album", "count"], [(5, 12, 1), (5, 15, 2)])
+
+        Like QuerySet.update(), this bypasses Model.save() and sends no signals. The primary
+        keys of the new rows are not returned, so they must be queried afterwards if needed.
+    """
+    if not rows:
+        return
+
+    database_alias = router.db_for_write(model)
+    connection = connections[database_alias]
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(field_name) for field_name in field_names]
+    row_placeholder = "(%s)" % ", ".join(["%s"] * len(fields))
+
+    cursor = connection.cursor()
+    for chunk_start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        chunk_of_rows = rows[chunk_start:chunk_start + BULK_INSERT_CHUNK_SIZE]
+
+        parameters = []
+        for row in chunk_of_rows:
+            for (field, value) in zip(fields, row):
+                parameters.append(field.get_db_prep_save(value, connection = connection))
+
+        cursor.execute("INSERT INTO %s (%s) VALUES %s" % (quote_name(model._meta.db_table),
+                                                          ", ".join([quote_name(field.column) for field in fields]),
+                                                          ", ".join([row_placeholder] * len(chunk_of_rows))),
+                       parameters)
+
+    transaction.commit_unless_managed(using = database_alias)
 
 
 
@@ -8,7 +8,6 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core.cache import cache
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponseServerError, \
         HttpResponseNotFound, HttpResponse
@@ -18,10 +17,13 @@ from django.template.loader import render_to_string
 from django.utils import simplejson as json
 import facebook_api
 from models import FacebookProfile, Album, Page, PageContent, \
-        Address, ShoppingCartItem, ShoppingCartEmptyError, Order, SPSPayment, OrderStatus
+        Address, ShoppingCartItem, ShoppingCartEmptyError, ShoppingCartChangedError, Order, SPSPayment, OrderStatus, \
+        CONTENT_KIND_IMAGE, CONTENT_KIND_CAPTION, LAYOUT_TABLE, LAYOUT_STYLESHEET, url_of_layout_stylesheet, \
+        CHECKOUT_STEP_DELIVERY_ADDRESSES, CHECKOUT_STEP_ORDER_SUMMARY, CHECKOUT_STEP_PLACE_ORDER
 from forms import AlbumCreationForm, LoginForm, AddPageForm, \
         EditPageForm, build_delivery_address_form, UserProfileForm, AddressModelForm, RegistrationModelForm, \
-        UserAuthForm, EditUserAuthForm
+        UserAuthForm, EditUserAuthForm, AlbumSearchForm
+from pagination import KeysetPaginator
 import utils
 
 
@@ -231,75 +233,160 @@ def welcome_page(request):
 
 
 
+# Orderings of album lists, each of which ends with a unique field as required by KeysetPaginator
+ALBUM_LIST_ORDERINGS = {
+    "title": ("title", "id"),
+    "newest": ("-creationDate", "-id"),
+}
+DEFAULT_ALBUM_LIST_ORDERING = "title"
+
+def paginate_albums(request, albums, albums_per_page, count_cache_key):
+    """
+        Returns a page of given albums, which is selected by the "cursor" parameter of the request,
+        sorted by the ordering named in the "sort" parameter, and the name of the ordering.
+        The covers of the albums on the page are resolved.
+    """
+    ordering_name = request.GET.get("sort")
+    if ordering_name not in ALBUM_LIST_ORDERINGS:
+        ordering_name = DEFAULT_ALBUM_LIST_ORDERING
+
+    paginator = KeysetPaginator(albums, ALBUM_LIST_ORDERINGS[ordering_name], albums_per_page, count_cache_key)
+    page = paginator.page(request.GET.get("cursor"))
+    page.object_list = Album.resolve_covers(page)
+    return (page, ordering_name)
+
+
+
+
+CACHE_KEY_PUBLIC_ALBUM_COUNT = "public_album_count"
+
 @prevent_all_caching
 def list_all_public_albums(request):
     """ Lists all public albums. """
-    albums = Album.objects.filter(isPublic = True).order_by('title')
+    albums = Album.objects.filter(isPublic = True)
+    (albums, ordering_name) = paginate_albums(request, albums, 20, CACHE_KEY_PUBLIC_ALBUM_COUNT)
 
-    paginator = Paginator(albums, 20) # Show 20 albums per page
+    template_parameters = {'albums': albums, 'sort': ordering_name, 'is_album_list_page': True,
+                           'search_form': AlbumSearchForm()}
+    return render_to_response_as_public('album/list-all.html', RequestContext(request, template_parameters))
 
-    # Make sure page request is an int. If not, deliver first page.
-    try:
-        page = int(request.GET.get('page', '1'))
-    except ValueError:
-        page = 1
 
-    # If page request (9999) is out of range, deliver last page of results.
-    try:
-        albums = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        albums = paginator.page(paginator.num_pages)
 
-    template_parameters = {'albums': albums, 'is_album_list_page': True}
-    return render_to_response_as_public('album/list-all.html', RequestContext(request, template_parameters))
 
+@prevent_all_caching
+def search_albums(request):
+    """ Lists the albums visible to the user, which match given search criteria, best matches first. """
+    albums = []
+    search_form = AlbumSearchForm(request.GET or None)
+    if search_form.is_valid():
+        albums = Album.search(search_form.cleaned_data["txtSearchCriteria"], request.user)
+        albums = Album.resolve_covers(albums)
 
+    template_parameters = {'albums': {'object_list': albums}, 'search_form': search_form}
+    return render_to_response('album/search.html', RequestContext(request, template_parameters))
 
 
-def show_single_page_GET(request, album_id, page_number):
-    myalbum = Album.by_id(album_id)
-    if not myalbum:
-        return render_to_response('album/album-not-found.html', RequestContext(request))
 
-    if myalbum.is_hidden_from_user(request.user):
-        return render_to_response_as_public('album/view-access-denied.html', RequestContext(request))
 
-    mypage = Page.by_album_id_and_page_number(album_id, page_number)
-    if not mypage:
-        return render_to_response('album/page-not-found.html', RequestContext(request))
+PAGES_PER_BUNDLE_MAX = 10
+
 
-    pageNumberInt = int(page_number)
+def single_page_links(album_id, page_info, secret_hash = None):
+    """ 
+        Returns links needed for showing a single page, given one of the pages returned by Page.window_info().
+        If a secret hash is given, the links are the ones for browsing the album with it.
+    """
+    page_number = page_info["page"].pageNumber
+    if secret_hash is None:
+        page_link = lambda number: reverse('show_single_page', kwargs = {"album_id":album_id, "page_number":number})
+        bundle_link = lambda number: reverse('show_page_bundle',
+                        kwargs = {"album_id":album_id, "page_number":number, "how_many":PAGES_PER_BUNDLE_MAX})
+        up_link = reverse('show_single_album', kwargs = {"album_id":album_id})
+    else:
+        page_link = lambda number: reverse('albumizer.views.show_single_page_with_hash',
+                        kwargs = {"album_id":album_id, "page_number":number, "secret_hash": secret_hash})
+        bundle_link = lambda number: reverse('albumizer.views.show_page_bundle_with_hash',
+                        kwargs = {"album_id":album_id, "page_number":number, "how_many":PAGES_PER_BUNDLE_MAX,
+                                  "secret_hash": secret_hash})
+        up_link = reverse('albumizer.views.show_single_album_with_hash',
+                        kwargs = {"album_id":album_id, "secret_hash": secret_hash})
+
+    links = {"pageLink": page_link(page_number), "upLink": up_link}
+    if page_info["has_next_page"]:
+        links["nextLink"] = page_link(page_number + 1)
+        links["nextBundleLink"] = bundle_link(page_number + 1)
+    if page_info["has_previous_page"]:
+        links["previousLink"] = page_link(page_number - 1)
+    return links
+
+
+
+
+def single_page_context(request, album, page_info, secret_hash = None):
+    """ 
+        Returns a template context for showing a single page, given its album and one of the pages
+        returned by Page.window_info(). If a secret hash is given, the links in the context are the
+        ones for browsing the album with it.
+    """
+    mypage = page_info["page"]
     context = {"pageNumber":mypage.pageNumber,
-          "albumTitle":myalbum.title,
+          "albumTitle":album.title,
           "layoutCssClass":mypage.layout.cssClass,
-          "current_user_can_edit": myalbum.is_editable_to_user(request.user),
-          "current_user_can_delete": myalbum.is_editable_to_user(request.user),
-          "album_id": album_id
+          "current_user_can_edit": album.is_editable_to_user(request.user),
+          "current_user_can_delete": album.is_editable_to_user(request.user),
+          "album_id": album.id
           }
     images = []
     texts = []
 
-    for pagecontent in mypage.pagecontents.all():
+    for pagecontent in page_info["contents"]:
         if pagecontent.image:
             images.append(pagecontent.image)
         elif pagecontent.content:
             texts.append(pagecontent.content)
     context["texts"] = texts
     context["images"] = images
-    context["cssContent"] = mypage.layout.cssContent
-    if myalbum.pages().filter(pageNumber = pageNumberInt + 1).exists():
-        context["nextLink"] = reverse('show_single_page', kwargs = {"album_id":album_id, "page_number":pageNumberInt + 1})
-    if myalbum.pages().filter(pageNumber = pageNumberInt - 1).exists():
-        context["previousLink"] = reverse('show_single_page', kwargs = {"album_id":album_id, "page_number":pageNumberInt - 1})
-    context["upLink"] = reverse('show_single_album', kwargs = {"album_id":album_id})
+    context["layoutStylesheet"] = url_of_layout_stylesheet()
+    context.update(single_page_links(album.id, page_info, secret_hash))
+    return context
+
+
+
+
+def single_page_as_json_data(request, album, page_info, secret_hash = None):
+    """ 
+        Returns the data needed for showing a single page in the ajax page viewer, given its album
+        and one of the pages returned by Page.window_info().
+    """
+    context = single_page_context(request, album, page_info, secret_hash)
+    return {
+        "pageLink":context["pageLink"],
+        "layoutStylesheet":context["layoutStylesheet"],
+        "ajaxContainer":render_to_string('album/view-album-page-single-ajaxContainer.html',
+                                         RequestContext(request, context))
+    }
+
+
+
+
+def show_single_page_GET(request, album_id, page_number):
+    page_info = Page.view_info(album_id, page_number)
+    myalbum = page_info["album"]
+    if not myalbum:
+        return render_to_response('album/album-not-found.html', RequestContext(request))
+
+    if myalbum.is_hidden_from_user(request.user):
+        return render_to_response_as_public('album/view-access-denied.html', RequestContext(request))
+
+    mypage = page_info["page"]
+    if not mypage:
+        return render_to_response('album/page-not-found.html', RequestContext(request))
 
     if request.is_ajax() or request.GET.get("ajax", ""):
-        data = {
-            "cssContainer":mypage.layout.cssContent,
-            "ajaxContainer":render_to_string('album/view-album-page-single-ajaxContainer.html', RequestContext(request, context))
-        }
+        data = single_page_as_json_data(request, myalbum, page_info)
         return HttpResponse(json.dumps(data), mimetype = "application/json")
 
+    context = single_page_context(request, myalbum, page_info)
     response = render_to_response_as_public('album/view-album-page-single.html', RequestContext(request, context))
     if not myalbum.isPublic or myalbum.is_editable_to_user(request.user):
         add_caching_preventing_headers(response)
@@ -328,58 +415,85 @@ def show_single_page_POST(request, album_id, page_number):
 def show_single_page_with_hash(request, album_id, page_number, secret_hash):
     """ Allows user to browse a single page of an private album with a secret hash code. """
 
-    myalbum = Album.by_id(album_id)
+    page_info = Page.view_info(album_id, page_number, secret_hash)
+    myalbum = page_info["album"]
     if not myalbum:
         return render_to_response('album/album-not-found.html', RequestContext(request))
 
-    mypage = Page.by_album_id_and_page_number(album_id, page_number)
+    mypage = page_info["page"]
     if not mypage:
         return render_to_response('album/page-not-found.html', RequestContext(request))
 
     if myalbum.isPublic or myalbum.is_owned_by(request.user):
         return HttpResponseRedirect(mypage.get_absolute_url())
 
-    pageNumberInt = int(page_number)
-    context = {"pageNumber":mypage.pageNumber,
-          "albumTitle":myalbum.title,
-          "layoutCssClass":mypage.layout.cssClass,
-          "current_user_can_edit": myalbum.is_editable_to_user(request.user),
-          "current_user_can_delete": myalbum.is_editable_to_user(request.user),
-          "album_id": album_id
-          }
-    images = []
-    texts = []
-
-    for pagecontent in mypage.pagecontents.all():
-        if pagecontent.image:
-            images.append(pagecontent.image)
-        elif pagecontent.content:
-            texts.append(pagecontent.content)
-    context["texts"] = texts
-    context["images"] = images
-    context["cssContent"] = mypage.layout.cssContent
-    if myalbum.pages().filter(pageNumber = pageNumberInt + 1).exists():
-        context["nextLink"] = reverse('albumizer.views.show_single_page_with_hash',
-                        kwargs = {"album_id":album_id, "page_number":pageNumberInt + 1, "secret_hash": secret_hash})
-    if myalbum.pages().filter(pageNumber = pageNumberInt - 1).exists():
-        context["previousLink"] = reverse('albumizer.views.show_single_page_with_hash',
-                        kwargs = {"album_id":album_id, "page_number":pageNumberInt - 1, "secret_hash": secret_hash})
-    context["upLink"] = reverse('albumizer.views.show_single_album_with_hash',
-                                kwargs = {"album_id":album_id, "secret_hash": secret_hash})
-
     if request.is_ajax() or request.GET.get("ajax", ""):
-        data = {
-            "cssContainer":mypage.layout.cssContent,
-            "ajaxContainer":render_to_string('album/view-album-page-single-ajaxContainer.html',
-                                             RequestContext(request, context))
-        }
+        data = single_page_as_json_data(request, myalbum, page_info, secret_hash)
         return HttpResponse(json.dumps(data), mimetype = "application/json")
 
+    context = single_page_context(request, myalbum, page_info, secret_hash)
     return render_to_response('album/view-album-page-single.html', RequestContext(request, context))
 
 
 
 
+def page_bundle_response(request, window, secret_hash = None):
+    """ 
+        Returns a json response containing the data of all pages of a window returned by Page.window_info()
+        for the ajax page viewer, so that it can flip through them without further requests.
+    """
+    data = {"pages": [single_page_as_json_data(request, window["album"], page_info, secret_hash)
+                      for page_info in window["pages"]]}
+    return HttpResponse(json.dumps(data), mimetype = "application/json")
+
+
+
+
+def show_page_bundle(request, album_id, page_number, how_many):
+    """ 
+        Returns a json representation of a window of consecutive pages starting from a given page, at most
+        PAGES_PER_BUNDLE_MAX of them. Visibility rules are the same as the ones of show_single_page_GET.
+    """
+    window = Page.window_info(album_id, page_number, min(int(how_many), PAGES_PER_BUNDLE_MAX))
+    myalbum = window["album"]
+    if not myalbum:
+        return HttpResponseNotFound()
+
+    if myalbum.is_hidden_from_user(request.user):
+        response = HttpResponse(status = 403)
+        add_caching_preventing_headers(response)
+        return response
+
+    response = page_bundle_response(request, window)
+    if myalbum.isPublic and not myalbum.is_editable_to_user(request.user):
+        add_public_caching_headers(response)
+    else:
+        add_caching_preventing_headers(response)
+    return response
+
+
+
+
+@prevent_all_caching
+def show_page_bundle_with_hash(request, album_id, page_number, how_many, secret_hash):
+    """ 
+        Returns a json representation of a window of consecutive pages of an private album with a secret
+        hash code. Visibility rules are the same as the ones of show_single_page_with_hash.
+    """
+    window = Page.window_info(album_id, page_number, min(int(how_many), PAGES_PER_BUNDLE_MAX), secret_hash)
+    myalbum = window["album"]
+    if not myalbum:
+        return HttpResponseNotFound()
+
+    if myalbum.isPublic or myalbum.is_owned_by(request.user):
+        return HttpResponseRedirect(reverse('show_page_bundle',
+                        kwargs = {"album_id":album_id, "page_number":page_number, "how_many":how_many}))
+
+    return page_bundle_response(request, window, secret_hash)
+
+
+
+
 ADD_ALBUM_TO_SHOPPING_CART_ERR_MSG_MISSING_ALBUM_UI = \
     u"We are sorry. You tried to add your shopping cart an album, which does " + \
     u"not exist. If the album in question has previously been available, " + \
@@ -428,6 +542,7 @@ def show_single_album_GET(request, album_id):
 
     template_parameters = {
         "album": album,
+        "album_info": album.detail_info(),
         "is_visible_to_current_user": album.is_visible_to_user(request.user),
         "current_user_can_edit": album.is_editable_to_user(request.user),
         "current_user_can_delete": album.is_editable_to_user(request.user),
@@ -511,7 +626,7 @@ def show_single_album_POST(request, album_id):
 
         album_title = album.title
 
-        images = PageContent.objects.filter(page__album = album, placeHolderID__contains = '_image_')
+        images = PageContent.objects.filter(page__album = album, kind = CONTENT_KIND_IMAGE)
 
         for image in images:
             if image.image:
@@ -534,7 +649,10 @@ def show_single_album_POST(request, album_id):
                 (request.user.username, album_id))
             return HttpResponseRedirect(reverse("albumizer.views.show_profile"))
 
-        myAlbum.deletePage(pageNumber)
+        try:
+            myAlbum.delete_page(int(pageNumber))
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest()
         request.user.message_set.create(message = "Page %s deleted" % pageNumber)
         return HttpResponseRedirect(reverse("show_single_album", args = [album_id]))
 
@@ -561,6 +679,7 @@ def show_single_album_with_hash(request, album_id, secret_hash):
 
     template_parameters = {
         "album": album,
+        "album_info": album.detail_info(),
         "opened_using_secret_hash": True,
         "is_visible_to_current_user": album.is_visible_to_user(request.user),
         "current_user_can_edit": album.is_editable_to_user(request.user),
@@ -572,6 +691,53 @@ def show_single_album_with_hash(request, album_id, secret_hash):
 
 
 
+SLIDESHOW_SLIDES_AT_START = 3
+SLIDESHOW_SLIDES_PER_REQUEST = 5
+
+
+def slideshow_slides_link(album_id, page_number, secret_hash = None):
+    """ Returns a link to the slides of an album starting from a given page, see show_slideshow_slides. """
+    if secret_hash is None:
+        return reverse('show_slideshow_slides',
+                       kwargs = {"album_id":album_id, "page_number":page_number,
+                                 "how_many":SLIDESHOW_SLIDES_PER_REQUEST})
+    return reverse('albumizer.views.show_slideshow_slides_with_hash',
+                   kwargs = {"album_id":album_id, "page_number":page_number,
+                             "how_many":SLIDESHOW_SLIDES_PER_REQUEST, "secret_hash":secret_hash})
+
+
+
+
+def slideshow_template_parameters(album, secret_hash = None):
+    """ 
+        Returns template parameters for showing a skeleton of a slideshow of all pages of an album, only
+        the first SLIDESHOW_SLIDES_AT_START of them having content. The rest of the slides are loaded on
+        demand as the slideshow advances. Everything is fetched with two queries no matter how many pages
+        there are, and none of them, if the album is empty.
+    """
+    pages = list(album.pages())
+    contents_by_page_id = Page.contents_by_page_id(pages[:SLIDESHOW_SLIDES_AT_START])
+
+    slides = []
+    for page in pages:
+        page.album = album
+        page.layout = LAYOUT_TABLE.by_pk(page.layout_id)
+        slides.append({
+            "page": page,
+            "isLoaded": page.id in contents_by_page_id,
+            "contents": contents_by_page_id.get(page.id, []),
+            "slidesLink": slideshow_slides_link(album.id, page.pageNumber, secret_hash)
+        })
+
+    return {
+        "album":album,
+        "layoutStylesheet":url_of_layout_stylesheet(),
+        "slides":slides,
+        "slides_per_request":SLIDESHOW_SLIDES_PER_REQUEST}
+
+
+
+
 def view_album_slideshow(request, album_id):
     myalbum = Album.by_id(album_id)
     if not myalbum:
@@ -580,19 +746,11 @@ def view_album_slideshow(request, album_id):
     if myalbum.is_hidden_from_user(request.user):
         return render_to_response_as_public('album/view-access-denied.html', RequestContext(request))
 
-    if not myalbum.has_pages():
+    templateparameters = slideshow_template_parameters(myalbum)
+    if not templateparameters["slides"]:
         request.user.message_set.create(message = "Can't start a slideshow with an empty album")
         return HttpResponseRedirect(reverse("show_single_album", args = [myalbum.id]))
 
-    layouts = []
-    for page in myalbum.pages():
-        if not page.layout in layouts:
-            layouts.append(page.layout)
-
-    templateparameters = {
-        "album":myalbum,
-        "layouts":layouts}
-
     response = render_to_response('album/view-album-slideshow.html', RequestContext(request, templateparameters))
     if not myalbum.isPublic or myalbum.is_editable_to_user(request.user):
         add_caching_preventing_headers(response)
@@ -610,20 +768,97 @@ def view_album_slideshow_with_hash(request, album_id, secret_hash):
     if myalbum.isPublic or myalbum.is_owned_by(request.user):
         return HttpResponseRedirect(reverse("albumizer.views.view_album_slideshow", args = [myalbum.id]))
 
-    if not myalbum.has_pages():
+    templateparameters = slideshow_template_parameters(myalbum, secret_hash)
+    if not templateparameters["slides"]:
         request.user.message_set.create(message = "Can't start a slideshow with an empty album")
         return HttpResponseRedirect(reverse("show_single_album", args = [myalbum.id]))
 
-    layouts = []
-    for page in myalbum.pages():
-        if not page.layout in layouts:
-            layouts.append(page.layout)
+    return render_to_response('album/view-album-slideshow.html', RequestContext(request, templateparameters))
 
-    templateparameters = {
-        "album":myalbum,
-        "layouts":layouts}
 
-    return render_to_response('album/view-album-slideshow.html', RequestContext(request, templateparameters))
+
+
+def slideshow_slides_response(request, window):
+    """ 
+        Returns a json response containing the rendered slides of all pages of a window
+        returned by Page.window_info().
+    """
+    slides = []
+    for page_info in window["pages"]:
+        slide = {"page": page_info["page"], "contents": page_info["contents"]}
+        slides.append({
+            "pageNumber": page_info["page"].pageNumber,
+            "slideContainer": render_to_string('album/view-album-slideshow-slide.html',
+                                               RequestContext(request, {"slide": slide}))
+        })
+    return HttpResponse(json.dumps({"slides": slides}), mimetype = "application/json")
+
+
+
+
+def show_slideshow_slides(request, album_id, page_number, how_many):
+    """ 
+        Returns a json representation of the slides of consecutive pages starting from a given page, at most
+        PAGES_PER_BUNDLE_MAX of them. Visibility rules are the same as the ones of view_album_slideshow.
+    """
+    window = Page.window_info(album_id, page_number, min(int(how_many), PAGES_PER_BUNDLE_MAX))
+    myalbum = window["album"]
+    if not myalbum:
+        return HttpResponseNotFound()
+
+    if myalbum.is_hidden_from_user(request.user):
+        response = HttpResponse(status = 403)
+        add_caching_preventing_headers(response)
+        return response
+
+    response = slideshow_slides_response(request, window)
+    if myalbum.isPublic and not myalbum.is_editable_to_user(request.user):
+        add_public_caching_headers(response)
+    else:
+        add_caching_preventing_headers(response)
+    return response
+
+
+
+
+@prevent_all_caching
+def show_slideshow_slides_with_hash(request, album_id, page_number, how_many, secret_hash):
+    """ 
+        Returns a json representation of the slides of consecutive pages of an private album with a secret
+        hash code. Visibility rules are the same as the ones of view_album_slideshow_with_hash.
+    """
+    window = Page.window_info(album_id, page_number, min(int(how_many), PAGES_PER_BUNDLE_MAX), secret_hash)
+    myalbum = window["album"]
+    if not myalbum:
+        return HttpResponseNotFound()
+
+    if myalbum.isPublic or myalbum.is_owned_by(request.user):
+        return HttpResponseRedirect(reverse('show_slideshow_slides',
+                        kwargs = {"album_id":album_id, "page_number":page_number, "how_many":how_many}))
+
+    return slideshow_slides_response(request, window)
+
+
+
+
+LAYOUT_STYLESHEET_MAX_AGE = 365 * 24 * 60 * 60     # seconds
+
+def layout_stylesheet(request, version_hash):
+    """ 
+        Returns the stylesheet compiled from the CSS of all layouts. As its url contains a hash of its
+        content, it can be cached for good. Requests for other versions are redirected to the current one.
+    """
+    if version_hash != LAYOUT_STYLESHEET.version_hash():
+        # the layouts may have been changed in another process, which this one has not noticed yet
+        LAYOUT_STYLESHEET.check_version()
+    if version_hash != LAYOUT_STYLESHEET.version_hash():
+        response = HttpResponseRedirect(url_of_layout_stylesheet())
+        add_caching_preventing_headers(response)
+        return response
+
+    response = HttpResponse(LAYOUT_STYLESHEET.css(), mimetype = "text/css; charset=utf-8")
+    response["Cache-Control"] = "public, max-age=%d" % LAYOUT_STYLESHEET_MAX_AGE
+    return response
 
 
 
@@ -688,18 +923,9 @@ def add_page_POST(request, album_id):
     if not album.is_editable_to_user(request.user):
         return render_to_response('album/edit-access-denied.html', RequestContext(request))
 
-    page_album = album
-    page_pageNumber = album.page_set.count() + 1
     page_layout = form.cleaned_data.get("chcPageLayout")
-
-    new_page = Page(
-        album = page_album,
-        pageNumber = page_pageNumber,
-        layout = page_layout
-    )
-    new_page.save()
-
-    page_page = Page.by_album_id_and_page_number(album_id, page_pageNumber)
+    page_page = album.insert_page(page_layout)
+    page_contents = []
 
     for i in range(1, page_layout.textFieldCount + 1):
         pageContent = PageContent(
@@ -707,14 +933,16 @@ def add_page_POST(request, album_id):
             placeHolderID = page_layout.name + '_caption_%s' % i,
             content = 'Caption %s' % i
         )
-        pageContent.save()
+        page_contents.append(pageContent)
 
     for i in range(1, page_layout.imageFieldCount + 1):
         pageContent = PageContent(
             page = page_page,
             placeHolderID = page_layout.name + '_image_%s' % i
         )
-        pageContent.save()
+        page_contents.append(pageContent)
+
+    page_page.save_contents(page_contents)
 
     userActionLogger.info("User %s created a new page in album \"%s\"." % (request.user.username, album.title))
 
@@ -738,16 +966,12 @@ def edit_page_GET(request, album_id, page_number):
     page = page_resultset[0]
 
     data = {}
-    page_caption_contents = PageContent.objects.filter(page = page,
-                                                       placeHolderID__contains = page.layout.name + '_caption_')
-    for content in page_caption_contents:
-        data["txtCaption_%s" % content.placeHolderID.split("_")[-1]] = content.content
+    for content in page.layout_content(CONTENT_KIND_CAPTION):
+        data["txtCaption_%s" % content.slot] = content.content
 
     file_data = {}
-    page_image_contents = PageContent.objects.filter(page = page,
-                                                     placeHolderID__contains = page.layout.name + '_image_')
-    for content in page_image_contents:
-        file_data["imgUpload_%s" % content.placeHolderID.split("_")[-1]] = content.image
+    for content in page.layout_content(CONTENT_KIND_IMAGE):
+        file_data["imgUpload_%s" % content.slot] = content.image
 
     form = EditPageForm(page, data, file_data)
 
@@ -774,18 +998,13 @@ def edit_page_POST(request, album_id, page_number):
     if not album.is_editable_to_user(request.user):
         return render_to_response('album/edit-access-denied.html', RequestContext(request))
 
-    page_layout = page_page.layout
-    page_captions = PageContent.objects.filter(page = page_page,
-                                               placeHolderID__contains = page_layout.name + '_caption_')
-
-    for content in page_captions:
-        content.content = form.cleaned_data.get("txtCaption_%s" % content.placeHolderID.split("_")[-1])
-        content.save()
+    captions = list(page_page.layout_content(CONTENT_KIND_CAPTION))
+    for content in captions:
+        content.content = form.cleaned_data.get("txtCaption_%s" % content.slot)
+    page_page.save_contents(captions)
 
-    page_image_contents = PageContent.objects.filter(page = page_page,
-                                                     placeHolderID__contains = page_page.layout.name + '_image_')
-    for content in page_image_contents:
-        placeholder_number = unicode(content.placeHolderID.split("_")[-1])
+    for content in page_page.layout_content(CONTENT_KIND_IMAGE):
+        placeholder_number = unicode(content.slot)
         image_is_to_be_cleared = request.POST.get("imgUpload_%s-clear" % placeholder_number)
         sent_image = form.cleaned_data.get("imgUpload_%s" % placeholder_number)
 
@@ -1081,27 +1300,16 @@ def facebook_login(request):
 
 
 
+CACHE_KEY_ALBUM_COUNT_OF_USER = "album_count_of_user_%d"
+
 @login_required
 @prevent_all_caching
 def show_profile(request):
     """ Shows user his/her profile page. """
     albums = Album.ones_owned_by(request.user)
+    (albums, ordering_name) = paginate_albums(request, albums, 10, CACHE_KEY_ALBUM_COUNT_OF_USER % request.user.id)
 
-    paginator = Paginator(albums, 10) # Show 10 albums per page
-
-    # Make sure page request is an int. If not, deliver first page.
-    try:
-      page = int(request.GET.get('page', '1'))
-    except ValueError:
-      page = 1
-
-    # If page request (9999) is out of range, deliver last page of results.
-    try:
-      albums = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-      albums = paginator.page(paginator.num_pages)
-
-    template_parameters = {'albums': albums, "orders":Order.objects.filter(orderer = request.user)}
+    template_parameters = {'albums': albums, 'sort': ordering_name, "orders":Order.objects.filter(orderer = request.user)}
     return render_to_response('accounts/profile.html', RequestContext(request, template_parameters))
 
 
@@ -1187,6 +1395,7 @@ def edit_shopping_cart_POST(request):
     proceed_to_checkout = False
     cart_content_to_remove = []
     cart_content_to_update = {}
+    album_ids_with_invalid_quantity = []
 
     for key in request.POST.keys():
         is_itemcount_update = key.startswith("itemcount.")
@@ -1206,30 +1415,18 @@ def edit_shopping_cart_POST(request):
                 return HttpResponseBadRequest()
 
             id_int = int(id_str)
-            if not Album.does_exist(id_int):
-                missing_album_error_already_given = shopping_cart_report_missing_album(
-                                                        id_int, request.user, missing_album_error_already_given)
-                has_errors = True
-                continue
-
             if is_item_removal:
                 cart_content_to_remove.append(id_int)
                 continue
 
             count_str = request.POST[key]
             if not count_str.isdigit():
-                shopping_cart_report_invalid_quantity(id_int, request.user)
-                has_errors = True
+                album_ids_with_invalid_quantity.append(id_int)
                 continue
 
             new_count = int(count_str)
             if new_count > 99 or new_count < 0:
-                shopping_cart_report_invalid_quantity(id_int, request.user)
-                has_errors = True
-                continue
-
-            if new_count == 0:
-                cart_content_to_remove.append(id_int)
+                album_ids_with_invalid_quantity.append(id_int)
                 continue
 
             cart_content_to_update[id_int] = new_count
@@ -1239,40 +1436,34 @@ def edit_shopping_cart_POST(request):
 
 
     for item_id in cart_content_to_remove:
-        try:
-            del cart_content_to_update[item_id]
-        except KeyError:
-            pass
+        cart_content_to_update[item_id] = 0
 
-        try:
-            ShoppingCartItem.remove(request.user, item_id)
-        except ShoppingCartItem.DoesNotExist:
-            missing_cart_item_error_already_given = shopping_cart_report_missing_cart_item(
-                                                        item_id, request.user, missing_cart_item_error_already_given)
-            has_errors = True
+    result = ShoppingCartItem.update_items_of_user(request.user, cart_content_to_update)
 
+    for item_id in result["missing_album_ids"]:
+        missing_album_error_already_given = shopping_cart_report_missing_album(
+                                                item_id, request.user, missing_album_error_already_given)
+        has_errors = True
 
-    for item_id in cart_content_to_update.keys():
-        try:
-            ShoppingCartItem.update_count(request.user, item_id, cart_content_to_update[item_id])
-        except ShoppingCartItem.DoesNotExist:
-            missing_cart_item_error_already_given = shopping_cart_report_missing_cart_item(
-                                                        item_id, request.user, missing_cart_item_error_already_given)
-            has_errors = True
+    for item_id in result["missing_item_album_ids"]:
+        missing_cart_item_error_already_given = shopping_cart_report_missing_cart_item(
+                                                    item_id, request.user, missing_cart_item_error_already_given)
+        has_errors = True
+
+    if album_ids_with_invalid_quantity:
+        album_titles = dict([(item.album_id, item.album.title) for item in result["items"]])
+        for item_id in album_ids_with_invalid_quantity:
+            shopping_cart_report_invalid_quantity(album_titles.get(item_id, "<missing>"), request.user)
+        has_errors = True
 
 
     if proceed_to_checkout and not has_errors:
-        validation_part = "?v=%s" % ShoppingCartItem.validation_hash_for_shopping_cart(request)
+        validation_part = "?v=%s" % ShoppingCartItem.checkout_token(request.user, CHECKOUT_STEP_DELIVERY_ADDRESSES)
         return HttpResponseRedirect(reverse("get_delivery_addresses") + validation_part)
 
     return HttpResponseRedirect(reverse("edit_shopping_cart"))
 
-def shopping_cart_report_invalid_quantity(item_id, user):
-    item_name = "<missing>"
-    item = Album.by_id(item_id)
-    if item:
-        item_name = item.title
-
+def shopping_cart_report_invalid_quantity(item_name, user):
     user.message_set.create(message = SHOPPING_CART_ERR_MSG_INVALID_QUANTITY_UI % item_name)
 
 def shopping_cart_report_missing_album(item_id, user, error_already_given):
@@ -1300,7 +1491,8 @@ def get_delivery_addresses_GET(request):
     """ Allows user to edit destination addresses for content of his/her shopping cart. """
     assert request.method == "GET"
 
-    if not ShoppingCartItem.is_validation_hash_valid(request):
+    if not ShoppingCartItem.is_checkout_token_valid(request.user, CHECKOUT_STEP_DELIVERY_ADDRESSES,
+                                                    request.GET.get("v")):
         request.user.message_set.create(message = CHECKOUT_ERR_MSG_INVALID_HASH)
         return HttpResponseRedirect(reverse("edit_shopping_cart"))
 
@@ -1339,13 +1531,10 @@ def get_delivery_addresses_POST(request):
         template_parameters = {"form": form}
         return render_to_response('order/addresses.html', RequestContext(request, template_parameters))
 
-    for (item, address) in form.item_address_pairs():
-        item.deliveryAddress = address
-        item.save()
-        #print "%s (%s), %s (%s)" % (unicode(item), unicode(type(item)), unicode(address), unicode(type(address)))
+    ShoppingCartItem.set_delivery_addresses(request.user, form.item_address_pairs())
 
     if request.POST.get("cmdSummary"):
-        validation_part = "?v=%s" % ShoppingCartItem.validation_hash_for_shopping_cart(request, exclude_addresses = False)
+        validation_part = "?v=%s" % ShoppingCartItem.checkout_token(request.user, CHECKOUT_STEP_ORDER_SUMMARY)
         return HttpResponseRedirect(reverse("show_order_summary") + validation_part)
 
     request.user.message_set.create(message = "We are sorry. You tried to perform an action unknown to us.")
@@ -1358,20 +1547,19 @@ def get_delivery_addresses_POST(request):
 
 
 
-ORDER_SUMMARY_EXTRA_VALIDATION_HASH_KEY = "show_order_summary_GET"
-
 @login_required
 @prevent_all_caching
 def show_order_summary_GET(request):
     """ Shows user a summary about his/her order and lets him/her to finally place the order. """
     assert request.method == "GET"
 
-    if not ShoppingCartItem.is_validation_hash_valid(request, exclude_addresses = False):
+    cart_version = ShoppingCartItem.cart_version_of_user(request.user)
+    if not ShoppingCartItem.is_checkout_token_valid(request.user, CHECKOUT_STEP_ORDER_SUMMARY,
+                                                    request.GET.get("v"), cart_version):
         request.user.message_set.create(message = CHECKOUT_ERR_MSG_INVALID_HASH)
         return HttpResponseRedirect(reverse("edit_shopping_cart"))
 
-    validation_hash = ShoppingCartItem.validation_hash_for_shopping_cart(request,
-                        exclude_addresses = False, extra_key = ORDER_SUMMARY_EXTRA_VALIDATION_HASH_KEY)
+    validation_hash = ShoppingCartItem.checkout_token(request.user, CHECKOUT_STEP_PLACE_ORDER, cart_version)
 
     order_info = ShoppingCartItem.order_info_for_user(request.user)
 
@@ -1392,16 +1580,21 @@ def show_order_summary_POST(request):
     """ Creates an order based on the content of user's shopping cart. """
     assert request.method == "POST"
 
-    if not ShoppingCartItem.is_validation_hash_valid(request,
-                    exclude_addresses = False, extra_key = ORDER_SUMMARY_EXTRA_VALIDATION_HASH_KEY):
+    # the order is placed only if the cart still has the version the token was given for
+    cart_version = ShoppingCartItem.cart_version_of_user(request.user)
+    if not ShoppingCartItem.is_checkout_token_valid(request.user, CHECKOUT_STEP_PLACE_ORDER, request.POST.get("v"),
+                                                    cart_version):
         request.user.message_set.create(message = CHECKOUT_ERR_MSG_INVALID_HASH)
         return HttpResponseRedirect(reverse("edit_shopping_cart"))
 
     new_order = None
     try:
-        new_order = Order.create_from_shopping_cart_for_user(request.user)
+        new_order = Order.create_from_shopping_cart_for_user(request.user, cart_version)
     except ShoppingCartEmptyError as e:
         return simple_message(request, "Shopping Cart Is Empty", e.message)
+    except ShoppingCartChangedError:
+        request.user.message_set.create(message = CHECKOUT_ERR_MSG_INVALID_HASH)
+        return HttpResponseRedirect(reverse("edit_shopping_cart"))
 
     return HttpResponseRedirect(reverse("report_order_as_successful", args = [new_order.id]))
 
@@ -1476,17 +1669,15 @@ def report_sps_payment_status_GET(request, status):
 
         new_payment = SPSPayment(
             order = order,
-            amount = order.info().get("order_total_price"),
+            amount = order.total_price(),
             referenceCode = reference,
             clarification = ""
         )
-        new_payment.save()
+        order.record_payment(new_payment)
         paymentLogger.info(u"Simple Payments payment of %s from user %s for order %s received." % \
                            (unicode(new_payment.amount), order.orderer.username, unicode(order.id)))
-        order.status = OrderStatus.paid_and_being_processed()
         commonLogger.info(u"Status of order %s from user %s is updated to be \"%s\"." % \
                              (unicode(order.id), request.user.username, unicode(order.status.code)))
-        order.save()
 
         template_parameters = {"order_info": order.info()}
         return render_to_response('payment/sps/%s.html' % status,
@@ -1552,6 +1743,39 @@ def api_json_get_random_albums(request, how_many):
 
 
 
+@login_required
+def api_json_reorder_pages(request, album_id):
+    """ 
+        Renumbers all pages of an album according to a POSTed comma-separated list of their ids in the
+        new order, e.g. pageIds=12,10,11. Returns a json representation of the new numbers and urls of the
+        pages. Used for reordering pages by dragging and dropping them.
+    """
+    if request.method != "POST":
+        return HttpResponseNotFound()
+
+    album = get_object_or_404(Album, pk = album_id)
+    if not album.is_editable_to_user(request.user):
+        commonLogger.warning(u"User %s attempted to reorder pages of album %s, but is not the owner of the album" %
+                             (request.user.username, album_id))
+        return HttpResponse(status = 403)
+
+    try:
+        page_ids = [int(page_id) for page_id in request.POST.get("pageIds", "").split(",")]
+        album.reorder_pages(page_ids)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    userActionLogger.info("User %s reordered the pages of album \"%s\"." % (request.user.username, album.title))
+
+    pages = [{"id": page.id, "pageNumber": page.pageNumber, "url": page.get_absolute_url()}
+             for page in album.pages().select_related("album")]
+    response = HttpResponse(json.dumps({"pages": pages}), mimetype = "application/json")
+    add_caching_preventing_headers(response)
+    return response
+
+
+
+
 CACHE_KEY_API_JSON_GET_ALBUM_COUNT = "api_json_album_count"
 
 @return_as_json
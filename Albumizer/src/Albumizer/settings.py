@@ -25,6 +25,13 @@ TWITTER_ACCOUNT = "aaltowsd2012s"
 FILE_UPLOAD_PERMISSIONS = 0644
 FILE_UPLOAD_FOLDER_PERMISSIONS = 0711
 
+# default number of worker processes used by the create_albumizer_renditions command to create
+# thumbnails of uploaded images; if less than two, thumbnails are created in the process of the command
+RENDITION_WORKER_PROCESSES = 2
+
+# file of the inverted index used for searching albums; if empty, searching is disabled
+SEARCH_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'search-index.sqlite3').replace('\\', '/')
+
 
 AUTHENTICATION_BACKENDS = (
     #basic username-password authentication backend